@@ -1,26 +1,445 @@
+import os
+
+# Modo do servidor Socket.IO: 'threading' (padrão), 'eventlet' ou 'gevent'. Nos dois últimos
+# a biblioteca padrão precisa ser corrigida (monkey patch) antes de qualquer outro import.
+MODO_ASSINCRONO = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+if MODO_ASSINCRONO == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif MODO_ASSINCRONO == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
 from multiprocessing.pool import MapResult
-from flask import Flask, jsonify, render_template, request, redirect, url_for, flash, send_from_directory
+from flask import Flask, jsonify, render_template, request, redirect, url_for, flash, g, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from sqlalchemy import func
+from sqlalchemy import event, func, text, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from sqlalchemy.pool import Pool
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-import os
+from werkzeug.utils import safe_join, secure_filename, send_file as enviar_arquivo_wsgi
+from collections import Counter, OrderedDict
 from datetime import datetime
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
+from socketio import PubSubManager
+from markupsafe import Markup, escape
+import array
+import atexit
+import click
+import bisect
+import contextlib
+import csv
+import functools
+import hashlib
+import inspect
+import io
+import json
+import multiprocessing
+import queue
 import random
+import re
+import socket
+import sqlite3
+import struct
+import tempfile
+import threading
 import time
+from urllib.parse import urlsplit
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.etree import ElementTree
 import pytz
 
 cuiaba_tz = pytz.timezone('America/Cuiaba')
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'sua_chave_secreta'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.sqlite'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///db.sqlite')
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['ALLOWED_EXTENSIONS'] = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'xlsx', 'docx'}
+app.config['MAX_CONTENT_LENGTH'] = 60 * 1024 * 1024      # limite por requisição (Flask responde 413)
+app.config['TAMANHO_MAXIMO_ARQUIVO'] = 50 * 1024 * 1024  # limite por arquivo enviado
+app.config['COTA_POR_USUARIO'] = 500 * 1024 * 1024       # soma dos arquivos distintos de cada usuário
+# Downloads: None (o Flask envia os bytes), 'x-sendfile' (Apache/lighttpd) ou 'x-accel' (nginx)
+app.config['DOWNLOAD_DESCARGA'] = os.environ.get('DOWNLOAD_DESCARGA') or None
+app.config['DOWNLOAD_PREFIXO_INTERNO'] = '/_uploads/'  # location "internal" do nginx apontando para UPLOAD_FOLDER
+app.config['RANKING_POR_PAGINA'] = 50
+app.config['ARQUIVOS_POR_PAGINA'] = 50
+app.config['BUSCA_RESULTADOS'] = 20
+app.config['PAINEL_CACHE_SEGUNDOS'] = 30  # validade do /api/perfil em cache
+app.config['USUARIOS_CACHE_TAMANHO'] = 5000   # usuários logados mantidos pelo user_loader
+app.config['USUARIOS_CACHE_SEGUNDOS'] = 300   # validade de cada cópia (limita a defasagem entre processos)
+app.config['FRASES_POR_LOTE'] = 10
+app.config['FRASES_LOTE_MAXIMO'] = 50
+app.config['FRASES_VERIFICACAO_SEGUNDOS'] = 5  # intervalo entre conferências da versão da tabela de frases
+# Extração de texto das entregas (.txt, .docx, .xlsx) num pool de processos
+app.config['EXTRACAO_PROCESSOS'] = 2
+# Importação de usuários por CSV: linhas por transação e processos para o hash das senhas
+app.config['IMPORTACAO_LOTE'] = 500
+app.config['IMPORTACAO_PROCESSOS'] = os.cpu_count() or 1
+app.config['EXTRACAO_EM_ANDAMENTO'] = 8       # entregas no pool ao mesmo tempo; as demais esperam no banco
+app.config['EXTRACAO_TENTATIVAS'] = 3
+app.config['EXTRACAO_LIMITE_CARACTERES'] = 500000
+# Similaridade entre entregas (MinHash + LSH)
+app.config['SIMILARIDADE_PERMUTACOES'] = 128
+app.config['SIMILARIDADE_BANDAS'] = 32     # 32 bandas de 4 valores: pares com Jaccard a partir de ~0,4 viram candidatos
+app.config['SIMILARIDADE_SHINGLE'] = 3     # palavras por shingle
+app.config['SIMILARIDADE_LIMIAR'] = 0.5    # similaridade estimada mínima para aparecer no relatório
+# Servidor Socket.IO: com eventlet/gevent o acesso ao banco dos eventos do jogo vai para
+# um pool limitado de threads nativas (o driver do banco bloquearia o loop de eventos)
+app.config['SOCKETIO_ASYNC_MODE'] = MODO_ASSINCRONO
+app.config['BANCO_THREADS'] = int(os.environ.get('BANCO_THREADS', 10))
+# Vários workers: fila que repassa os emits entre processos (redis://, amqp://, kafka://, zmq+tcp://
+# ou local://host:porta para o broker embutido, iniciado com "flask corretor-mensagens")
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+# Quantos workers atendem a aplicação; as salas de corrida vivem na memória de um só
+app.config['WORKERS'] = int(os.environ.get('WORKERS', 1))
+# Corridas em tempo real (salas com vários jogadores)
+app.config['CORRIDA_MAX_JOGADORES'] = 50
+app.config['CORRIDA_FRASES'] = 10      # a mesma sequência para todos os jogadores da sala
+app.config['CORRIDA_DURACAO'] = 180    # segundos até encerrar quem não terminou
+app.config['CORRIDA_CONTAGEM'] = 3     # contagem regressiva antes da largada
+app.config['CORRIDA_TICK'] = 0.2       # intervalo entre snapshots de progresso de cada sala
+# Monitor da turma ao vivo (professores)
+app.config['MONITOR_INTERVALO'] = 1.0        # segundos entre os quadros de diferenças
+app.config['MONITOR_QUADRO_COMPLETO'] = 10   # a cada quantos quadros vai um quadro completo
+app.config['MONITOR_INATIVO'] = 600          # segundos sem eventos até o aluno sair do monitor
+# Limite de eventos Socket.IO (token bucket): evento -> (rajada, fichas por segundo) para cada
+# conexão; cada usuário tem ainda um balde LIMITE_EVENTOS_FATOR_USUARIO vezes maior, somando
+# todas as abas. LIMITE_EVENTOS=0 no ambiente desliga (testes de carga)
+app.config['LIMITE_EVENTOS'] = {
+    'get_phrase': (30, 5),
+    'get_phrases': (5, 0.5),
+    'save_game_results': (3, 0.1),
+    'submit_game': (3, 0.1),
+    'submit_text': (10, 1),
+    'game_progress': (5, 2),
+    'race_create': (3, 0.1),
+    'race_join': (5, 0.5),
+    'race_start': (3, 0.5),
+    'race_progress': (30, 15),
+    'monitor_subscribe': (3, 0.2),
+} if os.environ.get('LIMITE_EVENTOS') != '0' else {}
+app.config['LIMITE_EVENTOS_FATOR_USUARIO'] = 3
+# Gravação adiada (write-behind) dos resultados do jogo
+app.config['GRAVACAO_ADIADA'] = os.environ.get('GRAVACAO_ADIADA') == '1'
+app.config['FILA_GRAVACAO_TAMANHO'] = 1000  # itens na fila antes de voltar à gravação síncrona
+app.config['FILA_GRAVACAO_LOTE'] = 100      # partidas por transação
+app.config['FILA_GRAVACAO_INTERVALO'] = 0.5  # segundos máximos de espera para completar um lote
+app.config['FILA_GRAVACAO_ESPERA_ENCERRAR'] = 10  # segundos para o lote em gravação terminar na saída
+# PRAGMAs aplicados a cada conexão SQLite (vazio desativa)
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,      # ms esperando o lock de escrita antes de falhar
+    'cache_size': -8000,       # negativo = KiB (8 MB); caches maiores deixam varreduras grandes mais lentas
+    'mmap_size': 268435456     # 256 MB
+}
+# Contador de SQL por requisição/evento e detector de N+1
+app.config['SQL_MONITOR'] = os.environ.get('SQL_MONITOR') == '1'
+app.config['SQL_LIMITE_REPETICOES'] = 3          # mesmo comando repetido N vezes = suspeita de N+1
+app.config['SQL_ORCAMENTO_PADRAO'] = None        # máximo de comandos por rota/evento (None = sem limite)
+app.config['SQL_ORCAMENTOS'] = {                 # por endpoint, ou 'socket:<evento>'
+    'perfil': 6,
+    'api_perfil': 5,
+    'socket:get_phrase': 1,
+    'socket:get_phrases': 1,
+}
+app.config['SQL_FALHAR_ACIMA_DO_ORCAMENTO'] = False  # True nos testes: estourar o orçamento gera erro
+# Token para o Prometheus ler /metrics (Authorization: Bearer <token>); professores logados também podem ver
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+class SocketIOObservado(SocketIO):
+    """SocketIO que executa cada handler dentro dos observadores de evento.
+
+    Os observadores (``observadores_evento``) são funções que recebem o nome do
+    evento e devolvem um context manager; servem para medir SQL, tempo etc.
+    sem repetir código em cada ``@socketio.on``. Antes deles passam os filtros
+    (``filtros_evento``): se algum devolver False, o handler não é executado.
+    """
+
+    def on(self, message, namespace=None):
+        registrar = super().on(message, namespace)
+
+        def decorator(handler):
+            parametros = inspect.signature(handler).parameters.values()
+            if any(p.kind == p.VAR_POSITIONAL for p in parametros):
+                maximo_args = None
+            else:
+                maximo_args = len(parametros)
+
+            @functools.wraps(handler)
+            def observado(*args):
+                # O Flask-SocketIO passa 'auth' ao connect; descartamos o que o handler não aceita
+                if maximo_args is not None:
+                    args = args[:maximo_args]
+                if not all(filtro(message) for filtro in filtros_evento):
+                    return None
+                with contextlib.ExitStack() as pilha:
+                    for observador in observadores_evento:
+                        pilha.enter_context(observador(message))
+                    return handler(*args)
+
+            registrar(observado)
+            return handler
+        return decorator
+
+observadores_evento = []
+filtros_evento = []
 
 db = SQLAlchemy(app)
-socketio = SocketIO(app)
+
+@event.listens_for(Engine, 'connect')
+def aplicar_pragmas_sqlite(conexao, _registro):
+    if not isinstance(conexao, sqlite3.Connection):
+        return
+    cursor = conexao.cursor()
+    for nome, valor in (app.config.get('SQLITE_PRAGMAS') or {}).items():
+        cursor.execute(f'PRAGMA {nome}={valor}')
+    cursor.close()
+
+# Fila de mensagens entre workers do Socket.IO
+def _enviar_quadro(sock, dados):
+    sock.sendall(struct.pack('!I', len(dados)) + dados)
+
+def _receber(sock, tamanho, ativo):
+    dados = b''
+    while len(dados) < tamanho:
+        try:
+            parte = sock.recv(tamanho - len(dados))
+        except socket.timeout:
+            if ativo():
+                continue
+            raise EOFError('processo encerrando')
+        if not parte:
+            raise EOFError('conexão encerrada')
+        dados += parte
+    return dados
+
+def _receber_quadro(sock, ativo=lambda: True):
+    """Lê um quadro (tamanho em 4 bytes + conteúdo); com timeout no socket, ``ativo`` decide se continua."""
+    tamanho, = struct.unpack('!I', _receber(sock, 4, ativo))
+    return _receber(sock, tamanho, ativo)
+
+class CorretorMensagens:
+    """Broker de publish/subscribe mínimo para rodar vários workers sem Redis.
+
+    Cada worker abre duas conexões TCP, uma para publicar e outra para assinar
+    um canal. O que chega num canal é repassado a todos os assinantes dele,
+    inclusive ao worker que publicou (como no Redis, que é o que o
+    PubSubManager do python-socketio espera). Cada assinante tem uma fila
+    limitada e uma thread de envio; quem não acompanha o ritmo é desconectado
+    e reconecta sozinho.
+    """
+
+    TAMANHO_FILA = 10000
+
+    def __init__(self, host='127.0.0.1', porta=5600):
+        self.endereco = (host, porta)
+        self._lock = threading.Lock()
+        self._assinantes = {}  # canal -> {socket: fila}
+        self._servidor = None
+
+    def escutar(self):
+        """Abre a porta (0 escolhe uma livre) e retorna o endereço efetivo."""
+        self._servidor = socket.create_server(self.endereco)
+        self.endereco = self._servidor.getsockname()[:2]
+        return self.endereco
+
+    def executar(self):
+        if self._servidor is None:
+            self.escutar()
+        while True:
+            try:
+                sock, _ = self._servidor.accept()
+            except OSError:
+                return  # encerrar() fechou o socket
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._atender, args=(sock,), daemon=True).start()
+
+    def encerrar(self):
+        if self._servidor is not None:
+            self._servidor.close()
+
+    def _atender(self, sock):
+        canal, fila = None, None
+        try:
+            saudacao = json.loads(_receber_quadro(sock))
+            canal = saudacao['canal']
+            if saudacao['papel'] == 'assinar':
+                fila = queue.Queue(maxsize=self.TAMANHO_FILA)
+                with self._lock:
+                    self._assinantes.setdefault(canal, {})[sock] = fila
+                while True:
+                    _enviar_quadro(sock, fila.get())
+            else:
+                while True:
+                    self._repassar(canal, _receber_quadro(sock))
+        except (OSError, EOFError, ValueError, KeyError):
+            pass
+        finally:
+            if fila is not None:
+                with self._lock:
+                    self._assinantes.get(canal, {}).pop(sock, None)
+            sock.close()
+
+    def _repassar(self, canal, quadro):
+        with self._lock:
+            assinantes = list(self._assinantes.get(canal, {}).items())
+        for sock, fila in assinantes:
+            try:
+                fila.put_nowait(quadro)
+            except queue.Full:
+                with self._lock:
+                    self._assinantes.get(canal, {}).pop(sock, None)
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+class FilaMensagensLocal(PubSubManager):
+    """Gerenciador de clientes do python-socketio que usa o CorretorMensagens.
+
+    URL no formato ``local://host:porta``. As mensagens trafegam em JSON (o
+    mesmo que o navegador recebe), nunca em pickle. Assim como no Redis, o que
+    for publicado enquanto um worker estiver desconectado do broker se perde.
+    """
+
+    name = 'local'
+
+    def __init__(self, url, channel='flask-socketio', write_only=False, logger=None):
+        partes = urlsplit(url)
+        self.endereco = (partes.hostname or '127.0.0.1', partes.port or 5600)
+        self._publicador = None
+        self._lock_publicar = threading.Lock()
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _conectar(self, papel):
+        sock = socket.create_connection(self.endereco, timeout=5)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        _enviar_quadro(sock, json.dumps({'papel': papel, 'canal': self.channel}).encode())
+        return sock
+
+    def _publish(self, data):
+        quadro = json.dumps(data).encode()
+        with self._lock_publicar:
+            for tentativa in range(2):
+                try:
+                    if self._publicador is None:
+                        self._publicador = self._conectar('publicar')
+                    _enviar_quadro(self._publicador, quadro)
+                    return
+                except OSError:
+                    if self._publicador is not None:
+                        self._publicador.close()
+                        self._publicador = None
+                    if tentativa:
+                        raise
+
+    def _listen(self):
+        # O timeout deixa a thread conferir se o processo está terminando
+        ativo = threading.main_thread().is_alive
+        while ativo():
+            try:
+                sock = self._conectar('assinar')
+            except OSError as e:
+                self._get_logger().error(f'Broker de mensagens indisponível: {e}')
+                time.sleep(1)
+                continue
+            sock.settimeout(1)
+            try:
+                while True:
+                    yield _receber_quadro(sock, ativo).decode('utf-8')
+            except (OSError, EOFError):
+                pass
+            finally:
+                sock.close()
+
+fila_mensagens = app.config['SOCKETIO_MESSAGE_QUEUE']
+if fila_mensagens and fila_mensagens.startswith('local://'):
+    socketio = SocketIOObservado(app, async_mode=app.config['SOCKETIO_ASYNC_MODE'],
+                                 client_manager=FilaMensagensLocal(fila_mensagens))
+else:
+    socketio = SocketIOObservado(app, async_mode=app.config['SOCKETIO_ASYNC_MODE'],
+                                 message_queue=fila_mensagens)
+
+def lock_nativo():
+    """Lock do sistema operacional, mesmo com a biblioteca padrão corrigida.
+
+    Um lock verde (eventlet/gevent) disputado a partir de uma thread nativa do
+    ExecutorBanco derruba o hub; os locks que essas threads usam vêm daqui.
+    """
+    if MODO_ASSINCRONO == 'eventlet':
+        return eventlet.patcher.original('_thread').allocate_lock()
+    if MODO_ASSINCRONO == 'gevent':
+        return monkey.get_original('_thread', 'allocate_lock')()
+    return threading.Lock()
+
+def contexto_processos():
+    """Contexto para os pools de processos, sem fork do servidor.
+
+    Um fork de um processo com várias threads (ou com a biblioteca padrão
+    corrigida pelo eventlet/gevent) pode herdar um lock travado e deixar o
+    filho parado para sempre; com forkserver (spawn no Windows) os filhos
+    partem de um processo limpo.
+    """
+    metodo = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(metodo)
+
+class ExecutorBanco:
+    """Executa o acesso ao banco dos eventos Socket.IO sem travar o servidor.
+
+    No modo 'threading' cada evento já tem a sua thread e a função é chamada
+    direto (também com ``threads=0``, que desliga o pool). Com eventlet/gevent
+    o sqlite3 (ou outro driver em C) bloquearia o processo inteiro, então a
+    função roda num pool limitado de threads nativas
+    (``eventlet.tpool`` ou o threadpool do hub do gevent) e só o greenlet do
+    evento espera o resultado. Lá ela tem um app context e uma sessão próprios
+    e herda o monitor de SQL do evento.
+
+    A função não deve mexer em estado do greenlet (``request``, ``current_user``,
+    filas e locks verdes): quem chama lê esses valores antes e passa como argumento.
+    """
+
+    def __init__(self, modo, threads):
+        self.modo = modo
+        self.threads = threads
+        self._executar = None
+
+    def _pool(self):
+        if self._executar is None:
+            if self.modo == 'eventlet':
+                from eventlet import tpool
+                tpool.set_num_threads(self.threads)
+                self._executar = tpool.execute
+            else:
+                from gevent import get_hub
+                threadpool = get_hub().threadpool
+                threadpool.maxsize = self.threads
+                self._executar = threadpool.apply
+        return self._executar
+
+    def executar(self, funcao, *args):
+        if self.modo == 'threading' or not self.threads:
+            return funcao(*args)
+        monitor = getattr(_sql_local, 'monitor', None)
+        return self._pool()(self._na_thread, monitor, funcao, args)
+
+    @staticmethod
+    def _na_thread(monitor, funcao, args):
+        _sql_local.monitor = monitor
+        with app.app_context():
+            try:
+                return funcao(*args)
+            finally:
+                db.session.remove()
+                _sql_local.monitor = None
+
+executor_banco = ExecutorBanco(app.config['SOCKETIO_ASYNC_MODE'], app.config['BANCO_THREADS'])
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'  # Especifica a rota de login
 login_manager.login_message = "Por favor, faça login para acessar esta página."
@@ -43,6 +462,10 @@ class User(UserMixin, db.Model):
                             secondary='equipe_membros',
                             backref=db.backref('equipe_membros', lazy=True))
 class Arquivo(db.Model):
+    __table_args__ = (
+        db.Index('ix_arquivo_upload_date_id', 'upload_date', 'id'),
+        db.Index('ix_arquivo_user_id_upload_date_id', 'user_id', 'upload_date', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(100))
     path = db.Column(db.String(200))
@@ -50,10 +473,12 @@ class Arquivo(db.Model):
     upload_date = db.Column(db.DateTime, default=lambda: datetime.now(cuiaba_tz)) 
     is_link = db.Column(db.Boolean, default=False)
     description = db.Column(db.String(200)) 
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 do conteúdo (chave no armazenamento)
+    size = db.Column(db.Integer)  # em bytes
 
 class Desempenho(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     wpm = db.Column(db.Float)
     accuracy = db.Column(db.Float)
     difficulty = db.Column(db.Integer)
@@ -64,14 +489,14 @@ class Desempenho(db.Model):
 class FraseDigitação(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     texto = db.Column(db.String(500), nullable=False)
-    nivel_dificuldade = db.Column(db.Integer, nullable=False)  # 1-4
+    nivel_dificuldade = db.Column(db.Integer, nullable=False, index=True)  # 1-4
     criado_por = db.Column(db.Integer, db.ForeignKey('user.id'))
     data_criacao = db.Column(db.DateTime, default=lambda: datetime.now(cuiaba_tz))
 
 class Nota(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    professor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    professor_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     valor = db.Column(db.Float)
     descricao = db.Column(db.String(200))
     data = db.Column(db.DateTime, default=lambda: datetime.now(cuiaba_tz))
@@ -79,6 +504,7 @@ class Nota(db.Model):
     professor = db.relationship('User', foreign_keys=[professor_id], backref=db.backref('notas_dadas', lazy=True))
 
 class GameResult(db.Model):
+    __table_args__ = (db.Index('ix_game_result_user_id_date_played', 'user_id', 'date_played'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     difficulty = db.Column(db.Integer, nullable=False)
@@ -89,12 +515,59 @@ class GameResult(db.Model):
     score = db.Column(db.Integer, nullable=False)
     time_played = db.Column(db.Integer, nullable=False)  # em segundos
     date_played = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(cuiaba_tz))
+    corrida_id = db.Column(db.Integer, db.ForeignKey('corrida.id'), index=True)  # None no jogo individual
+    posicao = db.Column(db.Integer)  # classificação final na corrida
     
     user = db.relationship('User', backref=db.backref('game_results', lazy=True))
 
+class Corrida(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    codigo = db.Column(db.String(8), nullable=False)
+    criado_por = db.Column(db.Integer, db.ForeignKey('user.id'))
+    dificuldade = db.Column(db.Integer, nullable=False)
+    jogadores = db.Column(db.Integer, nullable=False)
+    data_inicio = db.Column(db.DateTime)
+    data_fim = db.Column(db.DateTime)
+
+# Resumo por usuário mantido a cada partida salva (leitura O(1) nas telas de estatística)
+class UserStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    games_played = db.Column(db.Integer, nullable=False, default=0)
+    accuracy_sum = db.Column(db.Float, nullable=False, default=0)
+    time_played = db.Column(db.Integer, nullable=False, default=0)  # em segundos
+    best_wpm = db.Column(db.Float, nullable=False, default=0)
+    best_wpm_1 = db.Column(db.Float, nullable=False, default=0)
+    best_wpm_2 = db.Column(db.Float, nullable=False, default=0)
+    best_wpm_3 = db.Column(db.Float, nullable=False, default=0)
+    best_wpm_4 = db.Column(db.Float, nullable=False, default=0)
+    last_played = db.Column(db.DateTime)
+    # Precisão, dificuldade e data da partida com o melhor WPM (geral e por dificuldade), para o ranking
+    best_accuracy = db.Column(db.Float)
+    best_difficulty = db.Column(db.Integer)
+    best_date = db.Column(db.DateTime)
+    best_accuracy_1 = db.Column(db.Float)
+    best_accuracy_2 = db.Column(db.Float)
+    best_accuracy_3 = db.Column(db.Float)
+    best_accuracy_4 = db.Column(db.Float)
+    best_date_1 = db.Column(db.DateTime)
+    best_date_2 = db.Column(db.DateTime)
+    best_date_3 = db.Column(db.DateTime)
+    best_date_4 = db.Column(db.DateTime)
+
+    user = db.relationship('User', backref=db.backref('stats', uselist=False, lazy=True))
+
+    @property
+    def average_accuracy(self):
+        if not self.games_played:
+            return 0
+        return self.accuracy_sum / self.games_played
+
+    def best_wpm_for(self, difficulty):
+        return getattr(self, f'best_wpm_{difficulty}', 0)
+
 class Aluno(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     ativo = db.Column(db.Boolean, default=True)
     user = db.relationship('User', backref=db.backref('aluno_info', lazy=True))
 
@@ -141,6 +614,7 @@ class Trabalho(db.Model):
     equipes = db.relationship('Equipe', secondary=equipe_trabalho, back_populates='trabalhos')
 
 class Entrega(db.Model):
+    __table_args__ = (db.Index('ix_entrega_trabalho_id_equipe_id', 'trabalho_id', 'equipe_id'),)
     id = db.Column(db.Integer, primary_key=True)
     trabalho_id = db.Column(db.Integer, db.ForeignKey('trabalho.id'), nullable=False)
     equipe_id = db.Column(db.Integer, db.ForeignKey('equipe.id'), nullable=False)
@@ -149,11 +623,40 @@ class Entrega(db.Model):
     arquivo_id = db.Column(db.Integer, db.ForeignKey('arquivo.id'))
     nota = db.Column(db.Float)  # Adicione este campo
     feedback = db.Column(db.Text)  # Adicione este campo
+    status_extracao = db.Column(db.String(20))  # None, 'pendente', 'concluido' ou 'erro'
+    tentativas_extracao = db.Column(db.Integer, default=0)
     
     trabalho = db.relationship('Trabalho', backref=db.backref('entregas', lazy=True))
     equipe = db.relationship('Equipe', backref=db.backref('entregas', lazy=True))
     arquivo = db.relationship('Arquivo')
 
+class TextoEntrega(db.Model):
+    """Texto extraído do arquivo de uma entrega, guardado comprimido (zlib)."""
+    entrega_id = db.Column(db.Integer, db.ForeignKey('entrega.id'), primary_key=True)
+    dados = db.Column(db.LargeBinary, nullable=False)
+    caracteres = db.Column(db.Integer, nullable=False)
+    data_extracao = db.Column(db.DateTime, default=lambda: datetime.now(cuiaba_tz))
+    assinatura = db.Column(db.LargeBinary)  # MinHash (array de uint64); None se o texto for curto demais
+
+    entrega = db.relationship('Entrega', backref=db.backref('texto_extraido', uselist=False,
+                                                            cascade='all, delete-orphan'))
+
+    @property
+    def texto(self):
+        return zlib.decompress(self.dados).decode('utf-8')
+
+    @texto.setter
+    def texto(self, valor):
+        self.dados = zlib.compress(valor.encode('utf-8'), 6)
+        self.caracteres = len(valor)
+
+class BandaSimilaridade(db.Model):
+    """Balde LSH de uma entrega: entregas com o mesmo (banda, valor) são candidatas a plágio."""
+    __table_args__ = (db.Index('ix_banda_similaridade_banda_valor', 'banda', 'valor'),)
+    entrega_id = db.Column(db.Integer, db.ForeignKey('entrega.id'), primary_key=True)
+    banda = db.Column(db.Integer, primary_key=True)
+    valor = db.Column(db.BigInteger, nullable=False)
+
 class Avaliacao(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     entrega_id = db.Column(db.Integer, db.ForeignKey('entrega.id'), nullable=False)
@@ -165,14 +668,665 @@ class Avaliacao(db.Model):
     entrega = db.relationship('Entrega', backref=db.backref('avaliacoes', lazy=True))
     professor = db.relationship('User', backref=db.backref('avaliacoes_feitas', lazy=True))
 
+# Monitor de SQL por requisição HTTP e por evento Socket.IO
+class OrcamentoSQLExcedido(Exception):
+    pass
+
+class MonitorSQL:
+    """Acumula os comandos SQL executados durante uma requisição ou evento."""
+
+    def __init__(self, origem):
+        self.origem = origem
+        self.consultas = 0
+        self.tempo = 0.0
+        self.comandos = Counter()
+
+    def registrar(self, comando, duracao):
+        self.consultas += 1
+        self.tempo += duracao
+        self.comandos[comando] += 1
+
+    def repetidos(self):
+        limite = app.config['SQL_LIMITE_REPETICOES']
+        return [(comando, vezes) for comando, vezes in self.comandos.most_common() if vezes >= limite]
+
+    def orcamento(self):
+        return app.config['SQL_ORCAMENTOS'].get(self.origem, app.config['SQL_ORCAMENTO_PADRAO'])
+
+    def finalizar(self):
+        """Registra a linha de log e, se configurado, falha ao estourar o orçamento."""
+        repetidos = self.repetidos()
+        orcamento = self.orcamento()
+        excedeu = orcamento is not None and self.consultas > orcamento
+        registro = {
+            'sql_origem': self.origem,
+            'consultas': self.consultas,
+            'tempo_ms': round(self.tempo * 1000, 2),
+            'orcamento': orcamento,
+            'n_mais_1': [{'sql': comando[:200], 'vezes': vezes} for comando, vezes in repetidos]
+        }
+        if repetidos or excedeu:
+            app.logger.warning(json.dumps(registro, ensure_ascii=False))
+        else:
+            app.logger.info(json.dumps(registro, ensure_ascii=False))
+        if excedeu and app.config['SQL_FALHAR_ACIMA_DO_ORCAMENTO']:
+            raise OrcamentoSQLExcedido(
+                f'{self.origem} executou {self.consultas} comandos SQL (orçamento: {orcamento})')
+
+_sql_local = threading.local()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_do_sql(conexao, cursor, comando, parametros, contexto, executemany):
+    if getattr(_sql_local, 'monitor', None) is not None:
+        conexao.info.setdefault('inicio_sql', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _depois_do_sql(conexao, cursor, comando, parametros, contexto, executemany):
+    monitor = getattr(_sql_local, 'monitor', None)
+    inicios = conexao.info.get('inicio_sql')
+    if monitor is not None and inicios:
+        monitor.registrar(comando, time.perf_counter() - inicios.pop())
+
+@contextlib.contextmanager
+def monitorar_sql(origem):
+    if not app.config['SQL_MONITOR']:
+        yield None
+        return
+    anterior = getattr(_sql_local, 'monitor', None)
+    monitor = _sql_local.monitor = MonitorSQL(origem)
+    try:
+        yield monitor
+    finally:
+        _sql_local.monitor = anterior
+    monitor.finalizar()
+
+observadores_evento.append(lambda evento: monitorar_sql(f'socket:{evento}'))
+
+@app.before_request
+def iniciar_monitor_sql():
+    if app.config['SQL_MONITOR']:
+        g.monitor_sql = _sql_local.monitor = MonitorSQL(request.endpoint)
+
+@app.after_request
+def finalizar_monitor_sql(resposta):
+    monitor = g.pop('monitor_sql', None)
+    if monitor is not None:
+        _sql_local.monitor = None
+        resposta.headers['X-SQL-Consultas'] = str(monitor.consultas)
+        resposta.headers['X-SQL-Tempo-ms'] = f'{monitor.tempo * 1000:.2f}'
+        monitor.finalizar()
+    return resposta
+
+@app.teardown_request
+def limpar_monitor_sql(_erro):
+    _sql_local.monitor = None
+
+# Métricas no formato do Prometheus
+class MetricasFragmentadas:
+    """Contadores e histogramas agregados sem lock no caminho da requisição.
+
+    As séries ficam num número fixo de fragmentos (dicionários), escolhidos
+    por um hash do id da thread ou greenlet. Cada série é uma lista de números
+    alocada uma única vez, então registrar uma métrica não aloca nem trava
+    nada; a leitura em /metrics soma os fragmentos. Duas threads que caem no
+    mesmo fragmento podem, raramente, perder um incremento numa troca de
+    contexto no meio do ``+=`` — aceitável para métricas.
+    """
+
+    LIMITES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    BITS_FRAGMENTOS = 6  # 64 fragmentos
+
+    def __init__(self):
+        self._fragmentos = [{} for _ in range(1 << self.BITS_FRAGMENTOS)]
+
+    def _dados(self):
+        # Hash de Fibonacci: os ids são endereços alinhados, os bits baixos quase não variam
+        ident = threading.get_ident()
+        indice = ((ident * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> (64 - self.BITS_FRAGMENTOS)
+        return self._fragmentos[indice]
+
+    @staticmethod
+    def _somar_em(destino, dados):
+        for chave, valores in list(dados.items()):
+            atual = destino.get(chave)
+            if atual is None:
+                destino[chave] = list(valores)
+            else:
+                for i, valor in enumerate(valores):
+                    atual[i] += valor
+
+    def incrementar(self, nome, rotulos, valor=1):
+        dados = self._dados()
+        serie = dados.get((nome, rotulos))
+        if serie is None:
+            serie = dados.setdefault((nome, rotulos), [0])
+        serie[0] += valor
+
+    def observar(self, nome, rotulos, segundos):
+        dados = self._dados()
+        serie = dados.get((nome, rotulos))
+        if serie is None:
+            # um contador por faixa (a última é +Inf) e a soma dos tempos
+            serie = dados.setdefault((nome, rotulos), [0] * (len(self.LIMITES) + 1) + [0.0])
+        serie[bisect.bisect_left(self.LIMITES, segundos)] += 1
+        serie[-1] += segundos
+
+    def agregado(self):
+        total = {}
+        for dados in self._fragmentos:
+            self._somar_em(total, dados)
+        return total
+
+metricas = MetricasFragmentadas()
+
+# nome -> (tipo, ajuda, nomes dos rótulos)
+DEFINICOES_METRICAS = {
+    'digitacao_http_request_duration_seconds': ('histogram', 'Latência das rotas Flask', ('endpoint', 'method')),
+    'digitacao_http_requests_total': ('counter', 'Requisições HTTP por status', ('endpoint', 'method', 'status')),
+    'digitacao_socketio_event_duration_seconds': ('histogram', 'Latência dos handlers Socket.IO', ('event',)),
+    'digitacao_socketio_event_errors_total': ('counter', 'Handlers Socket.IO que lançaram exceção', ('event',)),
+    'digitacao_socketio_connected_clients': ('gauge', 'Clientes Socket.IO conectados', ()),
+    'digitacao_db_connections_open': ('gauge', 'Conexões com o banco abertas', ()),
+    'digitacao_db_connections_in_use': ('gauge', 'Conexões com o banco em uso (checkout do pool)', ()),
+    'digitacao_user_cache_total': ('counter', 'Consultas ao cache do user_loader', ('resultado',)),
+    'digitacao_race_tick_duration_seconds': ('histogram', 'Tempo de cada tick das corridas', ()),
+    'digitacao_socketio_events_rejected_total': ('counter', 'Eventos Socket.IO recusados pelo limite',
+                                                 ('event', 'scope')),
+}
+
+def _rotulos_prometheus(nomes, valores, extra=''):
+    pares = []
+    for nome, valor in zip(nomes, valores):
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pares.append(f'{nome}="{valor}"')
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+def gerar_metricas_prometheus():
+    agregado = metricas.agregado()
+    series = {}
+    for (nome, rotulos), valores in agregado.items():
+        series.setdefault(nome, []).append((rotulos, valores))
+
+    linhas = []
+    for nome, (tipo, ajuda, nomes_rotulos) in DEFINICOES_METRICAS.items():
+        linhas.append(f'# HELP {nome} {ajuda}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        for rotulos, valores in sorted(series.get(nome, []), key=lambda serie: serie[0]):
+            if tipo == 'histogram':
+                acumulado = 0
+                for limite, quantidade in zip(MetricasFragmentadas.LIMITES + ('+Inf',), valores[:-1]):
+                    acumulado += quantidade
+                    le = _rotulos_prometheus(nomes_rotulos, rotulos, f'le="{limite}"')
+                    linhas.append(f'{nome}_bucket{le} {acumulado}')
+                linhas.append(f'{nome}_sum{_rotulos_prometheus(nomes_rotulos, rotulos)} {valores[-1]:.6f}')
+                linhas.append(f'{nome}_count{_rotulos_prometheus(nomes_rotulos, rotulos)} {acumulado}')
+            else:
+                linhas.append(f'{nome}{_rotulos_prometheus(nomes_rotulos, rotulos)} {valores[0]}')
+    return '\n'.join(linhas) + '\n'
+
+@app.before_request
+def iniciar_cronometro():
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def registrar_metricas_http(resposta):
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None:
+        rotulos = (request.endpoint or 'desconhecido', request.method)
+        metricas.observar('digitacao_http_request_duration_seconds', rotulos, time.perf_counter() - inicio)
+        metricas.incrementar('digitacao_http_requests_total', rotulos + (str(resposta.status_code),))
+    return resposta
+
+@contextlib.contextmanager
+def medir_evento(evento):
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metricas.incrementar('digitacao_socketio_event_errors_total', (evento,))
+        raise
+    finally:
+        metricas.observar('digitacao_socketio_event_duration_seconds', (evento,), time.perf_counter() - inicio)
+        if evento == 'connect':
+            metricas.incrementar('digitacao_socketio_connected_clients', ())
+        elif evento == 'disconnect':
+            metricas.incrementar('digitacao_socketio_connected_clients', (), -1)
+
+observadores_evento.append(medir_evento)
+
+class LimitadorEventos:
+    """Token bucket por conexão e por usuário, separado por evento.
+
+    Cada conexão guarda só ``[fichas, último abastecimento]`` por evento
+    limitado, então a memória por sid é constante; as fichas são repostas sob
+    demanda, pelo tempo decorrido, sem tarefa de fundo. O balde do usuário
+    soma todas as abas dele e sobrevive a reconexões até ficar cheio de novo
+    (quem fecha e reabre a aba não ganha fichas à toa).
+    """
+
+    def __init__(self, fator_usuario):
+        self.fator_usuario = fator_usuario
+        self._sids = {}      # sid -> (user_id, {evento: [fichas, último]})
+        self._usuarios = {}  # user_id -> [conexões, momento da última saída, {evento: [fichas, último]}]
+        self._lock = threading.Lock()
+        self._ultima_limpeza = time.monotonic()
+
+    @staticmethod
+    def _retirar(baldes, evento, capacidade, por_segundo, agora):
+        """Tira uma ficha; devolve 0 se conseguiu ou os segundos até a próxima."""
+        balde = baldes.get(evento)
+        if balde is None:
+            balde = baldes[evento] = [capacidade, agora]
+        fichas = min(capacidade, balde[0] + (agora - balde[1]) * por_segundo)
+        balde[1] = agora
+        if fichas >= 1:
+            balde[0] = fichas - 1
+            return 0
+        balde[0] = fichas
+        return (1 - fichas) / por_segundo
+
+    def permitir(self, evento, limite, sid, user_id):
+        """None se o evento pode seguir; senão (escopo, segundos até a próxima ficha)."""
+        capacidade, por_segundo = limite
+        agora = time.monotonic()
+        with self._lock:
+            conexao = self._sids.get(sid)
+            if conexao is None:
+                conexao = self._sids[sid] = (user_id, {})
+                if user_id is not None:
+                    usuario = self._usuarios.setdefault(user_id, [0, agora, {}])
+                    usuario[0] += 1
+            espera = self._retirar(conexao[1], evento, capacidade, por_segundo, agora)
+            if espera:
+                return ('conexao', espera)
+            usuario = self._usuarios.get(conexao[0])
+            if usuario is not None:
+                fator = self.fator_usuario
+                espera = self._retirar(usuario[2], evento, capacidade * fator, por_segundo * fator, agora)
+                if espera:
+                    conexao[1][evento][0] += 1  # a ficha da conexão não foi usada
+                    return ('usuario', espera)
+        return None
+
+    def devolver(self, evento, limite, sid):
+        """Devolve a ficha de um evento que acabou não custando nada (ex.: reenvio duplicado)."""
+        capacidade, _ = limite
+        with self._lock:
+            user_id, baldes = self._sids.get(sid, (None, {}))
+            usuario = self._usuarios.get(user_id)
+            for balde, maximo in ((baldes.get(evento), capacidade),
+                                  (usuario[2].get(evento) if usuario else None, capacidade * self.fator_usuario)):
+                if balde is not None:
+                    balde[0] = min(balde[0] + 1, maximo)
+
+    def desconectar(self, sid, retencao):
+        agora = time.monotonic()
+        with self._lock:
+            user_id, _ = self._sids.pop(sid, (None, None))
+            usuario = self._usuarios.get(user_id)
+            if usuario is not None:
+                usuario[0] -= 1
+                usuario[1] = agora
+            if agora - self._ultima_limpeza > 60:
+                # Usuários sem conexão há mais tempo do que um balde leva para encher
+                self._ultima_limpeza = agora
+                for user_id in [u for u, (conexoes, saida, _) in self._usuarios.items()
+                                if conexoes <= 0 and agora - saida > retencao]:
+                    del self._usuarios[user_id]
+
+limitador_eventos = LimitadorEventos(app.config['LIMITE_EVENTOS_FATOR_USUARIO'])
+
+def limitar_evento(evento):
+    limite = app.config['LIMITE_EVENTOS'].get(evento)
+    if limite is None:
+        return True
+    user_id = current_user.id if current_user.is_authenticated else None
+    recusa = limitador_eventos.permitir(evento, limite, request.sid, user_id)
+    if recusa is None:
+        return True
+    escopo, espera = recusa
+    metricas.incrementar('digitacao_socketio_events_rejected_total', (evento, escopo))
+    emit('rate_limited', {'event': evento, 'retry_after': round(espera, 2)})
+    return False
+
+filtros_evento.append(limitar_evento)
+
+def devolver_ficha(evento):
+    limite = app.config['LIMITE_EVENTOS'].get(evento)
+    if limite is not None:
+        limitador_eventos.devolver(evento, limite, request.sid)
+
+@event.listens_for(Pool, 'connect')
+def _conexao_aberta(_conexao, _registro):
+    metricas.incrementar('digitacao_db_connections_open', ())
+
+@event.listens_for(Pool, 'close')
+def _conexao_fechada(_conexao, _registro):
+    metricas.incrementar('digitacao_db_connections_open', (), -1)
+
+@event.listens_for(Pool, 'checkout')
+def _conexao_em_uso(_conexao, _registro, _proxy):
+    metricas.incrementar('digitacao_db_connections_in_use', ())
+
+@event.listens_for(Pool, 'checkin')
+def _conexao_devolvida(_conexao, _registro):
+    metricas.incrementar('digitacao_db_connections_in_use', (), -1)
+
+def _sql_contador_alteracoes(tabela):
+    """Linha em versao_tabela que os triggers incrementam a cada INSERT, UPDATE ou DELETE."""
+    incrementar = f"UPDATE versao_tabela SET versao = versao + 1 WHERE tabela = '{tabela}';"
+    return [
+        'CREATE TABLE IF NOT EXISTS versao_tabela (tabela VARCHAR(64) PRIMARY KEY, versao INTEGER NOT NULL)',
+        f"INSERT OR IGNORE INTO versao_tabela (tabela, versao) VALUES ('{tabela}', 0)",
+    ] + [
+        f'CREATE TRIGGER IF NOT EXISTS "versao_{tabela}_{sufixo}" AFTER {operacao} ON "{tabela}" '
+        f'BEGIN {incrementar} END'
+        for sufixo, operacao in (('ai', 'INSERT'), ('au', 'UPDATE'), ('ad', 'DELETE'))
+    ]
+
+class IndiceFrases:
+    """Índice em memória das frases de digitação.
+
+    Para cada dificuldade guarda os textos ordenados pelo número de palavras e
+    uma tabela ``primeira[n]`` com a posição da primeira frase que tem pelo
+    menos ``n`` palavras. Assim qualquer faixa de palavras vira uma fatia
+    contígua e o sorteio é O(1), sem ORDER BY random() no banco.
+    O índice é recarregado preguiçosamente depois de ``invalidar()`` ou
+    quando a versão da tabela (o contador de alterações em versao_tabela,
+    mantido por triggers) muda; a versão é conferida no máximo a cada
+    ``verificacao`` segundos, o que também atualiza os outros workers, que
+    não recebem o ``invalidar()``.
+    """
+
+    def __init__(self, verificacao):
+        self.verificacao = verificacao
+        self._lock = lock_nativo()
+        self._niveis = None
+        self._versao = None
+        self._verificado_em = 0.0
+
+    def invalidar(self):
+        with self._lock:
+            self._niveis = None
+
+    @staticmethod
+    def _versao_atual():
+        # Quantidade e maior id não bastam: o SQLite reaproveita o id da última
+        # frase apagada, e uma edição não muda nenhum dos dois
+        return db.session.execute(text(
+            "SELECT versao FROM versao_tabela WHERE tabela = 'frase_digitação'"
+        )).scalar()
+
+    def _carregar(self):
+        niveis = self._niveis
+        agora = time.monotonic()
+        if niveis is not None and agora - self._verificado_em < self.verificacao:
+            return niveis
+        versao = self._versao_atual()
+        with self._lock:
+            self._verificado_em = agora
+            if self._niveis is None or versao != self._versao:
+                agrupadas = {}
+                for texto, dificuldade in db.session.query(FraseDigitação.texto,
+                                                           FraseDigitação.nivel_dificuldade):
+                    agrupadas.setdefault(dificuldade, []).append((len(texto.split()), texto))
+
+                niveis = {}
+                for dificuldade, frases in agrupadas.items():
+                    frases.sort(key=lambda frase: frase[0])
+                    textos = [texto for _, texto in frases]
+                    primeira = []
+                    posicao = 0
+                    for palavras in range(frases[-1][0] + 2):
+                        while posicao < len(frases) and frases[posicao][0] < palavras:
+                            posicao += 1
+                        primeira.append(posicao)
+                    niveis[dificuldade] = (textos, primeira)
+                self._niveis = niveis
+                self._versao = versao
+            return self._niveis
+
+    def sortear(self, dificuldade, min_palavras=None, max_palavras=None, excluir=None):
+        """Sorteia uma frase da dificuldade, opcionalmente dentro de uma faixa de palavras.
+
+        ``excluir`` é um conjunto de frases que não devem ser repetidas; se todas
+        as frases da faixa já estiverem nele, retorna None.
+        """
+        textos, primeira = self._carregar().get(dificuldade, ((), ()))
+        if not textos:
+            return None
+        limite = len(primeira) - 1
+        inicio = primeira[min(max(min_palavras, 0), limite)] if min_palavras is not None else 0
+        fim = primeira[min(max(max_palavras + 1, 0), limite)] if max_palavras is not None else len(textos)
+        if inicio >= fim:
+            return None
+        if excluir:
+            for _ in range(8):
+                frase = textos[random.randrange(inicio, fim)]
+                if frase not in excluir:
+                    return frase
+            livres = [frase for frase in textos[inicio:fim] if frase not in excluir]
+            return random.choice(livres) if livres else None
+        return textos[random.randrange(inicio, fim)]
+
+    def total(self, dificuldade):
+        return len(self._carregar().get(dificuldade, ((), ()))[0])
+
+indice_frases = IndiceFrases(app.config['FRASES_VERIFICACAO_SEGUNDOS'])
+
+def faixa_de_palavras(dificuldade, nivel):
+    """Fórmula para aumentar a complexidade com o nível: retorna (mínimo, máximo) de palavras."""
+    min_palavras = 3 + (dificuldade - 1) * 2 + (nivel // 5)
+    max_palavras = min_palavras + 2 + (nivel // 10)
+    return min_palavras, max_palavras
+
+FRASES_PADRAO = [
+    "A prática leva à perfeição na digitação.",
+    "Digitar rápido e sem erros é essencial hoje em dia.",
+    "A velocidade de digitação melhora com exercícios diários.",
+    "Foque na precisão primeiro, depois na velocidade.",
+    "Mantenha os dedos na posição correta para digitar melhor."
+]
+
+def sortear_frase(dificuldade, nivel, excluir=None):
+    """Escolhe uma frase adequada ao nível, relaxando a faixa de palavras se preciso.
+
+    Frases em ``excluir`` só são repetidas quando não resta nenhuma outra.
+    """
+    min_palavras, max_palavras = faixa_de_palavras(dificuldade, nivel)
+    frase = indice_frases.sortear(dificuldade, min_palavras, max_palavras, excluir)
+    if frase is None and excluir:
+        frase = indice_frases.sortear(dificuldade, excluir=excluir)
+    if frase is None:
+        frase = indice_frases.sortear(dificuldade, min_palavras, max_palavras)
+    if frase is None:
+        frase = indice_frases.sortear(dificuldade)
+    if frase is None:
+        # Frases padrão de fallback
+        livres = [f for f in FRASES_PADRAO if not excluir or f not in excluir]
+        frase = random.choice(livres or FRASES_PADRAO)
+    return frase
+
+def sortear_lote(dificuldade, nivel, quantidade, vistas):
+    """Frases para ``quantidade`` níveis a partir de ``nivel``; as sorteadas entram em ``vistas``."""
+    frases = []
+    for nivel in range(nivel, nivel + quantidade):
+        frase = sortear_frase(dificuldade, nivel, excluir=vistas)
+        vistas.add(frase)
+        frases.append({'level': nivel, 'phrase': frase})
+    return frases
+
+class UsuarioEmCache(UserMixin):
+    """Cópia leve do usuário logado (id, username, role), fora da sessão do SQLAlchemy.
+
+    Atributos que não estão na cópia (relacionamentos como ``equipes`` ou
+    ``notas_dadas``) vêm do User de verdade, carregado só quando usados.
+    """
+
+    def __init__(self, id, username, role):
+        self.id = id
+        self.username = username
+        self.role = role
+
+    @property
+    def modelo(self):
+        return User.query.get(self.id)
+
+    def __getattr__(self, nome):
+        if nome.startswith('_'):
+            raise AttributeError(nome)
+        return getattr(self.modelo, nome)
+
+class CacheUsuarios:
+    """LRU com validade para o user_loader do Flask-Login.
+
+    Sem ele, toda requisição e todo evento Socket.IO que toca em
+    ``current_user`` faz um SELECT no usuário. Acertos e falhas vão para a
+    métrica ``digitacao_user_cache_total``.
+    """
+
+    def __init__(self, tamanho, validade):
+        self.tamanho = tamanho
+        self.validade = validade
+        self._itens = OrderedDict()  # user_id -> (expira_em, UsuarioEmCache)
+        self._lock = threading.Lock()
+
+    def obter(self, user_id):
+        agora = time.monotonic()
+        with self._lock:
+            item = self._itens.get(user_id)
+            if item and item[0] > agora:
+                self._itens.move_to_end(user_id)
+                metricas.incrementar('digitacao_user_cache_total', ('acerto',))
+                return item[1]
+        metricas.incrementar('digitacao_user_cache_total', ('falha',))
+
+        linha = db.session.query(User.id, User.username, User.role).filter(User.id == user_id).first()
+        if linha is None:
+            return None
+        usuario = UsuarioEmCache(*linha)
+        with self._lock:
+            self._itens[user_id] = (agora + self.validade, usuario)
+            self._itens.move_to_end(user_id)
+            while len(self._itens) > self.tamanho:
+                self._itens.popitem(last=False)
+        return usuario
+
+    def invalidar(self, user_id=None):
+        """Descarta a cópia de um usuário (ou de todos) depois de alterar a tabela user."""
+        with self._lock:
+            if user_id is None:
+                self._itens.clear()
+            else:
+                self._itens.pop(user_id, None)
+
+cache_usuarios = CacheUsuarios(app.config['USUARIOS_CACHE_TAMANHO'], app.config['USUARIOS_CACHE_SEGUNDOS'])
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return cache_usuarios.obter(int(user_id))
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+# Armazenamento de arquivos por conteúdo
+class ErroArmazenamento(Exception):
+    pass
+
+class ArmazenamentoConteudo:
+    """Guarda os arquivos enviados pelo SHA-256 do conteúdo.
+
+    O upload é copiado em blocos para um arquivo temporário enquanto o hash é
+    calculado; no fim ele é renomeado para ``objetos/<2 primeiros>/<hash>``.
+    Conteúdo repetido não ocupa espaço de novo e nomes iguais não se
+    sobrescrevem mais.
+    """
+
+    TAMANHO_BLOCO = 64 * 1024
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+
+    def chave_relativa(self, chave):
+        return os.path.join('objetos', chave[:2], chave)
+
+    def caminho(self, chave):
+        return os.path.join(app.root_path, self.pasta, self.chave_relativa(chave))
+
+    def salvar(self, fluxo, limite=None):
+        """Grava o fluxo e retorna (hash, tamanho); falha se passar de ``limite`` bytes."""
+        temporarios = os.path.join(app.root_path, self.pasta, 'tmp')
+        os.makedirs(temporarios, exist_ok=True)
+        descritor, temporario = tempfile.mkstemp(dir=temporarios)
+        resumo = hashlib.sha256()
+        tamanho = 0
+        try:
+            with os.fdopen(descritor, 'wb') as destino:
+                while True:
+                    bloco = fluxo.read(self.TAMANHO_BLOCO)
+                    if not bloco:
+                        break
+                    tamanho += len(bloco)
+                    if limite is not None and tamanho > limite:
+                        raise ErroArmazenamento(
+                            f'Arquivo excede o limite de {limite // (1024 * 1024)} MB disponível.')
+                    resumo.update(bloco)
+                    destino.write(bloco)
+
+            chave = resumo.hexdigest()
+            final = self.caminho(chave)
+            if os.path.exists(final):
+                os.remove(temporario)  # mesmo conteúdo já armazenado
+            else:
+                os.makedirs(os.path.dirname(final), exist_ok=True)
+                os.replace(temporario, final)
+            return chave, tamanho
+        except BaseException:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+
+armazenamento = ArmazenamentoConteudo(app.config['UPLOAD_FOLDER'])
+
+def espaco_usado(user_id):
+    """Bytes ocupados pelos arquivos distintos (por hash) enviados pelo usuário."""
+    distintos = db.session.query(Arquivo.content_hash, Arquivo.size)\
+        .filter(Arquivo.user_id == user_id, Arquivo.content_hash.isnot(None))\
+        .distinct()\
+        .subquery()
+    return db.session.query(func.coalesce(func.sum(distintos.c.size), 0)).scalar()
+
+def armazenar_upload(arquivo, user_id, description=None):
+    """Salva o upload respeitando o limite por arquivo e a cota do usuário.
+
+    Retorna um Arquivo (ainda não adicionado à sessão) apontando para o conteúdo.
+    """
+    restante = app.config['COTA_POR_USUARIO'] - espaco_usado(user_id)
+    if restante <= 0:
+        raise ErroArmazenamento('Sua cota de armazenamento está esgotada.')
+    limite = min(app.config['TAMANHO_MAXIMO_ARQUIVO'], restante)
+
+    chave, tamanho = armazenamento.salvar(arquivo.stream, limite)
+    filename = secure_filename(arquivo.filename)
+    return Arquivo(
+        filename=filename,
+        path=armazenamento.chave_relativa(chave),
+        user_id=user_id,
+        is_link=False,
+        description=description or filename,
+        content_hash=chave,
+        size=tamanho
+    )
+
+@app.errorhandler(413)
+def arquivo_muito_grande(_erro):
+    limite = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    flash(f'Envio muito grande. O limite é de {limite} MB por envio.', 'error')
+    return redirect(request.url)
+
 # Rotas de autenticação
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -186,6 +1340,7 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and check_password_hash(user.password, password):
+            cache_usuarios.invalidar(user.id)  # relê nome e papel a cada login
             login_user(user)
             next_page = request.args.get('next') or url_for('index')
             return redirect(next_page)
@@ -226,6 +1381,7 @@ def gerenciar_frases():
             )
             db.session.add(nova_frase)
             db.session.commit()
+            indice_frases.invalidar()
             flash('Frase adicionada com sucesso!', 'success')
     
     frases = FraseDigitação.query.order_by(FraseDigitação.nivel_dificuldade).all()
@@ -242,35 +1398,181 @@ def remover_frase(id):
     if frase:
         db.session.delete(frase)
         db.session.commit()
+        indice_frases.invalidar()
         flash('Frase removida com sucesso!', 'success')
     return redirect(url_for('gerenciar_frases'))
 
-@app.route('/perfil')
-@login_required
-def perfil():
-    # Obter equipes do aluno e trabalhos atribuídos
+def montar_painel_aluno(user_id):
+    """Equipes, trabalhos, última entrega e membros do aluno em poucas consultas.
+
+    Uma consulta para as equipes, duas selectin (trabalhos e membros) e uma
+    para as entregas de todas as equipes, independente de quantos trabalhos
+    o aluno tenha.
+    """
+    equipes = Equipe.query.join(equipe_membros)\
+        .filter(equipe_membros.c.user_id == user_id)\
+        .options(selectinload(Equipe.trabalhos), selectinload(Equipe.equipe_membros))\
+        .order_by(Equipe.id)\
+        .all()
+
+    ultimas_entregas = {}
+    if equipes:
+        entregas = Entrega.query.filter(Entrega.equipe_id.in_([equipe.id for equipe in equipes]))\
+            .order_by(Entrega.data_entrega.desc(), Entrega.id.desc())\
+            .all()
+        for entrega in entregas:
+            ultimas_entregas.setdefault((entrega.equipe_id, entrega.trabalho_id), entrega)
+
     equipes_com_trabalhos = []
-    for equipe in current_user.equipes:
-        trabalhos = equipe.trabalhos
-        for trabalho in trabalhos:
+    for equipe in equipes:
+        for trabalho in equipe.trabalhos:
             equipes_com_trabalhos.append({
                 'equipe': equipe,
                 'trabalho': trabalho,
-                'entrega': Entrega.query.filter_by(
-                    trabalho_id=trabalho.id,
-                    equipe_id=equipe.id
-                ).first()
+                'entrega': ultimas_entregas.get((equipe.id, trabalho.id))
             })
+    return equipes_com_trabalhos
+
+# Cache do painel em JSON: user_id -> (expira_em, resposta serializada)
+_cache_painel = {}
+
+def invalidar_painel():
+    """Descarta o cache do /api/perfil (chamado quando equipes, trabalhos ou entregas mudam)."""
+    _cache_painel.clear()
+
+def _data_iso(data):
+    return data.isoformat() if data else None
+
+def _painel_em_json(user_id):
+    agora = time.monotonic()
+    em_cache = _cache_painel.get(user_id)
+    if em_cache and em_cache[0] > agora:
+        return em_cache[1]
+
+    painel = []
+    for item in montar_painel_aluno(user_id):
+        entrega = item['entrega']
+        painel.append({
+            'equipe': {
+                'id': item['equipe'].id,
+                'nome': item['equipe'].nome,
+                'membros': [membro.username for membro in item['equipe'].membros]
+            },
+            'trabalho': {
+                'id': item['trabalho'].id,
+                'titulo': item['trabalho'].titulo,
+                'descricao': item['trabalho'].descricao,
+                'data_entrega': _data_iso(item['trabalho'].data_entrega)
+            },
+            'entrega': {
+                'id': entrega.id,
+                'data_entrega': _data_iso(entrega.data_entrega),
+                'nota': entrega.nota
+            } if entrega else None
+        })
+    corpo = json.dumps({'trabalhos': painel}, ensure_ascii=False)
+    _cache_painel[user_id] = (agora + app.config['PAINEL_CACHE_SEGUNDOS'], corpo)
+    return corpo
+
+@app.route('/perfil')
+@login_required
+def perfil():
+    # Obter equipes do aluno e trabalhos atribuídos
+    equipes_com_trabalhos = montar_painel_aluno(current_user.id)
+    estatisticas = UserStats.query.get(current_user.id)
     
     return render_template('perfil.html', 
                          equipes_com_trabalhos=equipes_com_trabalhos,
+                         estatisticas=estatisticas,
+                         agora=datetime.now(),
                          user=current_user)
 
+@app.route('/api/perfil')
+@login_required
+def api_perfil():
+    # Versão em JSON para clientes que consultam periodicamente (com ETag)
+    resposta = app.response_class(_painel_em_json(current_user.id), mimetype='application/json')
+    resposta.add_etag()
+    return resposta.make_conditional(request)
+
+def _ler_cursor(cursor):
+    """Converte ``<data iso>_<id>`` de volta em (upload_date, id); None se inválido."""
+    try:
+        data, arquivo_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(data), int(arquivo_id)
+    except (AttributeError, ValueError):
+        return None
+
+def _parametros_arquivos():
+    extensao = (request.args.get('extensao') or '').lower().lstrip('.')
+    tipo = request.args.get('tipo')
+    return {
+        'autor': request.args.get('autor', type=int),
+        'tipo': tipo if tipo in ('arquivo', 'link') else None,
+        'extensao': extensao if extensao in app.config['ALLOWED_EXTENSIONS'] else None,
+    }
+
+def listar_arquivos(autor=None, tipo=None, extensao=None, cursor=None, limite=None):
+    """Uma página de arquivos, do mais recente para o mais antigo.
+
+    Paginação por chave em (upload_date, id): a próxima página começa depois
+    do último item visto, então o custo não cresce com o número da página
+    (ao contrário de OFFSET). Retorna (arquivos, cursor da próxima página).
+    """
+    limite = limite or app.config['ARQUIVOS_POR_PAGINA']
+    consulta = Arquivo.query
+    if autor:
+        consulta = consulta.filter(Arquivo.user_id == autor)
+    if tipo == 'link':
+        consulta = consulta.filter(Arquivo.is_link.is_(True))
+    elif tipo == 'arquivo':
+        consulta = consulta.filter(Arquivo.is_link.isnot(True))
+    if extensao:
+        consulta = consulta.filter(Arquivo.is_link.isnot(True),
+                                   func.lower(Arquivo.filename).like(f'%.{extensao}'))
+    posicao = _ler_cursor(cursor)
+    if posicao:
+        consulta = consulta.filter(tuple_(Arquivo.upload_date, Arquivo.id) < tuple_(*posicao))
+
+    arquivos = consulta.order_by(Arquivo.upload_date.desc(), Arquivo.id.desc())\
+        .limit(limite + 1)\
+        .all()
+    proximo = None
+    if len(arquivos) > limite:
+        arquivos = arquivos[:limite]
+        ultimo = arquivos[-1]
+        proximo = f'{ultimo.upload_date.isoformat()}_{ultimo.id}'
+    return arquivos, proximo
+
 @app.route('/arquivos')
 @login_required
 def arquivos():
-    files = Arquivo.query.all()
-    return render_template('arquivos.html', files=files)
+    filtros = _parametros_arquivos()
+    files, proximo = listar_arquivos(cursor=request.args.get('cursor'), **filtros)
+    autores = User.query.filter_by(role='professor').order_by(User.username).all()
+    return render_template('arquivos.html',
+                           files=files,
+                           proximo=proximo,
+                           filtros=filtros,
+                           autores=autores,
+                           extensoes=sorted(app.config['ALLOWED_EXTENSIONS']))
+
+@app.route('/api/arquivos')
+@login_required
+def api_arquivos():
+    files, proximo = listar_arquivos(cursor=request.args.get('cursor'), **_parametros_arquivos())
+    return jsonify({
+        'arquivos': [{
+            'id': arquivo.id,
+            'filename': arquivo.filename,
+            'is_link': bool(arquivo.is_link),
+            'url': arquivo.path if arquivo.is_link else url_for('download_file', file_id=arquivo.id),
+            'upload_date': _data_iso(arquivo.upload_date),
+            'data': arquivo.upload_date.strftime('%d/%m/%Y %H:%M') if arquivo.upload_date else '',
+            'size': arquivo.size,
+        } for arquivo in files],
+        'proximo': proximo
+    })
 
 @app.route('/upload', methods=['GET', 'POST'])
 @login_required
@@ -310,21 +1612,13 @@ def upload_file():
         elif 'file' in request.files:
             file = request.files['file']
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-                
                 # Obter a descrição do formulário ou usar o nome do arquivo como padrão
-                description = request.form.get('description', filename)
+                try:
+                    new_file = armazenar_upload(file, current_user.id, request.form.get('description'))
+                except ErroArmazenamento as e:
+                    flash(str(e), 'error')
+                    return redirect(url_for('upload_file'))
                 
-                new_file = Arquivo(
-                    filename=filename,
-                    path=file_path,
-                    user_id=current_user.id,
-                    is_link=False,
-                    description=description  # Adicionado aqui
-                )
                 db.session.add(new_file)
                 db.session.commit()
                 flash('Arquivo enviado com sucesso!', 'success')
@@ -334,11 +1628,49 @@ def upload_file():
     
     return render_template('upload.html')
 
+def enviar_arquivo(caminho, nome, relativo, etag=True):
+    """Envia um arquivo guardado em UPLOAD_FOLDER com ETag, 304 e Range.
+
+    Com ``DOWNLOAD_DESCARGA`` configurado, a resposta sai sem corpo e o proxy
+    serve os bytes (e trata o Range) a partir do cabeçalho X-Sendfile ou
+    X-Accel-Redirect; a aplicação só valida a sessão e o cache condicional.
+    """
+    if caminho is None or not os.path.isfile(caminho):
+        abort(404)
+    modo = app.config['DOWNLOAD_DESCARGA']
+    ambiente = request.environ
+    if modo:
+        ambiente = dict(ambiente)
+        ambiente.pop('HTTP_RANGE', None)
+        ambiente.pop('HTTP_IF_RANGE', None)
+    resposta = enviar_arquivo_wsgi(caminho, ambiente,
+                                   as_attachment=True,
+                                   download_name=nome,
+                                   conditional=True,
+                                   etag=etag,
+                                   use_x_sendfile=bool(modo),
+                                   response_class=app.response_class)
+    resposta.cache_control.private = True
+    if modo == 'x-accel' and 'X-Sendfile' in resposta.headers:
+        del resposta.headers['X-Sendfile']
+        resposta.headers['X-Accel-Redirect'] = (app.config['DOWNLOAD_PREFIXO_INTERNO']
+                                                + relativo.replace(os.sep, '/'))
+    return resposta
+
 @app.route('/download/<int:file_id>')
 @login_required
 def download_file(file_id):
-    file = Arquivo.query.get(file_id)
-    return send_from_directory(directory=app.config['UPLOAD_FOLDER'], path=file.filename, as_attachment=True)
+    file = Arquivo.query.get_or_404(file_id)
+    if file.is_link:
+        return redirect(file.path)
+    if file.content_hash:
+        # o hash identifica o conteúdo, então serve como ETag forte
+        return enviar_arquivo(armazenamento.caminho(file.content_hash), file.filename,
+                              armazenamento.chave_relativa(file.content_hash),
+                              etag=file.content_hash)
+    # arquivos antigos, ainda não migrados: ETag pela data de modificação e tamanho
+    pasta = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
+    return enviar_arquivo(safe_join(pasta, file.filename), file.filename, file.filename)
 
 @app.route('/notas', methods=['GET', 'POST'])
 @login_required
@@ -386,9 +1718,464 @@ def cadastro():
         else:
             new_user = User(username=username, password=generate_password_hash(password), role=role)
             db.session.add(new_user)
-            db.session.commit()
-            flash('Usuário cadastrado com sucesso!')
+            if role == 'aluno':
+                db.session.add(Aluno(user=new_user, ativo=True))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Uma importação por CSV criou o mesmo username depois da consulta
+                db.session.rollback()
+                flash('Usuário já existe.')
+            else:
+                cache_usuarios.invalidar(new_user.id)
+                flash('Usuário cadastrado com sucesso!')
     return render_template('cadastro.html')
+
+PAPEIS = ('aluno', 'professor')
+
+def _validar_linha(linha, vistos):
+    username = (linha.get('username') or '').strip()
+    password = linha.get('password') or ''
+    role = (linha.get('role') or 'aluno').strip().lower()
+    if not username:
+        return username, 'username vazio'
+    if len(username) > 100:
+        return username, 'username com mais de 100 caracteres'
+    if not password:
+        return username, 'senha vazia'
+    if role not in PAPEIS:
+        return username, f'papel inválido: {role}'
+    if username in vistos:
+        return username, 'username repetido no arquivo'
+    return username, None
+
+class PoolProcessos:
+    """Pool de processos criado no primeiro uso e compartilhado pelas requisições."""
+
+    def __init__(self, processos):
+        self.processos = processos
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.processos, mp_context=contexto_processos())
+                atexit.register(self._executor.shutdown)
+            return self._executor
+
+    def map(self, funcao, itens, chunksize=1):
+        itens = list(itens)
+        executor = self._pool()
+        try:
+            return list(executor.map(funcao, itens, chunksize=chunksize))
+        except BrokenProcessPool:
+            # um processo morreu (falta de memória, por exemplo): recria o pool e tenta de novo
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            return list(self._pool().map(funcao, itens, chunksize=chunksize))
+
+pool_importacao = PoolProcessos(app.config['IMPORTACAO_PROCESSOS'])
+
+def _usernames_existentes(usernames):
+    return {username for (username,) in
+            db.session.query(User.username).filter(User.username.in_(usernames))}
+
+def _importar_lote(lote, pool):
+    """Grava um lote já validado; retorna (numero_da_linha, username, erro) de cada linha."""
+    usernames = [linha['username'] for _, linha in lote]
+    existentes = _usernames_existentes(usernames)
+    novos = [(numero, linha) for numero, linha in lote if linha['username'] not in existentes]
+
+    # PBKDF2 é caro de propósito; os hashes são calculados em paralelo no pool
+    senhas = pool.map(generate_password_hash, [linha['password'] for _, linha in novos], chunksize=16)
+    hashes = {linha['username']: senha for (_, linha), senha in zip(novos, senhas)}
+    while novos:
+        try:
+            db.session.execute(User.__table__.insert(), [
+                {'username': linha['username'], 'password': hashes[linha['username']], 'role': linha['role']}
+                for _, linha in novos
+            ])
+            alunos = [linha['username'] for _, linha in novos if linha['role'] == 'aluno']
+            if alunos:
+                db.session.execute(Aluno.__table__.insert().from_select(
+                    ['user_id', 'ativo'],
+                    db.select([User.id, db.literal(True)]).where(User.username.in_(alunos))
+                ))
+            db.session.commit()
+            break
+        except IntegrityError:
+            # O formulário ou outra importação criou algum destes usernames depois
+            # da consulta: o lote volta inteiro e é gravado de novo sem eles
+            db.session.rollback()
+            criados_por_outro = _usernames_existentes(usernames) - existentes
+            if not criados_por_outro:
+                raise
+            existentes |= criados_por_outro
+            novos = [(numero, linha) for numero, linha in novos if linha['username'] not in existentes]
+
+    return [(numero, linha['username'], 'usuário já existe' if linha['username'] in existentes else None)
+            for numero, linha in lote]
+
+def importar_usuarios(arquivo_csv, lote=None, processos=None):
+    """Importa usuários de um CSV (username, password, role) lendo em streaming.
+
+    Gera ``(numero_da_linha, username, erro)`` para cada linha, com ``erro``
+    None quando o usuário foi criado. Cada lote é uma transação: uma consulta
+    para descobrir os usernames que já existem, os hashes em paralelo e um
+    INSERT com executemany para User e outro para Aluno.
+    """
+    lote = lote or app.config['IMPORTACAO_LOTE']
+    leitor = csv.DictReader(arquivo_csv)
+    vistos = set()
+    pendentes = []
+    # Sem ``processos`` usa o pool compartilhado; com ele (benchmark), um pool só desta importação
+    if processos:
+        contexto = ProcessPoolExecutor(max_workers=processos, mp_context=contexto_processos())
+    else:
+        contexto = contextlib.nullcontext(pool_importacao)
+    with contexto as pool:
+        for linha in leitor:
+            username, erro = _validar_linha(linha, vistos)
+            if erro:
+                yield leitor.line_num, username, erro
+                continue
+            vistos.add(username)
+            pendentes.append((leitor.line_num, {'username': username,
+                                                'password': linha['password'],
+                                                'role': (linha.get('role') or 'aluno').strip().lower()}))
+            if len(pendentes) >= lote:
+                yield from _importar_lote(pendentes, pool)
+                pendentes = []
+        if pendentes:
+            yield from _importar_lote(pendentes, pool)
+    cache_usuarios.invalidar()
+
+@app.route('/cadastro/importar', methods=['POST'])
+@login_required
+def importar_cadastro():
+    if current_user.role != 'professor':
+        flash('Apenas professores podem cadastrar usuários.')
+        return redirect(url_for('index'))
+    arquivo = request.files.get('arquivo')
+    if not arquivo or not arquivo.filename:
+        flash('Envie um arquivo CSV.', 'error')
+        return redirect(url_for('cadastro'))
+
+    criados = 0
+    erros = []
+    try:
+        for numero, username, erro in importar_usuarios(io.TextIOWrapper(arquivo.stream, encoding='utf-8-sig')):
+            if erro:
+                erros.append({'linha': numero, 'username': username, 'erro': erro})
+            else:
+                criados += 1
+    except (UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        erros.append({'linha': None, 'username': '', 'erro': f'arquivo inválido: {str(e)}'})
+    erros.sort(key=lambda erro: erro['linha'] or 0)
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'criados': criados, 'erros': erros})
+    flash(f'{criados} usuários cadastrados, {len(erros)} linhas com erro.', 'success' if not erros else 'error')
+    return render_template('cadastro.html', criados=criados, erros=erros)
+
+@app.cli.command('importar-usuarios')
+@click.argument('arquivo', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--relatorio', type=click.File('w', encoding='utf-8'),
+              help='CSV com o resultado de cada linha')
+def importar_usuarios_comando(arquivo, relatorio):
+    """Cadastra usuários a partir de um CSV com as colunas username, password e role."""
+    escritor = csv.writer(relatorio) if relatorio else None
+    if escritor:
+        escritor.writerow(['linha', 'username', 'resultado'])
+    criados = erros = 0
+    inicio = time.perf_counter()
+    for numero, username, erro in importar_usuarios(arquivo):
+        if erro:
+            erros += 1
+            print(f"Linha {numero} ({username}): {erro}")
+        else:
+            criados += 1
+        if escritor:
+            escritor.writerow([numero, username, erro or 'criado'])
+    duracao = time.perf_counter() - inicio
+    print(f"{criados} usuários cadastrados e {erros} linhas com erro em {duracao:.1f}s")
+DIFICULDADES = (1, 2, 3, 4)
+
+def atualizar_estatisticas(user_id, wpm=None, accuracy=None, difficulty=None, tempo_jogado=0, data=None):
+    """Aplica uma partida ao UserStats do usuário dentro da transação atual.
+
+    Quem chama é responsável pelo commit, junto com o Desempenho/GameResult.
+    Sem wpm, apenas o tempo jogado é somado.
+    """
+    tempo_jogado = int(tempo_jogado or 0)
+    valores = {UserStats.time_played: UserStats.time_played + tempo_jogado}
+    if wpm is not None:
+        data = data or datetime.utcnow()
+        # No UPDATE as expressões enxergam a linha antiga: a partida só vira a
+        # melhor se superar o best_wpm anterior (empate mantém a mais antiga)
+        melhorou = (UserStats.best_date.is_(None)) | (UserStats.best_wpm < wpm)
+        valores.update({
+            UserStats.games_played: UserStats.games_played + 1,
+            UserStats.accuracy_sum: UserStats.accuracy_sum + (accuracy or 0),
+            UserStats.best_wpm: func.max(UserStats.best_wpm, wpm),
+            UserStats.best_accuracy: db.case((melhorou, accuracy), else_=UserStats.best_accuracy),
+            UserStats.best_difficulty: db.case((melhorou, difficulty), else_=UserStats.best_difficulty),
+            UserStats.best_date: db.case((melhorou, data), else_=UserStats.best_date),
+            UserStats.last_played: data
+        })
+        if difficulty in DIFICULDADES:
+            coluna = getattr(UserStats, f'best_wpm_{difficulty}')
+            precisao = getattr(UserStats, f'best_accuracy_{difficulty}')
+            quando = getattr(UserStats, f'best_date_{difficulty}')
+            melhorou = quando.is_(None) | (coluna < wpm)
+            valores[coluna] = func.max(coluna, wpm)
+            valores[precisao] = db.case((melhorou, accuracy), else_=precisao)
+            valores[quando] = db.case((melhorou, data), else_=quando)
+
+    atualizados = UserStats.query.filter_by(user_id=user_id)\
+                               .update(valores, synchronize_session=False)
+    if not atualizados:
+        stats = UserStats(user_id=user_id, games_played=0, accuracy_sum=0, time_played=tempo_jogado,
+                          best_wpm=0, best_wpm_1=0, best_wpm_2=0, best_wpm_3=0, best_wpm_4=0)
+        if wpm is not None:
+            stats.games_played = 1
+            stats.accuracy_sum = accuracy or 0
+            stats.best_wpm = wpm
+            stats.best_accuracy = accuracy
+            stats.best_difficulty = difficulty
+            stats.best_date = data
+            stats.last_played = data
+            if difficulty in DIFICULDADES:
+                setattr(stats, f'best_wpm_{difficulty}', wpm)
+                setattr(stats, f'best_accuracy_{difficulty}', accuracy)
+                setattr(stats, f'best_date_{difficulty}', data)
+        db.session.add(stats)
+
+# Preenche precisão, dificuldade e data da melhor partida de cada usuário a partir do histórico
+# (uma subconsulta por usuário pelo índice de desempenho.user_id; empate fica com a mais antiga)
+SQL_MELHORES_PARTIDAS = [
+    'UPDATE user_stats SET (best_accuracy, best_difficulty, best_date) = '
+    '(SELECT accuracy, difficulty, date FROM desempenho WHERE desempenho.user_id = user_stats.user_id '
+    'ORDER BY wpm DESC, id LIMIT 1)',
+] + [
+    f'UPDATE user_stats SET (best_accuracy_{d}, best_date_{d}) = '
+    f'(SELECT accuracy, date FROM desempenho WHERE desempenho.user_id = user_stats.user_id '
+    f'AND difficulty = {d} ORDER BY wpm DESC, id LIMIT 1)'
+    for d in DIFICULDADES
+]
+
+def preencher_estatisticas(conexao):
+    """Recria a tabela UserStats a partir de Desempenho e GameResult, em lote.
+
+    Recebe a sessão ou uma conexão e não faz commit: o comando
+    reconstruir-estatisticas e a migração 9 decidem a transação.
+    """
+    melhor_por_dificuldade = [
+        func.coalesce(func.max(db.case((Desempenho.difficulty == d, Desempenho.wpm))), 0)
+        for d in DIFICULDADES
+    ]
+    tempo_jogado = db.select([func.coalesce(func.sum(GameResult.time_played), 0)])\
+                     .where(GameResult.user_id == Desempenho.user_id)\
+                     .scalar_subquery()
+    historico = db.select([
+        Desempenho.user_id,
+        func.count(Desempenho.id),
+        func.coalesce(func.sum(Desempenho.accuracy), 0),
+        tempo_jogado,
+        func.coalesce(func.max(Desempenho.wpm), 0),
+        *melhor_por_dificuldade,
+        func.max(Desempenho.date)
+    ]).where(Desempenho.user_id.isnot(None))\
+      .group_by(Desempenho.user_id)
+
+    tabela = UserStats.__table__
+    colunas = ['user_id', 'games_played', 'accuracy_sum', 'time_played', 'best_wpm',
+               'best_wpm_1', 'best_wpm_2', 'best_wpm_3', 'best_wpm_4', 'last_played']
+    conexao.execute(tabela.delete())
+    conexao.execute(tabela.insert().from_select(colunas, historico))
+    for comando in SQL_MELHORES_PARTIDAS:
+        conexao.execute(text(comando))
+
+    # Usuários que só têm GameResult (rota /save_results) entram apenas com o tempo jogado
+    somente_tempo = db.select([
+        GameResult.user_id,
+        func.sum(GameResult.time_played)
+    ]).where(GameResult.user_id.isnot(None))\
+      .where(~GameResult.user_id.in_(db.select([tabela.c.user_id])))\
+      .group_by(GameResult.user_id)
+    conexao.execute(tabela.insert().from_select(['user_id', 'time_played'], somente_tempo))
+
+def reconstruir_estatisticas():
+    """Recria toda a tabela UserStats a partir do histórico, em lote."""
+    preencher_estatisticas(db.session)
+    db.session.commit()
+    return UserStats.query.count()
+
+@app.cli.command('reconstruir-estatisticas')
+def reconstruir_estatisticas_comando():
+    """Reconstrói o resumo UserStats a partir de Desempenho e GameResult."""
+    total = reconstruir_estatisticas()
+    print(f"Estatísticas reconstruídas para {total} usuários")
+
+def gravar_partidas(itens):
+    """Insere um lote de partidas numa única transação.
+
+    Cada item traz ``desempenho`` (e opcionalmente ``game_result``) como
+    dicionários de colunas; as linhas vão para o banco com executemany e o
+    UserStats de cada partida é atualizado no mesmo commit.
+    """
+    resultados = [item['game_result'] for item in itens if item.get('game_result')]
+    desempenhos = [item['desempenho'] for item in itens]
+    if resultados:
+        db.session.execute(GameResult.__table__.insert(), resultados)
+    db.session.execute(Desempenho.__table__.insert(), desempenhos)
+    for item in itens:
+        desempenho = item['desempenho']
+        atualizar_estatisticas(desempenho['user_id'],
+                               wpm=desempenho['wpm'],
+                               accuracy=desempenho['accuracy'],
+                               difficulty=desempenho['difficulty'],
+                               tempo_jogado=item.get('tempo_jogado', 0),
+                               data=desempenho['date'])
+    db.session.commit()
+
+class FilaGravacao:
+    """Fila limitada de partidas gravadas em segundo plano (write-behind).
+
+    Os handlers do Socket.IO só enfileiram; uma tarefa de fundo junta até
+    ``lote`` partidas (ou o que chegar em ``intervalo`` segundos), grava tudo
+    numa transação e então emite ``results_saved`` para cada sid. Quando o
+    processo termina, espera a tarefa gravar o lote que já tirou da fila e
+    grava o que ainda estiver nela.
+    """
+
+    def __init__(self, tamanho_maximo, lote, intervalo, espera_encerrar):
+        self.fila = queue.Queue(maxsize=tamanho_maximo)
+        self.lote = lote
+        self.intervalo = intervalo
+        self.espera_encerrar = espera_encerrar
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._tarefa = None
+
+    def iniciar(self):
+        # Daemon: a saída do processo não espera a tarefa (com eventlet ela nunca
+        # veria a thread principal terminar); quem espera é o encerrar() do atexit
+        with self._lock:
+            if self._tarefa is None:
+                self._tarefa = threading.Thread(target=self._executar, daemon=True,
+                                                name='fila-gravacao')
+                self._tarefa.start()
+                atexit.register(self.encerrar)
+
+    def enfileirar(self, item):
+        """Retorna False se a fila estiver cheia (quem chama grava de forma síncrona)."""
+        self.iniciar()
+        try:
+            self.fila.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def _coletar(self):
+        try:
+            itens = [self.fila.get(timeout=self.intervalo)]
+        except queue.Empty:
+            return []
+        prazo = time.monotonic() + self.intervalo
+        while len(itens) < self.lote:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                itens.append(self.fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        return itens
+
+    def _executar(self):
+        # Para quando o encerrar() pede ou quando a thread principal termina
+        while not self._parar.is_set() and threading.main_thread().is_alive():
+            itens = self._coletar()
+            if itens:
+                self.descarregar(itens)
+        self._esvaziar()
+
+    def descarregar(self, itens):
+        with app.app_context():
+            try:
+                confirmacoes = executor_banco.executar(self._gravar, itens)
+            finally:
+                db.session.remove()
+
+        for item, erro in confirmacoes:
+            if not item.get('sid'):
+                continue
+            if erro is not None:
+                esquecer_partida_salva(item['sid'], item.get('assinatura'))
+            resposta = {'success': True} if erro is None else {'success': False, 'error': erro}
+            try:
+                socketio.emit('results_saved', resposta, room=item['sid'])
+            except Exception as e:
+                print(f"Erro ao confirmar gravação: {str(e)}")
+
+    @staticmethod
+    def _gravar(itens):
+        try:
+            gravar_partidas(itens)
+            return [(item, None) for item in itens]
+        except Exception as e:
+            db.session.rollback()
+            print(f"Erro ao gravar lote de {len(itens)} partidas, tentando uma a uma: {str(e)}")
+        confirmacoes = []
+        for item in itens:
+            try:
+                gravar_partidas([item])
+                confirmacoes.append((item, None))
+            except Exception as erro:
+                db.session.rollback()
+                confirmacoes.append((item, str(erro)))
+        return confirmacoes
+
+    def encerrar(self):
+        """Para a tarefa, espera o lote em gravação e grava o resto da fila."""
+        self._parar.set()
+        tarefa = self._tarefa
+        if tarefa is not None and tarefa is not threading.current_thread():
+            tarefa.join(self.espera_encerrar)
+            if tarefa.is_alive():
+                print(f"Gravação em andamento não terminou em {self.espera_encerrar}s")
+        self._esvaziar()
+
+    def _esvaziar(self):
+        restantes = []
+        while True:
+            try:
+                restantes.append(self.fila.get_nowait())
+            except queue.Empty:
+                break
+        for inicio in range(0, len(restantes), self.lote):
+            self.descarregar(restantes[inicio:inicio + self.lote])
+
+fila_gravacao = FilaGravacao(app.config['FILA_GRAVACAO_TAMANHO'],
+                             app.config['FILA_GRAVACAO_LOTE'],
+                             app.config['FILA_GRAVACAO_INTERVALO'],
+                             app.config['FILA_GRAVACAO_ESPERA_ENCERRAR'])
+
+def persistir_partida(item):
+    """Grava a partida agora ou, no modo GRAVACAO_ADIADA, coloca na fila.
+
+    Retorna True se a partida foi enfileirada; nesse caso a confirmação
+    ``results_saved`` é emitida pela fila quando a linha estiver no banco.
+    """
+    if app.config['GRAVACAO_ADIADA'] and fila_gravacao.enfileirar(item):
+        return True
+    executor_banco.executar(gravar_partidas, [item])
+    return False
+
 @app.route('/save_results', methods=['POST'])
 def save_results():
     if not current_user.is_authenticated:
@@ -411,6 +2198,7 @@ def save_results():
         )
         
         db.session.add(new_result)
+        atualizar_estatisticas(current_user.id, tempo_jogado=data['time_played'])
         db.session.commit()
         
         return jsonify({'success': True, 'message': 'Resultados salvos com sucesso!'})
@@ -419,119 +2207,197 @@ def save_results():
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)})
     
+# Última partida salva por conexão: um reenvio idêntico (clique duplo, reconexão) não grava de novo.
+# Vale só dentro do mesmo jogo (start_game limpa) e é esquecida se a gravação falhar.
+partida_salva_da_sessao = {}
+
+def esquecer_partida_salva(sid, assinatura):
+    if assinatura is not None and partida_salva_da_sessao.get(sid) == assinatura:
+        partida_salva_da_sessao.pop(sid, None)
+
 @socketio.on('save_game_results')
-def handle_save_results(data):
-    try:
-        if not current_user.is_authenticated:
-            emit('results_saved', {'success': False, 'error': 'Usuário não autenticado'})
-            return
-        
-        # Criar novo registro no banco de dados
-        new_result = GameResult(
-            user_id=current_user.id,
-            difficulty=data['difficulty'],
-            level=data['level'],
-            wpm=data['wpm'],
-            accuracy=data['accuracy'],
-            errors=data['errors'],
-            score=data['score'],
-            time_played=data['time_played'],
-            date_played=datetime.utcnow()
-        )
+def handle_save_results(data):
+    try:
+        if not current_user.is_authenticated:
+            emit('results_saved', {'success': False, 'error': 'Usuário não autenticado'})
+            return
         
-        db.session.add(new_result)
-        db.session.commit()
+        assinatura = json.dumps(data, sort_keys=True, default=str)
+        if partida_salva_da_sessao.get(request.sid) == assinatura:
+            devolver_ficha('save_game_results')
+            emit('results_saved', {'success': True, 'duplicada': True})
+            return
+        partida_salva_da_sessao[request.sid] = assinatura
         
-        # Também salvar no modelo Desempenho para compatibilidade
-        new_performance = Desempenho(
-            user_id=current_user.id,
-            wpm=data['wpm'],
-            accuracy=data['accuracy'],
-            difficulty=data['difficulty'],
-            errors=data['errors'],
-            date=datetime.utcnow()
-        )
-        db.session.add(new_performance)
-        db.session.commit()
+        agora = datetime.utcnow()
+        item = {
+            'sid': request.sid,
+            'assinatura': assinatura,
+            'tempo_jogado': data['time_played'],
+            'game_result': {
+                'user_id': current_user.id,
+                'difficulty': data['difficulty'],
+                'level': data['level'],
+                'wpm': data['wpm'],
+                'accuracy': data['accuracy'],
+                'errors': data['errors'],
+                'score': data['score'],
+                'time_played': data['time_played'],
+                'date_played': agora
+            },
+            # Também salvar no modelo Desempenho para compatibilidade
+            'desempenho': {
+                'user_id': current_user.id,
+                'wpm': data['wpm'],
+                'accuracy': data['accuracy'],
+                'difficulty': data['difficulty'],
+                'errors': data['errors'],
+                'date': agora
+            }
+        }
+        monitor_turma.atualizar(request.sid, dict(data, estado='terminou'))
+        if persistir_partida(item):
+            return  # a fila confirma com results_saved depois de gravar
         
         emit('results_saved', {'success': True})
         
     except Exception as e:
         db.session.rollback()
+        partida_salva_da_sessao.pop(request.sid, None)
         print(f"Erro ao salvar resultados do jogo: {str(e)}")
         emit('results_saved', {'success': False, 'error': str(e)})
+def calcular_ranking(dificuldade=None, pagina=1, por_pagina=None):
+    """Retorna (itens, total) com o melhor desempenho de cada usuário.
+
+    Lê o resumo UserStats, que guarda a melhor partida de cada usuário (geral
+    e por dificuldade) e é atualizado a cada gravação; assim o ranking ordena
+    uma linha por usuário em vez de agregar todo o Desempenho. COUNT() OVER ()
+    traz o total de usuários classificados junto com a página pedida.
+    """
+    por_pagina = por_pagina or app.config['RANKING_POR_PAGINA']
+    pagina = max(pagina, 1)
+
+    if dificuldade:
+        if dificuldade not in DIFICULDADES:
+            return [], 0
+        wpm = getattr(UserStats, f'best_wpm_{dificuldade}')
+        accuracy = getattr(UserStats, f'best_accuracy_{dificuldade}')
+        difficulty = db.literal(dificuldade)
+        date = getattr(UserStats, f'best_date_{dificuldade}')
+    else:
+        wpm, accuracy, difficulty, date = (UserStats.best_wpm, UserStats.best_accuracy,
+                                           UserStats.best_difficulty, UserStats.best_date)
+
+    linhas = db.session.query(
+        User.id,
+        User.username,
+        wpm.label('wpm'),
+        accuracy.label('accuracy'),
+        difficulty.label('difficulty'),
+        date.label('date'),
+        func.count().over().label('total')
+    ).join(UserStats, UserStats.user_id == User.id)\
+     .filter(date.isnot(None))\
+     .order_by(wpm.desc(), User.username)\
+     .limit(por_pagina)\
+     .offset((pagina - 1) * por_pagina)\
+     .all()
+
+    total = linhas[0].total if linhas else 0
+    inicio = (pagina - 1) * por_pagina
+    itens = [{
+        'posicao': inicio + i + 1,
+        'user_id': linha.id,
+        'username': linha.username,
+        'wpm': linha.wpm,
+        'accuracy': linha.accuracy,
+        'difficulty': linha.difficulty,
+        'date': linha.date
+    } for i, linha in enumerate(linhas)]
+    return itens, total
+
+def _parametros_ranking():
+    dificuldade = request.args.get('dificuldade', type=int)
+    pagina = request.args.get('pagina', 1, type=int)
+    por_pagina = request.args.get('por_pagina', app.config['RANKING_POR_PAGINA'], type=int)
+    por_pagina = min(max(por_pagina, 1), 200)
+    return dificuldade, pagina, por_pagina
+
 @app.route('/ranking')
 @login_required
 def ranking():
-    # Obter todos os usuários com seus melhores desempenhos
-    usuarios = User.query.all()
-    ranking_data = []
-    
-    for usuario in usuarios:
-        melhor_desempenho = Desempenho.query.filter_by(user_id=usuario.id)\
-                              .order_by(Desempenho.wpm.desc())\
-                              .first()
-        if melhor_desempenho:
-            ranking_data.append({
-                'username': usuario.username,
-                'wpm': melhor_desempenho.wpm,
-                'accuracy': melhor_desempenho.accuracy,
-                'difficulty': melhor_desempenho.difficulty,
-                'date': melhor_desempenho.date
-            })
-    
-    # Ordenar por WPM (maior primeiro)
-    ranking_data.sort(key=lambda x: x['wpm'], reverse=True)
-    
-    return render_template('ranking.html', ranking_data=ranking_data)
+    dificuldade, pagina, por_pagina = _parametros_ranking()
+    ranking_data, total = calcular_ranking(dificuldade, pagina, por_pagina)
+    total_paginas = max((total + por_pagina - 1) // por_pagina, 1)
+
+    return render_template('ranking.html',
+                         ranking_data=ranking_data,
+                         dificuldade=dificuldade,
+                         pagina=pagina,
+                         total_paginas=total_paginas,
+                         total=total)
+
+@app.route('/api/ranking')
+@login_required
+def api_ranking():
+    dificuldade, pagina, por_pagina = _parametros_ranking()
+    ranking_data, total = calcular_ranking(dificuldade, pagina, por_pagina)
+    for item in ranking_data:
+        item['date'] = item['date'].isoformat() if item['date'] else None
+
+    return jsonify({
+        'ranking': ranking_data,
+        'pagina': pagina,
+        'por_pagina': por_pagina,
+        'total': total,
+        'dificuldade': dificuldade
+    })
 
 # Jogo de digitação via SocketIO
+# Frases já enviadas para cada conexão (sid), para não repetir durante a sessão
+frases_da_sessao = {}
+
 @socketio.on('get_phrase')
 def handle_get_phrase(data):
     difficulty = data.get('difficulty', 1)
     level = data.get('level', 1)
     
-    # Fórmula para aumentar complexidade com o nível
-    min_words = 3 + (difficulty - 1) * 2 + (level // 5)
-    max_words = min_words + 2 + (level // 10)
-    
-    # Buscar frases no banco com número de palavras adequado
-    frases = FraseDigitação.query.filter(
-        FraseDigitação.nivel_dificuldade == difficulty,
-        func.length(FraseDigitação.texto.split()) >= min_words,
-        func.length(FraseDigitação.texto.split()) <= max_words
-    ).all()
+    vistas = frases_da_sessao.setdefault(request.sid, set())
+    frase = executor_banco.executar(sortear_frase, difficulty, level, vistas)
+    vistas.add(frase)
+    socketio.emit('new_phrase', {'phrase': frase, 'lote': data.get('lote')}, room=request.sid)
+
+@socketio.on('get_phrases')
+def handle_get_phrases(data):
+    # Entrega um lote de frases para os próximos níveis, sem repetir na mesma sessão
+    difficulty = int(data.get('difficulty', 1))
+    level = int(data.get('level', 1))
+    quantidade = int(data.get('quantidade', app.config['FRASES_POR_LOTE']))
+    quantidade = min(max(quantidade, 1), app.config['FRASES_LOTE_MAXIMO'])
     
-    if frases:
-        frase = random.choice(frases).texto
-    else:
-        # Fallback para frases padrão
-        frases_padrao = [
-            "Aprender a digitar rápido é essencial",
-            "A prática constante leva à perfeição",
-            "Digitar sem olhar para o teclado é importante",
-            "Velocidade e precisão são fundamentais",
-            "Erros são oportunidades de aprendizado"
-        ]
-        frase = random.choice(frases_padrao)
+    vistas = frases_da_sessao.setdefault(request.sid, set())
+    frases = executor_banco.executar(sortear_lote, difficulty, level, quantidade, vistas)
     
-    socketio.emit('new_phrase', {'phrase': frase}, room=request.sid)
+    emit('new_phrases', {
+        'difficulty': difficulty,
+        'lote': data.get('lote'),
+        'phrases': frases
+    })
 
 @socketio.on('submit_game')
 def handle_submit_game(data):
     if current_user.is_authenticated:
         try:
-            novo_desempenho = Desempenho(
-                user_id=current_user.id,
-                wpm=float(data.get('wpm', 0)),
-                accuracy=float(data.get('accuracy', 0)),
-                difficulty=int(data.get('difficulty', 1)),
-                errors=int(data.get('errors', 0)),
-                date=datetime.utcnow()
-            )
-            db.session.add(novo_desempenho)
-            db.session.commit()
-            print(f"Dados salvos: WPM={novo_desempenho.wpm}, Precisão={novo_desempenho.accuracy}")
+            novo_desempenho = {
+                'user_id': current_user.id,
+                'wpm': float(data.get('wpm', 0)),
+                'accuracy': float(data.get('accuracy', 0)),
+                'difficulty': int(data.get('difficulty', 1)),
+                'errors': int(data.get('errors', 0)),
+                'date': datetime.utcnow()
+            }
+            if not persistir_partida({'sid': request.sid, 'desempenho': novo_desempenho}):
+                print(f"Dados salvos: WPM={novo_desempenho['wpm']}, Precisão={novo_desempenho['accuracy']}")
         except Exception as e:
             print(f"Erro ao salvar desempenho: {str(e)}")
             db.session.rollback()
@@ -598,17 +2464,12 @@ def entregas_aluno(trabalho_id):
         comentarios = request.form.get('comentarios', '')
         
         if arquivo and allowed_file(arquivo.filename):
-            filename = secure_filename(arquivo.filename)
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            arquivo.save(filepath)
-            
-            novo_arquivo = Arquivo(
-                filename=filename,
-                path=filepath,
-                user_id=current_user.id,
-                description=f'Entrega para {trabalho.titulo}'
-            )
+            try:
+                novo_arquivo = armazenar_upload(arquivo, current_user.id,
+                                                f'Entrega para {trabalho.titulo}')
+            except ErroArmazenamento as e:
+                flash(str(e), 'error')
+                return redirect(url_for('entregas_aluno', trabalho_id=trabalho.id))
             db.session.add(novo_arquivo)
             db.session.flush()
             
@@ -618,8 +2479,12 @@ def entregas_aluno(trabalho_id):
                 comentarios=comentarios,
                 arquivo_id=novo_arquivo.id
             )
+            if extensao_do_arquivo(novo_arquivo.filename) in EXTENSOES_TEXTO:
+                nova_entrega.status_extracao = 'pendente'
             db.session.add(nova_entrega)
             db.session.commit()
+            invalidar_painel()
+            extrator_textos.solicitar()
             
             flash('Entrega realizada com sucesso!', 'success')
             return redirect(url_for('entregas_aluno', trabalho_id=trabalho.id))
@@ -653,12 +2518,18 @@ def excluir_equipe(equipe_id):
             # Remove os trabalhos vinculados
             equipe.trabalhos = []
             
-            # Remove as entregas associadas
+            # Remove as entregas associadas (e o texto extraído delas)
+            entregas_da_equipe = db.session.query(Entrega.id).filter_by(equipe_id=equipe_id)
+            TextoEntrega.query.filter(TextoEntrega.entrega_id.in_(entregas_da_equipe))\
+                .delete(synchronize_session=False)
+            BandaSimilaridade.query.filter(BandaSimilaridade.entrega_id.in_(entregas_da_equipe))\
+                .delete(synchronize_session=False)
             Entrega.query.filter_by(equipe_id=equipe_id).delete()
             
             # Finalmente remove a equipe
             db.session.delete(equipe)
             db.session.commit()
+            invalidar_painel()
             
             flash('Equipe excluída com sucesso!', 'success')
         except Exception as e:
@@ -686,6 +2557,7 @@ def avaliar_entrega(entrega_id):
         entrega.nota = nota
         entrega.feedback = feedback
         db.session.commit()
+        invalidar_painel()
         
         flash('Avaliação registrada com sucesso!', 'success')
         return redirect(url_for('gerenciar_entregas', trabalho_id=entrega.trabalho_id))
@@ -713,6 +2585,7 @@ def atribuir_trabalho():
         if trabalho not in equipe.trabalhos:
             equipe.trabalhos.append(trabalho)
             db.session.commit()
+            invalidar_painel()
             flash(f'Trabalho "{trabalho.titulo}" atribuído à equipe "{equipe.nome}"!', 'success')
         else:
             flash('Esta equipe já possui este trabalho', 'info')
@@ -724,45 +2597,35 @@ def atribuir_trabalho():
 def handle_connect():
     print('Cliente conectado:', request.sid)
 
+@socketio.on('disconnect')
+def handle_disconnect():
+    frases_da_sessao.pop(request.sid, None)
+    partida_salva_da_sessao.pop(request.sid, None)
+    corridas.sair(request.sid)
+    monitor_turma.desconectar(request.sid)
+    limites = app.config['LIMITE_EVENTOS'].values()
+    limitador_eventos.desconectar(request.sid, max((rajada / taxa for rajada, taxa in limites), default=0))
+
 @socketio.on('start_game')
 def handle_start_game(data):
-    difficulty = data.get('difficulty', 1)
+    # Novo jogo: as frases podem voltar a aparecer, e a mesma pontuação pode ser salva de novo
+    frases_da_sessao.pop(request.sid, None)
+    partida_salva_da_sessao.pop(request.sid, None)
+    if current_user.is_authenticated:
+        monitor_turma.iniciar_jogo(request.sid, current_user, (data or {}).get('difficulty', 1))
     
     # Adicione esta rota para fornecer frases aleatórias
 @app.route('/get_random_phrase/<int:difficulty>')
 @login_required
 def get_random_phrase(difficulty):
-    frase = FraseDigitação.query.filter_by(nivel_dificuldade=difficulty).order_by(func.random()).first()
+    frase = indice_frases.sortear(difficulty)
     if frase:
         return jsonify({
-            'texto': frase.texto,
-            'dificuldade': frase.nivel_dificuldade
+            'texto': frase,
+            'dificuldade': difficulty
         })
     return jsonify({'texto': 'Digite esta frase padrão quando não há frases no banco.', 'dificuldade': 1})
 
-# Modifique o socketio.on('get_phrase') para:
-@socketio.on('get_phrase')
-def handle_get_phrase(data):
-    difficulty = data.get('difficulty', 1)
-    level = data.get('level', 1)
-    
-    # Buscar frases no banco com a dificuldade selecionada
-    frase = FraseDigitação.query.filter_by(nivel_dificuldade=difficulty).order_by(func.random()).first()
-    
-    if not frase:
-        # Frases padrão de fallback
-        frases_padrao = [
-            "A prática leva à perfeição na digitação.",
-            "Digitar rápido e sem erros é essencial hoje em dia.",
-            "A velocidade de digitação melhora com exercícios diários.",
-            "Foque na precisão primeiro, depois na velocidade.",
-            "Mantenha os dedos na posição correta para digitar melhor."
-        ]
-        frase_texto = random.choice(frases_padrao)
-    else:
-        frase_texto = frase.texto
-    
-    socketio.emit('new_phrase', {'phrase': frase_texto}, room=request.sid)
 @socketio.on('submit_text')
 def handle_submit_text(data):
     frase_original = data['original']
@@ -784,19 +2647,594 @@ def handle_submit_text(data):
     
     # Salvar desempenho
     if current_user.is_authenticated:
-        novo_desempenho = Desempenho(
-            user_id=current_user.id,
-            wpm=wpm,
-            accuracy=precisao,
-            difficulty=dificuldade
-        )
-        db.session.add(novo_desempenho)
-        db.session.commit()
+        persistir_partida({
+            'sid': request.sid,
+            'desempenho': {
+                'user_id': current_user.id,
+                'wpm': wpm,
+                'accuracy': precisao,
+                'difficulty': dificuldade,
+                'errors': 0,
+                'date': datetime.utcnow()
+            }
+        })
     
     socketio.emit('game_result', {
         'wpm': wpm,
         'accuracy': precisao
     }, room=request.sid)
+
+# Corridas de digitação em tempo real
+PONTOS_POR_DIFICULDADE = {1: 1, 2: 1.5, 3: 2, 4: 3}  # mesmo multiplicador de WPM do jogo individual
+CARACTERES_CODIGO_SALA = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+
+class JogadorCorrida:
+    __slots__ = ('user_id', 'username', 'sid', 'frase', 'digitados', 'erros', 'concluido_em')
+
+    def __init__(self, user_id, username, sid):
+        self.user_id = user_id
+        self.username = username
+        self.sid = sid
+        self.frase = 0         # índice da frase atual
+        self.digitados = 0     # caracteres digitados na frase atual
+        self.erros = 0
+        self.concluido_em = None  # segundos desde a largada
+
+class SalaCorrida:
+    """Uma corrida: a mesma sequência de frases para todos os jogadores.
+
+    Os eventos de progresso só atualizam o jogador na memória; quem avisa a
+    sala é o GerenciadorCorridas, com um snapshot por tick quando algo mudou.
+    Jogadores são indexados pelo user_id, então quem reconecta volta à mesma
+    posição.
+    """
+
+    def __init__(self, codigo, dono_id, dificuldade, frases, duracao):
+        self.codigo = codigo
+        self.dono_id = dono_id
+        self.dificuldade = dificuldade
+        self.frases = frases
+        self.acumulado = [0]  # caracteres antes de cada frase
+        for frase in frases:
+            self.acumulado.append(self.acumulado[-1] + len(frase))
+        self.duracao = duracao
+        self.estado = 'espera'  # espera -> em_andamento -> encerrada
+        self.jogadores = {}     # user_id -> JogadorCorrida
+        self.espectadores = set()
+        self.criada_em = time.monotonic()
+        self.largada = None
+        self.data_inicio = None
+        self.alterada = False
+        self.lock = threading.Lock()
+
+    @property
+    def sala_socketio(self):
+        return f'corrida:{self.codigo}'
+
+    def caracteres(self, jogador):
+        return self.acumulado[jogador.frase] + jogador.digitados
+
+    def decorrido(self):
+        return max(time.monotonic() - self.largada, 0) if self.largada else 0
+
+    def wpm(self, jogador, decorrido):
+        minutos = (jogador.concluido_em or decorrido) / 60
+        return self.caracteres(jogador) / 5 / minutos if minutos > 0 else 0
+
+    def estado_publico(self):
+        return {
+            'sala': self.codigo,
+            'estado': self.estado,
+            'dono': self.dono_id,
+            'dificuldade': self.dificuldade,
+            'jogadores': [{'id': j.user_id, 'username': j.username, 'conectado': j.sid is not None}
+                          for j in self.jogadores.values()],
+            'espectadores': len(self.espectadores),
+        }
+
+    def snapshot(self):
+        """Progresso compacto: [user_id, progresso em milésimos, wpm, terminou] por jogador."""
+        total = self.acumulado[-1] or 1
+        decorrido = self.decorrido()
+        return {
+            'sala': self.codigo,
+            'tempo': round(decorrido, 1),
+            'jogadores': [[j.user_id, self.caracteres(j) * 1000 // total, round(self.wpm(j, decorrido)),
+                           j.concluido_em is not None] for j in self.jogadores.values()],
+        }
+
+    def terminou(self):
+        return self.decorrido() >= self.duracao or \
+            all(j.concluido_em is not None for j in self.jogadores.values())
+
+    def classificacao(self):
+        """Quem terminou primeiro na frente; depois quem avançou mais caracteres."""
+        decorrido = min(self.decorrido(), self.duracao)
+        ordenados = sorted(self.jogadores.values(),
+                           key=lambda j: (j.concluido_em is None, j.concluido_em or 0, -self.caracteres(j)))
+        linhas = []
+        for posicao, jogador in enumerate(ordenados, start=1):
+            caracteres = self.caracteres(jogador)
+            wpm = self.wpm(jogador, decorrido)
+            precisao = max(caracteres - jogador.erros, 0) / caracteres * 100 if caracteres else 0
+            linhas.append({
+                'posicao': posicao,
+                'user_id': jogador.user_id,
+                'username': jogador.username,
+                'frases': jogador.frase,
+                'wpm': round(wpm, 1),
+                'precisao': round(precisao, 1),
+                'erros': jogador.erros,
+                'tempo': round(jogador.concluido_em or decorrido, 1),
+                'terminou': jogador.concluido_em is not None,
+                'pontos': int(wpm * PONTOS_POR_DIFICULDADE.get(self.dificuldade, 1)) + int(precisao)
+                          + 10 * jogador.frase + 50 * (len(ordenados) - posicao),
+            })
+        return linhas
+
+class ErroCorrida(Exception):
+    pass
+
+class GerenciadorCorridas:
+    """Salas de corrida deste processo e a tarefa que transmite o progresso.
+
+    Mandar cada tecla a todos os colegas custaria O(N²) mensagens por rodada
+    de digitação; aqui o progresso só é anotado e, a cada ``tick`` segundos,
+    cada sala que mudou recebe um único snapshot. A tarefa de fundo também
+    encerra as corridas (tempo esgotado ou todos terminaram) e grava a
+    classificação final.
+    """
+
+    def __init__(self, tick, max_jogadores):
+        self.tick = tick
+        self.max_jogadores = max_jogadores
+        self.salas = {}
+        self._por_sid = {}  # sid -> (sala, user_id, espectador)
+        self._lock = threading.Lock()
+        self._iniciado = False
+
+    def _iniciar(self):
+        with self._lock:
+            if not self._iniciado:
+                self._iniciado = True
+                socketio.start_background_task(self._executar)
+
+    def abertas(self):
+        return [sala for sala in list(self.salas.values()) if sala.estado == 'espera']
+
+    def criar(self, dono_id, dificuldade, frases, duracao):
+        with self._lock:
+            codigo = ''.join(random.choices(CARACTERES_CODIGO_SALA, k=5))
+            while codigo in self.salas:
+                codigo = ''.join(random.choices(CARACTERES_CODIGO_SALA, k=5))
+            sala = self.salas[codigo] = SalaCorrida(codigo, dono_id, dificuldade, frases, duracao)
+        self._iniciar()
+        return sala
+
+    def entrar(self, codigo, sid, usuario, espectador=False):
+        sala = self.salas.get((codigo or '').strip().upper())
+        if sala is None:
+            raise ErroCorrida('Sala não encontrada.')
+        self.sair(sid)
+        with sala.lock:
+            jogador = sala.jogadores.get(usuario.id)
+            if espectador:
+                sala.espectadores.add(sid)
+            elif jogador is not None:
+                jogador.sid = sid  # reconexão
+            elif sala.estado != 'espera':
+                raise ErroCorrida('A corrida já começou.')
+            elif len(sala.jogadores) >= self.max_jogadores:
+                raise ErroCorrida('Sala cheia.')
+            else:
+                sala.jogadores[usuario.id] = JogadorCorrida(usuario.id, usuario.username, sid)
+            sala.alterada = True
+        self._por_sid[sid] = (sala, usuario.id, espectador)
+        return sala
+
+    def sair(self, sid):
+        """Retira o sid da sala; durante a corrida o jogador continua na classificação."""
+        sala, user_id, espectador = self._por_sid.pop(sid, (None, None, False))
+        if sala is None:
+            return None
+        with sala.lock:
+            sala.espectadores.discard(sid)
+            jogador = None if espectador else sala.jogadores.get(user_id)
+            if jogador is not None and jogador.sid == sid:
+                if sala.estado == 'espera':
+                    del sala.jogadores[user_id]
+                else:
+                    jogador.sid = None
+            vazia = not sala.espectadores and not any(j.sid for j in sala.jogadores.values())
+            if vazia and sala.estado == 'espera':
+                self.salas.pop(sala.codigo, None)
+        return sala
+
+    def largar(self, sid, contagem):
+        sala, user_id, _ = self._por_sid.get(sid, (None, None, False))
+        if sala is None:
+            raise ErroCorrida('Você não está em uma sala.')
+        with sala.lock:
+            if sala.dono_id != user_id:
+                raise ErroCorrida('Só quem criou a sala pode iniciar a corrida.')
+            if sala.estado != 'espera':
+                raise ErroCorrida('A corrida já começou.')
+            if not sala.jogadores:
+                raise ErroCorrida('Nenhum jogador na sala.')
+            sala.estado = 'em_andamento'
+            sala.largada = time.monotonic() + contagem
+            sala.data_inicio = datetime.utcnow()
+            sala.alterada = True
+        return sala
+
+    def progresso(self, sid, dados):
+        """Anota o progresso do jogador; O(1), nada é transmitido aqui."""
+        sala, user_id, espectador = self._por_sid.get(sid, (None, None, False))
+        if sala is None or espectador or sala.estado != 'em_andamento':
+            return
+        decorrido = time.monotonic() - sala.largada
+        if decorrido < 0 or decorrido > sala.duracao:
+            return
+        try:
+            indice = int(dados.get('frase', -1))
+            digitados = int(dados.get('digitados', 0))
+            erros = int(dados.get('erros', 0))
+        except (TypeError, ValueError):
+            return
+        with sala.lock:
+            jogador = sala.jogadores.get(user_id)
+            if jogador is None or jogador.concluido_em is not None or indice != jogador.frase:
+                return
+            frase = sala.frases[indice]
+            jogador.erros = max(jogador.erros, erros)
+            if dados.get('texto') == frase:
+                jogador.frase += 1
+                jogador.digitados = 0
+                if jogador.frase == len(sala.frases):
+                    jogador.concluido_em = decorrido
+            else:
+                jogador.digitados = min(max(digitados, 0), len(frase) - 1)
+            sala.alterada = True
+
+    def executar_tick(self):
+        """Um snapshot por sala alterada; encerra as corridas que acabaram."""
+        agora = time.monotonic()
+        for sala in list(self.salas.values()):
+            with sala.lock:
+                if sala.estado == 'espera':
+                    if agora - sala.criada_em > 3600:  # sala abandonada
+                        self.salas.pop(sala.codigo, None)
+                    elif sala.alterada:
+                        sala.alterada = False
+                        socketio.emit('race_state', sala.estado_publico(), room=sala.sala_socketio)
+                    continue
+                encerrar = sala.estado == 'em_andamento' and sala.largada <= agora and sala.terminou()
+                snapshot = sala.snapshot() if sala.alterada or encerrar else None
+                sala.alterada = False
+                if encerrar:
+                    sala.estado = 'encerrada'
+                    classificacao = sala.classificacao()
+                    self.salas.pop(sala.codigo, None)
+            if snapshot is not None:
+                socketio.emit('race_snapshot', snapshot, room=sala.sala_socketio)
+            if encerrar:
+                socketio.emit('race_finished', {'sala': sala.codigo, 'classificacao': classificacao},
+                              room=sala.sala_socketio)
+                socketio.close_room(sala.sala_socketio)
+                for sid in [sid for sid, (outra, _, _) in list(self._por_sid.items()) if outra is sala]:
+                    self._por_sid.pop(sid, None)
+                if classificacao:
+                    socketio.start_background_task(self._gravar, sala, classificacao)
+
+    def _executar(self):
+        while threading.main_thread().is_alive():
+            inicio = time.perf_counter()
+            try:
+                self.executar_tick()
+            except Exception as e:
+                print(f"Erro no tick das corridas: {str(e)}")
+            duracao = time.perf_counter() - inicio
+            metricas.observar('digitacao_race_tick_duration_seconds', (), duracao)
+            socketio.sleep(max(self.tick - duracao, 0))
+
+    def _gravar(self, sala, classificacao):
+        with app.app_context():
+            try:
+                executor_banco.executar(gravar_corrida, sala.codigo, sala.dono_id, sala.dificuldade,
+                                        sala.data_inicio, classificacao)
+            except Exception as e:
+                print(f"Erro ao gravar a corrida {sala.codigo}: {str(e)}")
+            finally:
+                db.session.remove()
+
+corridas = GerenciadorCorridas(app.config['CORRIDA_TICK'], app.config['CORRIDA_MAX_JOGADORES'])
+
+def corridas_disponiveis():
+    """As salas e o tick ficam na memória do worker: com vários workers, os jogadores se espalhariam."""
+    return not (app.config['SOCKETIO_MESSAGE_QUEUE'] and app.config['WORKERS'] > 1)
+
+def bloquear_corridas(evento):
+    """Filtro de eventos: recusa os eventos de corrida quando elas não estão disponíveis."""
+    if not evento.startswith('race_') or corridas_disponiveis():
+        return True
+    emit('race_error', {'error': 'As corridas não estão disponíveis com vários servidores.'})
+    return False
+
+filtros_evento.append(bloquear_corridas)
+
+def gravar_corrida(codigo, dono_id, dificuldade, data_inicio, classificacao):
+    """Grava a corrida e um GameResult por jogador (com a posição), na mesma transação."""
+    agora = datetime.utcnow()
+    corrida = Corrida(codigo=codigo, criado_por=dono_id, dificuldade=dificuldade,
+                      jogadores=len(classificacao), data_inicio=data_inicio, data_fim=agora)
+    db.session.add(corrida)
+    db.session.flush()
+    itens = []
+    for linha in classificacao:
+        tempo = int(round(linha['tempo']))
+        itens.append({
+            'tempo_jogado': tempo,
+            'game_result': {
+                'user_id': linha['user_id'], 'difficulty': dificuldade, 'level': linha['frases'],
+                'wpm': linha['wpm'], 'accuracy': linha['precisao'], 'errors': linha['erros'],
+                'score': linha['pontos'], 'time_played': tempo, 'date_played': agora,
+                'corrida_id': corrida.id, 'posicao': linha['posicao']
+            },
+            'desempenho': {
+                'user_id': linha['user_id'], 'wpm': linha['wpm'], 'accuracy': linha['precisao'],
+                'difficulty': dificuldade, 'errors': linha['erros'], 'date': agora
+            }
+        })
+    gravar_partidas(itens)
+    return corrida.id
+
+@app.route('/corrida')
+@login_required
+def corrida():
+    if not corridas_disponiveis():
+        flash('As corridas não estão disponíveis com vários servidores.', 'error')
+    return render_template('corrida.html', salas=corridas.abertas(), codigo=request.args.get('sala', ''))
+
+def _entrar_na_corrida(codigo):
+    espectador = current_user.role == 'professor'
+    sala = corridas.entrar(codigo, request.sid, current_user, espectador=espectador)
+    join_room(sala.sala_socketio)
+    emit('race_joined', dict(sala.estado_publico(), espectador=espectador, eu=current_user.id))
+    return sala
+
+@socketio.on('race_create')
+def handle_race_create(data):
+    if not current_user.is_authenticated:
+        emit('race_error', {'error': 'Usuário não autenticado'})
+        return
+    try:
+        dificuldade = min(max(int(data.get('difficulty', 1)), 1), 4)
+    except (TypeError, ValueError):
+        dificuldade = 1
+    frases = executor_banco.executar(sortear_lote, dificuldade, 1, app.config['CORRIDA_FRASES'], set())
+    sala = corridas.criar(current_user.id, dificuldade, [item['phrase'] for item in frases],
+                          app.config['CORRIDA_DURACAO'])
+    _entrar_na_corrida(sala.codigo)
+
+@socketio.on('race_join')
+def handle_race_join(data):
+    if not current_user.is_authenticated:
+        emit('race_error', {'error': 'Usuário não autenticado'})
+        return
+    try:
+        sala = _entrar_na_corrida(data.get('sala'))
+    except ErroCorrida as e:
+        emit('race_error', {'error': str(e)})
+        return
+    if sala.estado == 'em_andamento':
+        # Reconexão no meio da corrida: recebe as frases e o tempo restante
+        emit('race_started', {'sala': sala.codigo, 'frases': sala.frases, 'duracao': sala.duracao,
+                              'contagem': max(sala.largada - time.monotonic(), 0),
+                              'decorrido': sala.decorrido()})
+
+@socketio.on('race_start')
+def handle_race_start(data):
+    try:
+        sala = corridas.largar(request.sid, app.config['CORRIDA_CONTAGEM'])
+    except ErroCorrida as e:
+        emit('race_error', {'error': str(e)})
+        return
+    socketio.emit('race_state', sala.estado_publico(), room=sala.sala_socketio)
+    socketio.emit('race_started', {'sala': sala.codigo, 'frases': sala.frases, 'duracao': sala.duracao,
+                                   'contagem': app.config['CORRIDA_CONTAGEM'], 'decorrido': 0},
+                  room=sala.sala_socketio)
+
+@socketio.on('race_progress')
+def handle_race_progress(data):
+    corridas.progresso(request.sid, data or {})
+
+@socketio.on('race_leave')
+def handle_race_leave(data=None):
+    sala = corridas.sair(request.sid)
+    if sala is not None:
+        leave_room(sala.sala_socketio)
+
+# Monitor da turma ao vivo
+class AlunoMonitorado:
+    __slots__ = ('user_id', 'username', 'sids', 'dificuldade', 'nivel', 'wpm', 'precisao',
+                 'erros', 'pontos', 'estado', 'atualizado')
+
+    def __init__(self, user_id, username):
+        self.user_id = user_id
+        self.username = username
+        self.sids = set()
+        self.reiniciar(1)
+
+    def reiniciar(self, dificuldade):
+        self.dificuldade = dificuldade
+        self.nivel = 1
+        self.wpm = 0.0
+        self.precisao = 100.0
+        self.erros = 0
+        self.pontos = 0
+        self.estado = 'jogando'
+        self.atualizado = time.monotonic()
+
+    def linha(self):
+        return [self.user_id, self.username, self.dificuldade, self.nivel, round(self.wpm),
+                round(self.precisao, 1), self.erros, self.pontos, self.estado]
+
+class MonitorTurma:
+    """Estado atual de cada aluno jogando, para o monitor dos professores.
+
+    Os eventos do jogo só sobrescrevem os números do aluno (um objeto de
+    tamanho fixo por aluno, sem histórico) e marcam que ele mudou. A cada
+    ``intervalo`` segundos uma tarefa de fundo manda à sala dos professores
+    um quadro só com as linhas alteradas e os alunos que saíram; de tempos em
+    tempos vai um quadro completo, que também corrige quem perdeu algum. O
+    aluno sai do monitor quando a última conexão dele cai ou quando fica
+    ``inativo`` segundos sem mandar nada.
+    """
+
+    SALA = 'monitor_turma'
+
+    def __init__(self, intervalo, quadro_completo, inativo):
+        self.intervalo = intervalo
+        self.quadro_completo = quadro_completo
+        self.inativo = inativo
+        self.origem = os.urandom(4).hex()  # distingue os workers quando há fila de mensagens
+        self.alunos = {}     # user_id -> AlunoMonitorado
+        self._por_sid = {}   # sid -> user_id
+        self._alterados = set()
+        self._removidos = set()
+        self._quadros = 0
+        self._lock = threading.Lock()
+        self._iniciado = False
+
+    def _iniciar(self):
+        with self._lock:
+            if self._iniciado:
+                return
+            self._iniciado = True
+        socketio.start_background_task(self._executar)
+
+    def iniciar_jogo(self, sid, usuario, dificuldade):
+        if usuario.role == 'professor':
+            return
+        try:
+            dificuldade = min(max(int(dificuldade), 1), 4)
+        except (TypeError, ValueError):
+            dificuldade = 1
+        with self._lock:
+            aluno = self.alunos.get(usuario.id)
+            if aluno is None:
+                aluno = self.alunos[usuario.id] = AlunoMonitorado(usuario.id, usuario.username)
+            aluno.sids.add(sid)
+            aluno.reiniciar(dificuldade)
+            self._por_sid[sid] = usuario.id
+            self._alterados.add(usuario.id)
+            self._removidos.discard(usuario.id)
+        self._iniciar()
+
+    def atualizar(self, sid, dados):
+        """Sobrescreve os números do aluno dono do sid; O(1), nada é transmitido aqui."""
+        try:
+            nivel = int(dados.get('level', 1))
+            wpm = float(dados.get('wpm', 0))
+            precisao = float(dados.get('accuracy', 0))
+            erros = int(dados.get('errors', 0))
+            pontos = int(dados.get('score', 0))
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            aluno = self.alunos.get(self._por_sid.get(sid))
+            if aluno is None:
+                return
+            aluno.nivel = max(nivel, 1)
+            aluno.wpm = min(max(wpm, 0.0), 1000.0)
+            aluno.precisao = min(max(precisao, 0.0), 100.0)
+            aluno.erros = max(erros, 0)
+            aluno.pontos = max(pontos, 0)
+            aluno.estado = 'terminou' if dados.get('estado') == 'terminou' else 'jogando'
+            aluno.atualizado = time.monotonic()
+            self._alterados.add(aluno.user_id)
+
+    def desconectar(self, sid):
+        with self._lock:
+            user_id = self._por_sid.pop(sid, None)
+            aluno = self.alunos.get(user_id)
+            if aluno is None:
+                return
+            aluno.sids.discard(sid)
+            if not aluno.sids:
+                self._remover(user_id)
+
+    def _remover(self, user_id):
+        aluno = self.alunos.pop(user_id)
+        for sid in aluno.sids:
+            self._por_sid.pop(sid, None)
+        self._alterados.discard(user_id)
+        self._removidos.add(user_id)
+
+    def quadro_inicial(self):
+        """Todas as linhas deste worker, para o professor que acabou de entrar."""
+        self._iniciar()
+        with self._lock:
+            linhas = [aluno.linha() for aluno in self.alunos.values()]
+        return {'origem': self.origem, 'completo': True, 'alunos': linhas, 'removidos': []}
+
+    def quadro(self, completo=False):
+        """Linhas alteradas (ou todas) e alunos que saíram desde o último quadro."""
+        with self._lock:
+            limite = time.monotonic() - self.inativo
+            for user_id in [a.user_id for a in self.alunos.values() if a.atualizado < limite]:
+                self._remover(user_id)
+            ids = self.alunos if completo else self._alterados
+            linhas = [self.alunos[user_id].linha() for user_id in ids]
+            removidos = list(self._removidos)
+            self._alterados = set()
+            self._removidos = set()
+        return {'origem': self.origem, 'completo': completo, 'alunos': linhas, 'removidos': removidos}
+
+    def executar_quadro(self):
+        self._quadros += 1
+        completo = self._quadros % self.quadro_completo == 0
+        quadro = self.quadro(completo)
+        if completo or quadro['alunos'] or quadro['removidos']:
+            socketio.emit('monitor_delta', quadro, room=self.SALA)
+
+    def _executar(self):
+        while threading.main_thread().is_alive():
+            inicio = time.perf_counter()
+            try:
+                self.executar_quadro()
+            except Exception as e:
+                print(f"Erro no monitor da turma: {str(e)}")
+            socketio.sleep(max(self.intervalo - (time.perf_counter() - inicio), 0))
+
+monitor_turma = MonitorTurma(app.config['MONITOR_INTERVALO'], app.config['MONITOR_QUADRO_COMPLETO'],
+                             app.config['MONITOR_INATIVO'])
+
+@app.route('/monitor')
+@login_required
+def monitor():
+    if current_user.role != 'professor':
+        flash('Apenas professores podem acompanhar a turma.', 'error')
+        return redirect(url_for('index'))
+    membros = {}
+    for user_id, equipe_id in db.session.query(equipe_membros.c.user_id, equipe_membros.c.equipe_id):
+        membros.setdefault(equipe_id, []).append(user_id)
+    equipes = Equipe.query.order_by(Equipe.nome).all()
+    return render_template('monitor.html', equipes=equipes, membros=membros)
+
+@socketio.on('game_progress')
+def handle_game_progress(data):
+    monitor_turma.atualizar(request.sid, data or {})
+
+@socketio.on('monitor_subscribe')
+def handle_monitor_subscribe(data=None):
+    if not current_user.is_authenticated or current_user.role != 'professor':
+        emit('monitor_error', {'error': 'Apenas professores podem acompanhar a turma.'})
+        return
+    join_room(MonitorTurma.SALA)
+    # O quadro inicial vem só deste worker; os outros aparecem no próximo quadro completo deles
+    emit('monitor_delta', monitor_turma.quadro_inicial())
+
 # Rotas para gerenciamento de equipes
 @app.route('/equipes', methods=['GET', 'POST'])
 @login_required
@@ -805,14 +3243,6 @@ def gerenciar_equipes():
         flash('Apenas professores podem gerenciar equipes.', 'error')
         return redirect(url_for('index'))
     
-    # Garantir que todos os alunos tenham registro na tabela Aluno
-    alunos_users = User.query.filter_by(role='aluno').all()
-    for user in alunos_users:
-        if not Aluno.query.filter_by(user_id=user.id).first():
-            novo_aluno = Aluno(user_id=user.id, ativo=True)
-            db.session.add(novo_aluno)
-    db.session.commit()
-    
     if request.method == 'POST':
         acao = request.form.get('acao')
         
@@ -867,6 +3297,7 @@ def gerenciar_equipes():
                     equipe.membros.append(aluno)
             
             db.session.commit()
+            invalidar_painel()
             flash(f'{num_equipes} equipes sorteadas com sucesso!', 'success')
             return redirect(url_for('gerenciar_equipes'))
         
@@ -875,6 +3306,7 @@ def gerenciar_equipes():
             db.session.execute(equipe_membros.delete())
             Equipe.query.delete()
             db.session.commit()
+            invalidar_painel()
             flash('Todas as equipes foram removidas.', 'success')
             return redirect(url_for('gerenciar_equipes'))
     
@@ -884,7 +3316,9 @@ def gerenciar_equipes():
         .filter(User.role == 'aluno')\
         .all()
     
-    equipes = Equipe.query.all()
+    equipes = Equipe.query\
+        .options(selectinload(Equipe.equipe_membros).selectinload(User.aluno_info))\
+        .all()
     
     return render_template('equipes.html', 
                          alunos=alunos_com_status, 
@@ -980,6 +3414,7 @@ def atribuir_trabalho_aluno():
         nova_equipe.trabalhos.append(trabalho)
         db.session.add(nova_equipe)
         db.session.commit()
+        invalidar_painel()
         flash(f'Trabalho atribuído com sucesso para {aluno.username}!', 'success')
     
     return redirect(url_for('gerenciar_trabalhos'))
@@ -997,6 +3432,7 @@ def remover_atribuicao(trabalho_id, equipe_id):
     if trabalho in equipe.trabalhos:
         equipe.trabalhos.remove(trabalho)
         db.session.commit()
+        invalidar_painel()
         flash('Atribuição removida com sucesso!', 'success')
     else:
         flash('Esta equipe não tinha este trabalho atribuído.', 'info')
@@ -1022,6 +3458,7 @@ def remover_atribuicao_aluno(trabalho_id, aluno_id):
     if equipe and trabalho in equipe.trabalhos:
         equipe.trabalhos.remove(trabalho)
         db.session.commit()
+        invalidar_painel()
         flash('Atribuição removida com sucesso!', 'success')
     else:
         flash('Este aluno não tinha este trabalho atribuído.', 'info')
@@ -1043,7 +3480,8 @@ def gerenciar_entregas(trabalho_id):
         return render_template('entregas_professor.html',
                             trabalho=trabalho,
                             equipes=equipes,
-                            entregas=entregas)
+                            entregas=entregas,
+                            pares_suspeitos=pares_similares(trabalho_id))
     else:
         # Para alunos: redirecionar para sua entrega
         equipe = Equipe.query.join(equipe_membros).filter(
@@ -1057,9 +3495,779 @@ def gerenciar_entregas(trabalho_id):
             
         return redirect(url_for('entregas_aluno', trabalho_id=trabalho_id))
     
+class _SaidaZip(io.RawIOBase):
+    """Destino sem seek para o ZipFile: acumula o que foi escrito até ser retirado."""
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def retirar(self):
+        dados = b''.join(self._partes)
+        self._partes = []
+        return dados
+
+def _nome_no_zip(texto):
+    return texto.replace('/', '_').replace('\\', '_').strip(' .') or '_'
+
+def gerar_zip(itens, manifesto):
+    """Gera um ZIP em pedaços a partir de ``(nome, caminho, data)``.
+
+    Nada é montado em memória nem em disco: cada arquivo é lido em blocos e
+    repassado assim que o zipfile o escreve, então o consumo de memória não
+    depende do tamanho da turma. O manifesto CSV vai por último.
+    """
+    saida = _SaidaZip()
+    # ZIP_STORED: pdf, docx e imagens já são comprimidos; recomprimir só gastaria CPU
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_STORED) as arquivo_zip:
+        for nome, caminho, data in itens:
+            info = zipfile.ZipInfo(nome, date_time=(data or datetime.now()).timetuple()[:6])
+            info.file_size = os.path.getsize(caminho)  # define se precisa de ZIP64
+            with open(caminho, 'rb') as origem, arquivo_zip.open(info, 'w') as destino:
+                while True:
+                    bloco = origem.read(ArmazenamentoConteudo.TAMANHO_BLOCO)
+                    if not bloco:
+                        break
+                    destino.write(bloco)
+                    yield saida.retirar()
+            yield saida.retirar()
+        arquivo_zip.writestr('manifesto.csv', manifesto)
+    yield saida.retirar()
+
+def _caminho_do_arquivo(arquivo):
+    if arquivo is None or arquivo.is_link:
+        return None
+    if arquivo.content_hash:
+        caminho = armazenamento.caminho(arquivo.content_hash)
+    else:
+        caminho = safe_join(os.path.join(app.root_path, app.config['UPLOAD_FOLDER']), arquivo.filename)
+    return caminho if caminho and os.path.isfile(caminho) else None
+
+@app.route('/trabalhos/<int:trabalho_id>/entregas.zip')
+@login_required
+def exportar_entregas(trabalho_id):
+    if current_user.role != 'professor':
+        abort(403)
+    trabalho = Trabalho.query.get_or_404(trabalho_id)
+    entregas = Entrega.query.filter_by(trabalho_id=trabalho_id)\
+        .options(selectinload(Entrega.equipe), selectinload(Entrega.arquivo))\
+        .order_by(Entrega.equipe_id, Entrega.data_entrega, Entrega.id)\
+        .all()
+
+    # Tudo que vem do banco é lido aqui; o gerador roda depois do fim da requisição
+    itens = []
+    linhas = io.StringIO()
+    escritor = csv.writer(linhas)
+    escritor.writerow(['equipe', 'entrega_id', 'data_entrega', 'arquivo', 'tamanho', 'nota', 'feedback', 'comentarios'])
+    for entrega in entregas:
+        arquivo = entrega.arquivo
+        caminho = _caminho_do_arquivo(arquivo)
+        if caminho:
+            nome = f'{_nome_no_zip(entrega.equipe.nome)}/{entrega.id}_{_nome_no_zip(arquivo.filename)}'
+            itens.append((nome, caminho, entrega.data_entrega))
+            descricao = nome
+        elif arquivo is not None and arquivo.is_link:
+            descricao = arquivo.path
+        else:
+            descricao = 'arquivo ausente'
+        escritor.writerow([
+            entrega.equipe.nome,
+            entrega.id,
+            _data_iso(entrega.data_entrega),
+            descricao,
+            os.path.getsize(caminho) if caminho else '',
+            '' if entrega.nota is None else entrega.nota,
+            entrega.feedback or '',
+            entrega.comentarios or '',
+        ])
+    manifesto = linhas.getvalue().encode('utf-8-sig')  # BOM para o Excel abrir com acentos
+
+    resposta = app.response_class(gerar_zip(itens, manifesto), mimetype='application/zip')
+    resposta.headers.set('Content-Disposition', 'attachment',
+                         filename=f'entregas_trabalho_{trabalho.id}.zip')
+    return resposta
+
+# Extração de texto das entregas
+EXTENSOES_TEXTO = {'txt', 'docx', 'xlsx'}
+_WORD = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_PLANILHA = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+def extensao_do_arquivo(nome):
+    return nome.rsplit('.', 1)[1].lower() if nome and '.' in nome else ''
+
+def _decodificar(dados):
+    try:
+        return dados.decode('utf-8-sig')
+    except UnicodeDecodeError as erro:
+        if erro.start >= len(dados) - 3:  # caractere cortado no fim da leitura
+            return dados[:erro.start].decode('utf-8-sig')
+        return dados.decode('cp1252', errors='replace')
+
+def _texto_docx(pacote):
+    with pacote.open('word/document.xml') as xml:
+        for _, elemento in ElementTree.iterparse(xml):
+            if elemento.tag == _WORD + 't':
+                yield elemento.text or ''
+            elif elemento.tag == _WORD + 'tab':
+                yield '\t'
+            elif elemento.tag == _WORD + 'p':
+                yield '\n'
+                elemento.clear()
+
+def _texto_xlsx(pacote):
+    nomes = pacote.namelist()
+    compartilhadas = []
+    if 'xl/sharedStrings.xml' in nomes:
+        with pacote.open('xl/sharedStrings.xml') as xml:
+            for _, elemento in ElementTree.iterparse(xml):
+                if elemento.tag == _PLANILHA + 'si':
+                    compartilhadas.append(''.join(t.text or '' for t in elemento.iter(_PLANILHA + 't')))
+                    elemento.clear()
+
+    planilhas = sorted((nome for nome in nomes
+                        if nome.startswith('xl/worksheets/sheet') and nome.endswith('.xml')),
+                       key=lambda nome: int(re.sub(r'\D', '', nome) or 0))
+    for nome in planilhas:
+        with pacote.open(nome) as xml:
+            celulas = []
+            for _, elemento in ElementTree.iterparse(xml):
+                if elemento.tag == _PLANILHA + 'c':
+                    tipo = elemento.get('t')
+                    valor = elemento.find(_PLANILHA + 'v')
+                    if tipo == 's' and valor is not None:
+                        celulas.append(compartilhadas[int(valor.text)])
+                    elif tipo == 'inlineStr':
+                        celulas.append(''.join(t.text or '' for t in elemento.iter(_PLANILHA + 't')))
+                    elif valor is not None and valor.text:
+                        celulas.append(valor.text)
+                elif elemento.tag == _PLANILHA + 'row':
+                    if celulas:
+                        yield '\t'.join(celulas) + '\n'
+                    celulas = []
+                    elemento.clear()
+
+def extrair_texto(caminho, extensao, limite):
+    """Texto puro de um .txt, .docx ou .xlsx, com no máximo ``limite`` caracteres.
+
+    Roda nos processos do pool: usa só a biblioteca padrão (docx e xlsx são
+    ZIPs com XML, lidos em streaming) e não acessa o banco.
+    """
+    if extensao == 'txt':
+        with open(caminho, 'rb') as arquivo:
+            return _decodificar(arquivo.read(limite * 4))[:limite]
+
+    partes = []
+    total = 0
+    with zipfile.ZipFile(caminho) as pacote:
+        leitor = _texto_docx(pacote) if extensao == 'docx' else _texto_xlsx(pacote)
+        for parte in leitor:
+            partes.append(parte)
+            total += len(parte)
+            if total >= limite:
+                break
+        leitor.close()
+    return ''.join(partes)[:limite]
+
+def _hash64(texto):
+    return int.from_bytes(hashlib.blake2b(texto.encode('utf-8'), digest_size=8).digest(), 'big')
+
+@functools.lru_cache(maxsize=None)
+def _mascaras_minhash(permutacoes):
+    gerador = random.Random(20240501)  # fixo: assinaturas calculadas em momentos diferentes precisam bater
+    return tuple(gerador.getrandbits(64) for _ in range(permutacoes))
+
+def assinatura_minhash(texto, permutacoes, tamanho_shingle):
+    """Assinatura MinHash do conjunto de shingles (sequências de palavras) do texto.
+
+    Cada shingle vira um hash de 64 bits; cada "permutação" é um XOR com uma
+    máscara fixa, e a assinatura guarda o menor valor de cada uma. A fração de
+    posições iguais entre duas assinaturas estima o Jaccard dos textos.
+    """
+    palavras = re.findall(r'\w+', texto.lower())
+    hashes = {_hash64(' '.join(palavras[i:i + tamanho_shingle]))
+              for i in range(len(palavras) - tamanho_shingle + 1)}
+    if not hashes:
+        return None
+    return array.array('Q', (min(map(mascara.__xor__, hashes))
+                             for mascara in _mascaras_minhash(permutacoes))).tobytes()
+
+def bandas_lsh(assinatura, bandas):
+    valores = array.array('Q', assinatura)
+    linhas = len(valores) // bandas
+    return [(banda, int.from_bytes(hashlib.blake2b(valores[banda * linhas:(banda + 1) * linhas].tobytes(),
+                                                   digest_size=8).digest(), 'big', signed=True))
+            for banda in range(bandas)]
+
+def similaridade_estimada(assinatura_a, assinatura_b):
+    a, b = array.array('Q', assinatura_a), array.array('Q', assinatura_b)
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+def processar_entrega(caminho, extensao, limite, permutacoes, tamanho_shingle):
+    """Tarefa do pool: extrai o texto e já calcula a assinatura MinHash."""
+    texto = extrair_texto(caminho, extensao, limite)
+    return texto, assinatura_minhash(texto, permutacoes, tamanho_shingle)
+
+def salvar_assinatura(registro, assinatura):
+    """Grava a assinatura no TextoEntrega e troca os baldes LSH da entrega."""
+    registro.assinatura = assinatura
+    BandaSimilaridade.query.filter_by(entrega_id=registro.entrega_id).delete()
+    if assinatura:
+        db.session.add_all(BandaSimilaridade(entrega_id=registro.entrega_id, banda=banda, valor=valor)
+                           for banda, valor in bandas_lsh(assinatura, app.config['SIMILARIDADE_BANDAS']))
+
+def pares_similares(trabalho_id=None, limiar=None):
+    """Pares de entregas de equipes diferentes com similaridade estimada >= limiar.
+
+    Só os pares que caem no mesmo balde LSH em alguma banda são comparados,
+    então o custo cresce com o número de candidatos, não com o de pares
+    possíveis. Com ``trabalho_id``, busca pares em que uma das entregas é
+    desse trabalho (a outra pode ser de qualquer trabalho ou semestre).
+    """
+    limiar = app.config['SIMILARIDADE_LIMIAR'] if limiar is None else limiar
+    if trabalho_id is None:
+        sql = ('SELECT DISTINCT a.entrega_id, b.entrega_id FROM banda_similaridade a '
+               'JOIN banda_similaridade b ON b.banda = a.banda AND b.valor = a.valor '
+               'AND b.entrega_id > a.entrega_id')
+    else:
+        sql = ('SELECT DISTINCT a.entrega_id, b.entrega_id FROM banda_similaridade a '
+               'JOIN banda_similaridade b ON b.banda = a.banda AND b.valor = a.valor '
+               'AND b.entrega_id != a.entrega_id '
+               'WHERE a.entrega_id IN (SELECT id FROM entrega WHERE trabalho_id = :trabalho_id)')
+    candidatos = {tuple(sorted(par)) for par in
+                  db.session.execute(text(sql), {'trabalho_id': trabalho_id}).fetchall()}
+    if not candidatos:
+        return []
+
+    ids = {entrega_id for par in candidatos for entrega_id in par}
+    assinaturas = dict(db.session.query(TextoEntrega.entrega_id, TextoEntrega.assinatura)
+                       .filter(TextoEntrega.entrega_id.in_(ids)).all())
+    equipes = dict(db.session.query(Entrega.id, Entrega.equipe_id).filter(Entrega.id.in_(ids)).all())
+
+    pares = []
+    for a, b in candidatos:
+        if equipes.get(a) == equipes.get(b) or not assinaturas.get(a) or not assinaturas.get(b):
+            continue  # reenvios da mesma equipe são naturalmente parecidos
+        similaridade = similaridade_estimada(assinaturas[a], assinaturas[b])
+        if similaridade >= limiar:
+            pares.append((a, b, similaridade))
+    if not pares:
+        return []
+
+    entregas = {entrega.id: entrega for entrega in
+                Entrega.query.options(selectinload(Entrega.equipe), selectinload(Entrega.trabalho))
+                .filter(Entrega.id.in_({entrega_id for par in pares for entrega_id in par[:2]})).all()}
+    resultado = []
+    for a, b, similaridade in sorted(pares, key=lambda par: -par[2]):
+        entrega, outra = entregas[a], entregas[b]
+        if trabalho_id is not None and entrega.trabalho_id != trabalho_id:
+            entrega, outra = outra, entrega
+        resultado.append({'entrega': entrega, 'outra': outra, 'similaridade': similaridade})
+    return resultado
+
+class ExtratorTextos:
+    """Extrai o texto das entregas num pool de processos.
+
+    O banco é a fila: entregas com ``status_extracao = 'pendente'`` esperam ali
+    e no máximo ``em_andamento`` vão para o pool de cada vez (o resto fica
+    pendente até abrir vaga). Cada falha conta uma tentativa; depois de
+    ``tentativas`` a entrega fica com status 'erro'.
+
+    O callback dos futuros roda na thread de gerenciamento do pool e só põe o
+    resultado numa fila; uma thread própria grava no banco e agenda as próximas.
+    """
+
+    def __init__(self, processos, em_andamento, tentativas):
+        self.processos = processos
+        self.em_andamento = em_andamento
+        self.tentativas = tentativas
+        self._lock = threading.Lock()
+        self._executor = None
+        self._futuros = {}  # entrega_id -> Future
+        self._concluidos = queue.Queue()
+        self._gravador = None
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.processos, mp_context=contexto_processos())
+            atexit.register(self.encerrar)
+        if self._gravador is None:
+            self._gravador = threading.Thread(target=self._gravar_concluidos, daemon=True,
+                                              name='extrator-textos')
+            self._gravador.start()
+        return self._executor
+
+    def solicitar(self):
+        """Chamado pelas rotas: agenda numa tarefa de fundo, sem segurar a requisição."""
+        socketio.start_background_task(self.agendar)
+
+    def agendar(self):
+        """Envia ao pool as entregas pendentes que couberem."""
+        enviados = []
+        with app.app_context(), self._lock:
+            vagas = self.em_andamento - len(self._futuros)
+            if vagas <= 0:
+                return
+            consulta = Entrega.query.options(selectinload(Entrega.arquivo))\
+                .filter(Entrega.status_extracao == 'pendente')
+            if self._futuros:
+                consulta = consulta.filter(Entrega.id.notin_(list(self._futuros)))
+            entregas = consulta.order_by(Entrega.id).limit(vagas).all()
+
+            sem_arquivo = []
+            for entrega in entregas:
+                caminho = _caminho_do_arquivo(entrega.arquivo)
+                if caminho is None:
+                    sem_arquivo.append(entrega)
+                    continue
+                argumentos = (caminho, extensao_do_arquivo(entrega.arquivo.filename),
+                              app.config['EXTRACAO_LIMITE_CARACTERES'],
+                              app.config['SIMILARIDADE_PERMUTACOES'],
+                              app.config['SIMILARIDADE_SHINGLE'])
+                try:
+                    futuro = self._pool().submit(processar_entrega, *argumentos)
+                except BrokenProcessPool:
+                    # um processo morreu (falta de memória, por exemplo): recria o pool
+                    self._executor = None
+                    futuro = self._pool().submit(processar_entrega, *argumentos)
+                self._futuros[entrega.id] = futuro
+                enviados.append((entrega.id, futuro))
+
+            for entrega in sem_arquivo:
+                entrega.status_extracao = 'erro'
+                print(f"Entrega {entrega.id}: arquivo não encontrado para extrair o texto")
+            if sem_arquivo:
+                db.session.commit()
+            db.session.remove()
+
+        # Fora do lock: se o futuro já terminou, o callback roda aqui mesmo
+        for entrega_id, futuro in enviados:
+            futuro.add_done_callback(functools.partial(self._ao_terminar, entrega_id))
+
+    def _ao_terminar(self, entrega_id, futuro):
+        # Na thread de gerenciamento do pool: um commit lento ou uma exceção
+        # aqui travariam ou quebrariam o pool, então só repassa ao gravador
+        self._concluidos.put((entrega_id, futuro))
+
+    def _gravar_concluidos(self):
+        while True:
+            entrega_id, futuro = self._concluidos.get()
+            try:
+                self._concluir(entrega_id, futuro)
+            except Exception as e:
+                print(f"Erro ao concluir a extração da entrega {entrega_id}: {str(e)}")
+
+    def _concluir(self, entrega_id, futuro):
+        with app.app_context():
+            try:
+                entrega = Entrega.query.get(entrega_id)
+                if entrega is not None:
+                    try:
+                        texto, assinatura = futuro.result()
+                    except Exception as e:
+                        entrega.tentativas_extracao = (entrega.tentativas_extracao or 0) + 1
+                        if entrega.tentativas_extracao >= self.tentativas:
+                            entrega.status_extracao = 'erro'
+                        print(f"Erro ao extrair texto da entrega {entrega_id} "
+                              f"(tentativa {entrega.tentativas_extracao}): {str(e)}")
+                    else:
+                        registro = entrega.texto_extraido or TextoEntrega(entrega=entrega)
+                        registro.texto = texto
+                        registro.data_extracao = datetime.now(cuiaba_tz)
+                        salvar_assinatura(registro, assinatura)
+                        entrega.status_extracao = 'concluido'
+                    db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Erro ao salvar texto da entrega {entrega_id}: {str(e)}")
+            finally:
+                db.session.remove()
+
+        with self._lock:
+            self._futuros.pop(entrega_id, None)
+        if threading.main_thread().is_alive():
+            self.agendar()
+
+    def aguardar(self):
+        """Processa todas as pendentes e espera terminar (usado pelo comando flask)."""
+        while True:
+            self.agendar()
+            with self._lock:
+                futuros = list(self._futuros.values())
+            if not futuros:
+                return
+            for futuro in futuros:
+                try:
+                    futuro.result()
+                except Exception:
+                    pass
+            time.sleep(0.05)  # dá tempo para o callback gravar e liberar a vaga
+
+    def encerrar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+extrator_textos = ExtratorTextos(app.config['EXTRACAO_PROCESSOS'],
+                                 app.config['EXTRACAO_EM_ANDAMENTO'],
+                                 app.config['EXTRACAO_TENTATIVAS'])
+
+@app.cli.command('extrair-textos')
+def extrair_textos_comando():
+    """Extrai o texto de todas as entregas pendentes."""
+    extrator_textos.aguardar()
+    with app.app_context():
+        contagem = dict(db.session.query(Entrega.status_extracao, func.count())
+                        .filter(Entrega.status_extracao.isnot(None))
+                        .group_by(Entrega.status_extracao).all())
+    print(f"Extração de texto: {contagem}")
+
+def _assinar_texto(dados):
+    texto = zlib.decompress(dados).decode('utf-8')
+    return assinatura_minhash(texto, app.config['SIMILARIDADE_PERMUTACOES'], app.config['SIMILARIDADE_SHINGLE'])
+
+@app.cli.command('reconstruir-similaridade')
+def reconstruir_similaridade_comando():
+    """Recalcula as assinaturas MinHash e os baldes LSH de todos os textos extraídos."""
+    total = 0
+    with ProcessPoolExecutor(max_workers=app.config['EXTRACAO_PROCESSOS'], mp_context=contexto_processos()) as pool:
+        ids = [linha[0] for linha in db.session.query(TextoEntrega.entrega_id).order_by(TextoEntrega.entrega_id)]
+        for inicio in range(0, len(ids), 500):
+            registros = TextoEntrega.query.filter(TextoEntrega.entrega_id.in_(ids[inicio:inicio + 500])).all()
+            for registro, assinatura in zip(registros, pool.map(_assinar_texto, [r.dados for r in registros],
+                                                                chunksize=20)):
+                salvar_assinatura(registro, assinatura)
+            db.session.commit()
+            total += len(registros)
+    print(f"Assinaturas recalculadas para {total} entregas")
+
+@app.route('/metrics')
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    autorizado = token and request.headers.get('Authorization') == f'Bearer {token}'
+    if not autorizado and not (current_user.is_authenticated and current_user.role == 'professor'):
+        abort(403)
+    return app.response_class(gerar_metricas_prometheus(),
+                              content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Busca textual (SQLite FTS5)
+# Um único índice "busca" para frases, trabalhos, arquivos e entregas. O rowid
+# codifica a origem (id * 8 + tipo), então os triggers atualizam e removem pelo
+# rowid sem varrer o índice. "pai" guarda o dono do arquivo ou o trabalho da
+# entrega, usado no filtro por papel e nos links do resultado.
+TIPOS_BUSCA = {1: 'frase', 2: 'trabalho', 3: 'arquivo', 4: 'entrega'}
+
+# tipo -> (tabela, título, conteúdo, pai, colunas observadas); {r} é a linha (new/old/tabela)
+FONTES_BUSCA = {
+    1: ('frase_digitação', "''", '{r}.texto', 'NULL', 'texto'),
+    2: ('trabalho', '{r}.titulo', "coalesce({r}.descricao, '')", 'NULL', 'titulo, descricao'),
+    3: ('arquivo', "coalesce({r}.filename, '')", "coalesce({r}.description, '')", '{r}.user_id',
+        'filename, description, user_id'),
+    4: ('entrega', "''", "coalesce({r}.comentarios, '') || ' ' || coalesce({r}.feedback, '')",
+        '{r}.trabalho_id', 'comentarios, feedback, trabalho_id'),
+}
+
+MARCA_INICIO, MARCA_FIM = '\x02', '\x03'
+
+def _sql_indice_busca():
+    comandos = [
+        'CREATE VIRTUAL TABLE IF NOT EXISTS busca USING fts5('
+        'titulo, conteudo, pai UNINDEXED, '
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    ]
+    for tipo, (tabela, titulo, conteudo, pai, colunas) in FONTES_BUSCA.items():
+        inserir = (f'INSERT INTO busca (rowid, titulo, conteudo, pai) VALUES '
+                   f'(new.id * 8 + {tipo}, {titulo.format(r="new")}, {conteudo.format(r="new")}, '
+                   f'{pai.format(r="new")});')
+        remover = f'DELETE FROM busca WHERE rowid = old.id * 8 + {tipo};'
+        comandos += [
+            f'CREATE TRIGGER IF NOT EXISTS busca_{tabela}_ai AFTER INSERT ON "{tabela}" BEGIN {inserir} END',
+            f'CREATE TRIGGER IF NOT EXISTS busca_{tabela}_au AFTER UPDATE OF {colunas} ON "{tabela}" '
+            f'BEGIN {remover} {inserir} END',
+            f'CREATE TRIGGER IF NOT EXISTS busca_{tabela}_ad AFTER DELETE ON "{tabela}" BEGIN {remover} END',
+        ]
+    return comandos
+
+def reconstruir_indice_busca(conexao):
+    """Recria o conteúdo do índice a partir das tabelas de origem."""
+    conexao.execute(text('DELETE FROM busca'))
+    for tipo, (tabela, titulo, conteudo, pai, _) in FONTES_BUSCA.items():
+        r = f'"{tabela}"'
+        conexao.execute(text(
+            f'INSERT INTO busca (rowid, titulo, conteudo, pai) '
+            f'SELECT {r}.id * 8 + {tipo}, {titulo.format(r=r)}, {conteudo.format(r=r)}, {pai.format(r=r)} '
+            f'FROM {r}'
+        ))
+    conexao.execute(text("INSERT INTO busca (busca) VALUES ('optimize')"))
+    return conexao.execute(text('SELECT count(*) FROM busca')).scalar()
+
+def _consulta_fts(texto):
+    # Cada palavra vira um termo entre aspas com prefixo ("digi"*): o que o
+    # usuário digita nunca é interpretado como sintaxe do FTS5
+    palavras = re.findall(r'\w+', texto or '')[:8]
+    return ' '.join(f'"{palavra}"*' for palavra in palavras)
+
+def _trecho(texto):
+    if not texto:
+        return ''
+    return Markup(str(escape(texto)).replace(MARCA_INICIO, '<mark>').replace(MARCA_FIM, '</mark>'))
+
+def buscar(texto, usuario, limite=None):
+    """Resultados ordenados por relevância (bm25, título pesa mais que o conteúdo).
+
+    Professores veem tudo. Alunos veem os trabalhos e entregas das suas
+    equipes e os arquivos enviados por professores ou por eles mesmos.
+    """
+    consulta = _consulta_fts(texto)
+    if not consulta:
+        return []
+    filtro = ''
+    if usuario.role != 'professor':
+        filtro = """AND (
+            (rowid % 8 = 2 AND rowid / 8 IN (
+                SELECT et.trabalho_id FROM equipe_trabalho et
+                JOIN equipe_membros em ON em.equipe_id = et.equipe_id WHERE em.user_id = :usuario))
+            OR (rowid % 8 = 3 AND (pai = :usuario OR pai IN (SELECT id FROM user WHERE role = 'professor')))
+            OR (rowid % 8 = 4 AND EXISTS (
+                SELECT 1 FROM entrega e
+                JOIN equipe_membros em ON em.equipe_id = e.equipe_id
+                WHERE e.id = busca.rowid / 8 AND em.user_id = :usuario))
+        )"""
+    linhas = db.session.execute(text(f"""
+        SELECT rowid,
+               highlight(busca, 0, :inicio, :fim) AS titulo,
+               snippet(busca, 1, :inicio, :fim, '…', 16) AS trecho,
+               pai
+        FROM busca
+        WHERE busca MATCH :consulta {filtro}
+        ORDER BY bm25(busca, 4.0, 1.0)
+        LIMIT :limite
+    """), {
+        'consulta': consulta,
+        'usuario': usuario.id,
+        'inicio': MARCA_INICIO,
+        'fim': MARCA_FIM,
+        'limite': limite or app.config['BUSCA_RESULTADOS'],
+    }).fetchall()
+
+    professor = usuario.role == 'professor'
+    resultados = []
+    for rowid, titulo, trecho, pai in linhas:
+        id_origem, tipo = divmod(rowid, 8)
+        if tipo == 1:
+            url = url_for('gerenciar_frases')
+        elif tipo == 2:
+            url = url_for('gerenciar_entregas' if professor else 'entregas_aluno', trabalho_id=id_origem)
+        elif tipo == 3:
+            url = url_for('download_file', file_id=id_origem)
+        else:
+            url = (url_for('avaliar_entrega', entrega_id=id_origem) if professor
+                   else url_for('entregas_aluno', trabalho_id=pai))
+        resultados.append({
+            'tipo': TIPOS_BUSCA[tipo],
+            'id': id_origem,
+            'titulo': _trecho(titulo),
+            'trecho': _trecho(trecho),
+            'url': url,
+        })
+    return resultados
+
+@app.route('/buscar')
+@login_required
+def buscar_pagina():
+    termo = request.args.get('q', '').strip()
+    resultados = buscar(termo, current_user)
+    return render_template('busca.html', termo=termo, resultados=resultados)
+
+@app.route('/api/buscar')
+@login_required
+def api_buscar():
+    resultados = buscar(request.args.get('q', ''), current_user,
+                        min(request.args.get('limite', app.config['BUSCA_RESULTADOS'], type=int), 100))
+    for resultado in resultados:
+        resultado['titulo'] = str(resultado['titulo'])
+        resultado['trecho'] = str(resultado['trecho'])
+    return jsonify({'resultados': resultados})
+
+@app.cli.command('reconstruir-busca')
+def reconstruir_busca_comando():
+    """Recria o índice FTS5 da busca a partir das tabelas."""
+    with db.engine.begin() as conexao:
+        total = reconstruir_indice_busca(conexao)
+    print(f"Índice de busca reconstruído com {total} documentos")
+
+SQL_SINCRONIZAR_ALUNOS = (
+    "INSERT INTO aluno (user_id, ativo) "
+    "SELECT u.id, 1 FROM user u "
+    "WHERE u.role = 'aluno' AND NOT EXISTS (SELECT 1 FROM aluno a WHERE a.user_id = u.id)"
+)
+
+def sincronizar_alunos():
+    """Cria, num único INSERT ... SELECT, o registro Aluno que falta para usuários antigos."""
+    with db.engine.begin() as conexao:
+        return conexao.execute(text(SQL_SINCRONIZAR_ALUNOS)).rowcount
+
+@app.cli.command('sincronizar-alunos')
+def sincronizar_alunos_comando():
+    """Garante um registro Aluno para cada usuário com papel 'aluno'."""
+    print(f"{sincronizar_alunos()} registros de aluno criados")
+
+def adicionar_coluna(tabela, coluna, tipo):
+    """Passo de migração que adiciona a coluna só se ela ainda não existir."""
+    def passo(conexao):
+        existentes = {linha[1] for linha in conexao.execute(text(f'PRAGMA table_info("{tabela}")'))}
+        if coluna not in existentes:
+            conexao.execute(text(f'ALTER TABLE "{tabela}" ADD COLUMN {coluna} {tipo}'))
+    return passo
+
+def migrar_arquivos_para_conteudo(conexao):
+    """Copia os arquivos antigos da pasta de uploads para o armazenamento por hash.
+
+    Os originais só são apagados pela função devolvida, que aplicar_migracoes
+    chama depois do commit; se a transação falhar, as linhas continuam
+    apontando para arquivos que ainda existem.
+    """
+    pasta = app.config['UPLOAD_FOLDER']
+    linhas = conexao.execute(text(
+        'SELECT id, path, filename FROM arquivo '
+        'WHERE content_hash IS NULL AND (is_link IS NULL OR is_link = 0)'
+    )).fetchall()
+
+    por_origem = {}
+    for id_arquivo, caminho, filename in linhas:
+        candidatos = [caminho, os.path.join(app.root_path, caminho or ''),
+                      os.path.join(app.root_path, pasta, filename or '')]
+        origem = next((c for c in candidatos if c and os.path.isfile(c)), None)
+        if origem is None:
+            print(f"Arquivo {id_arquivo} não encontrado no disco; mantido como está")
+            continue
+        por_origem.setdefault(os.path.abspath(origem), []).append(id_arquivo)
+
+    for origem, ids in por_origem.items():
+        with open(origem, 'rb') as fluxo:
+            chave, tamanho = armazenamento.salvar(fluxo)
+        conexao.execute(
+            Arquivo.__table__.update()
+            .where(Arquivo.__table__.c.id.in_(ids))
+            .values(content_hash=chave, size=tamanho, path=armazenamento.chave_relativa(chave))
+        )
+
+    def apagar_originais():
+        for origem in por_origem:
+            try:
+                os.remove(origem)
+            except OSError as e:
+                print(f"Não foi possível apagar {origem}: {str(e)}")
+    return apagar_originais
+
+# Migrações do esquema
+# db.create_all() só cria tabelas novas; alterações em bancos existentes (índices,
+# colunas) entram aqui, em ordem. Cada passo é um SQL ou uma função que recebe a
+# conexão, e a versão aplicada fica registrada na tabela schema_version. Se a função
+# devolver outra função, esta só roda depois do commit (efeitos fora do banco).
+MIGRACOES = [
+    (1, 'Índices das consultas mais frequentes', [
+        'CREATE INDEX IF NOT EXISTS ix_desempenho_user_id ON desempenho (user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_game_result_user_id_date_played ON game_result (user_id, date_played)',
+        'CREATE INDEX IF NOT EXISTS ix_entrega_trabalho_id_equipe_id ON entrega (trabalho_id, equipe_id)',
+        'CREATE INDEX IF NOT EXISTS ix_aluno_user_id ON aluno (user_id)',
+        'CREATE INDEX IF NOT EXISTS "ix_frase_digitação_nivel_dificuldade" ON "frase_digitação" (nivel_dificuldade)',
+        'CREATE INDEX IF NOT EXISTS ix_nota_professor_id ON nota (professor_id)',
+    ]),
+    (2, 'Armazenamento de arquivos por hash do conteúdo', [
+        adicionar_coluna('arquivo', 'content_hash', 'VARCHAR(64)'),
+        adicionar_coluna('arquivo', 'size', 'INTEGER'),
+        'CREATE INDEX IF NOT EXISTS ix_arquivo_content_hash ON arquivo (content_hash)',
+        migrar_arquivos_para_conteudo,
+    ]),
+    (3, 'Índices da listagem paginada de arquivos', [
+        'CREATE INDEX IF NOT EXISTS ix_arquivo_upload_date_id ON arquivo (upload_date, id)',
+        'CREATE INDEX IF NOT EXISTS ix_arquivo_user_id_upload_date_id ON arquivo (user_id, upload_date, id)',
+    ]),
+    (4, 'Índice FTS5 da busca textual', _sql_indice_busca() + [reconstruir_indice_busca]),
+    (5, 'Status da extração de texto das entregas', [
+        adicionar_coluna('entrega', 'status_extracao', 'VARCHAR(20)'),
+        adicionar_coluna('entrega', 'tentativas_extracao', 'INTEGER DEFAULT 0'),
+        "UPDATE entrega SET status_extracao = 'pendente' "
+        "WHERE status_extracao IS NULL AND arquivo_id IN ("
+        "SELECT id FROM arquivo WHERE (is_link IS NULL OR is_link = 0) AND ("
+        "lower(filename) LIKE '%.txt' OR lower(filename) LIKE '%.docx' OR lower(filename) LIKE '%.xlsx'))",
+    ]),
+    (6, 'Assinaturas MinHash e baldes LSH das entregas', [
+        adicionar_coluna('texto_entrega', 'assinatura', 'BLOB'),
+        'CREATE INDEX IF NOT EXISTS ix_banda_similaridade_banda_valor ON banda_similaridade (banda, valor)',
+    ]),
+    (7, 'Registro Aluno para usuários antigos', [SQL_SINCRONIZAR_ALUNOS]),
+    (8, 'Resultados das corridas', [
+        adicionar_coluna('game_result', 'corrida_id', 'INTEGER REFERENCES corrida (id)'),
+        adicionar_coluna('game_result', 'posicao', 'INTEGER'),
+        'CREATE INDEX IF NOT EXISTS ix_game_result_corrida_id ON game_result (corrida_id)',
+    ]),
+    (9, 'Melhor partida no UserStats (ranking sem varrer o desempenho)', [
+        adicionar_coluna('user_stats', 'best_accuracy', 'FLOAT'),
+        adicionar_coluna('user_stats', 'best_difficulty', 'INTEGER'),
+        adicionar_coluna('user_stats', 'best_date', 'DATETIME'),
+    ] + [adicionar_coluna('user_stats', f'best_accuracy_{d}', 'FLOAT') for d in DIFICULDADES]
+      + [adicionar_coluna('user_stats', f'best_date_{d}', 'DATETIME') for d in DIFICULDADES]
+      # Bancos antigos têm histórico mas nenhuma linha no UserStats (create_all cria
+      # a tabela vazia): o resumo inteiro sai do Desempenho/GameResult, com a melhor partida
+      + [preencher_estatisticas]),
+    (10, 'Contador de alterações da tabela de frases', _sql_contador_alteracoes('frase_digitação')),
+]
+
+def aplicar_migracoes():
+    """Aplica as migrações pendentes, cada uma em sua própria transação."""
+    with db.engine.begin() as conexao:
+        conexao.execute(text('CREATE TABLE IF NOT EXISTS schema_version (versao INTEGER NOT NULL)'))
+        versao_atual = conexao.execute(text('SELECT MAX(versao) FROM schema_version')).scalar() or 0
+
+    aplicadas = []
+    for versao, descricao, passos in MIGRACOES:
+        if versao <= versao_atual:
+            continue
+        depois_do_commit = []
+        with db.engine.begin() as conexao:
+            for passo in passos:
+                if callable(passo):
+                    resultado = passo(conexao)
+                    if callable(resultado):
+                        depois_do_commit.append(resultado)
+                else:
+                    conexao.execute(text(passo))
+            conexao.execute(text('INSERT INTO schema_version (versao) VALUES (:versao)'), {'versao': versao})
+        for acao in depois_do_commit:
+            acao()
+        print(f"Migração {versao} aplicada: {descricao}")
+        aplicadas.append(versao)
+    return aplicadas
+
+@app.cli.command('corretor-mensagens')
+@click.option('--host', help='padrão: o da SOCKETIO_MESSAGE_QUEUE local://, ou 127.0.0.1')
+@click.option('--porta', type=int, help='padrão: a da SOCKETIO_MESSAGE_QUEUE local://, ou 5600')
+def corretor_mensagens_comando(host, porta):
+    """Roda o broker embutido que liga os workers (SOCKETIO_MESSAGE_QUEUE=local://host:porta)."""
+    url = app.config['SOCKETIO_MESSAGE_QUEUE'] or ''
+    partes = urlsplit(url if url.startswith('local://') else 'local://')
+    corretor = CorretorMensagens(host or partes.hostname or '127.0.0.1', porta or partes.port or 5600)
+    print(f"Broker de mensagens em {':'.join(map(str, corretor.escutar()))}")
+    corretor.executar()
+
+@app.cli.command('migrar')
+def migrar_comando():
+    """Cria as tabelas que faltam e aplica as migrações pendentes."""
+    db.create_all()
+    aplicadas = aplicar_migracoes()
+    if not aplicadas:
+        print("Banco de dados já está atualizado")
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        aplicar_migracoes()
         
         # Criar usuário professor automaticamente se não existir
         professor = User.query.filter_by(username='wabney_santos').first()
@@ -1074,4 +4282,6 @@ if __name__ == '__main__':
             db.session.commit()
             print("Usuário professor criado automaticamente")
     
-    socketio.run(app, host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    # Entregas que ficaram pendentes quando o servidor parou voltam para o pool
+    extrator_textos.solicitar()
+    socketio.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=False)
\ No newline at end of file
@@ -0,0 +1,1111 @@
+"""Benchmarks do Sistema de Digitação.
+
+Cada cenário cria um banco SQLite temporário, popula com dados sintéticos e
+mede as rotas reais da aplicação usando o cliente de testes do Flask e o
+cliente de testes do Socket.IO (tudo local, sem rede).
+
+Uso:
+    python benchmark.py ranking --usuarios 10000 --desempenhos 1000000
+    python benchmark.py turma --alunos 40 --saida resultado.json
+    python benchmark.py turma --comparar-com resultado_anterior.json
+    python benchmark.py download --tamanho-mb 20
+    python benchmark.py similaridade --documentos 10000
+    python benchmark.py busca --documentos 100000
+    python benchmark.py cadastro --usuarios 600
+    python benchmark.py servidor --clientes 100 --modos threading,eventlet:0,eventlet
+    python benchmark.py workers --workers 4 --clientes 40
+    python benchmark.py corrida --salas 10 --jogadores 50
+    python benchmark.py monitor --alunos 200 --professores 3
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+# O banco precisa ser definido antes de importar a aplicação
+_DIRETORIO = tempfile.mkdtemp(prefix='bench_digitacao_')
+_BANCO = os.path.join(_DIRETORIO, 'bench.sqlite')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + _BANCO)
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from app import (app, db, socketio, aplicar_migracoes, armazenamento, assinatura_minhash, bandas_lsh,  # noqa: E402
+                 buscar, corridas, importar_usuarios, metricas, monitor_turma, pares_similares, reconstruir_estatisticas,
+                 Arquivo, CorretorMensagens, FilaMensagensLocal, GameResult, MetricasFragmentadas, User,
+                 Desempenho)
+
+SENHA = 'senha123'
+PALAVRAS = ('casa teclado rápido texto aluno digitar escola frase prova tempo '
+            'livro mesa verde azul correr pular dedo tecla letra ponto').split()
+
+
+def popular_banco(usuarios, desempenhos, frases=0, equipes=0, trabalhos=0, entregas=0, lote=50000):
+    """Insere os dados sintéticos diretamente via sqlite3 (executemany)."""
+    with app.app_context():
+        db.create_all()
+        aplicar_migracoes()
+
+    gerador = random.Random(42)
+    senha = generate_password_hash(SENHA)
+    conexao = sqlite3.connect(_BANCO)
+    cursor = conexao.cursor()
+    cursor.executemany(
+        'INSERT INTO user (id, username, password, role) VALUES (?, ?, ?, ?)',
+        ((i, f'aluno{i}', senha, 'aluno') for i in range(1, usuarios + 1))
+    )
+    cursor.executemany(
+        'INSERT INTO aluno (user_id, ativo) VALUES (?, 1)',
+        ((i,) for i in range(1, usuarios + 1))
+    )
+
+    inicio = datetime(2024, 1, 1)
+    restantes = desempenhos
+    while restantes > 0:
+        quantidade = min(lote, restantes)
+        cursor.executemany(
+            'INSERT INTO desempenho (user_id, wpm, accuracy, difficulty, errors, date) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            ((gerador.randint(1, usuarios),
+              round(gerador.uniform(5, 120), 2),
+              round(gerador.uniform(50, 100), 2),
+              gerador.randint(1, 4),
+              gerador.randint(0, 20),
+              (inicio + timedelta(minutes=gerador.randint(0, 500000))).isoformat(' '))
+             for _ in range(quantidade))
+        )
+        restantes -= quantidade
+
+    cursor.executemany(
+        'INSERT INTO "frase_digitação" (texto, nivel_dificuldade, data_criacao) VALUES (?, ?, ?)',
+        ((' '.join(gerador.choice(PALAVRAS) for _ in range(gerador.randint(3, 16))) + f' {i}',
+          gerador.randint(1, 4),
+          inicio.isoformat(' '))
+         for i in range(frases))
+    )
+
+    # Equipes com os alunos distribuídos em ordem, cada uma com alguns trabalhos
+    if equipes:
+        cursor.executemany(
+            'INSERT INTO equipe (id, nome, data_criacao) VALUES (?, ?, ?)',
+            ((i, f'Equipe {i}', inicio.isoformat(' ')) for i in range(1, equipes + 1))
+        )
+        cursor.executemany(
+            'INSERT INTO equipe_membros (user_id, equipe_id) VALUES (?, ?)',
+            ((i, (i - 1) % equipes + 1) for i in range(1, usuarios + 1))
+        )
+    if trabalhos:
+        cursor.executemany(
+            'INSERT INTO trabalho (id, titulo, descricao, data_criacao, data_entrega) VALUES (?, ?, ?, ?, ?)',
+            ((i, f'Trabalho {i}', 'Descrição do trabalho', inicio.isoformat(' '),
+              (inicio + timedelta(days=30)).isoformat(' '))
+             for i in range(1, trabalhos + 1))
+        )
+        if equipes:
+            cursor.executemany(
+                'INSERT INTO equipe_trabalho (equipe_id, trabalho_id, data_atribuicao) VALUES (?, ?, ?)',
+                ((e, t, inicio.isoformat(' ')) for e in range(1, equipes + 1) for t in range(1, trabalhos + 1))
+            )
+    if entregas and equipes and trabalhos:
+        cursor.executemany(
+            'INSERT INTO entrega (trabalho_id, equipe_id, data_entrega, comentarios) VALUES (?, ?, ?, ?)',
+            ((gerador.randint(1, trabalhos), gerador.randint(1, equipes),
+              (inicio + timedelta(hours=gerador.randint(0, 700))).isoformat(' '), 'Entrega')
+             for _ in range(entregas))
+        )
+    conexao.commit()
+    conexao.close()
+    if desempenhos:
+        with app.app_context():
+            reconstruir_estatisticas()  # o ranking e o perfil leem o resumo UserStats
+
+
+def cliente_autenticado(user_id):
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['_user_id'] = str(user_id)
+        sessao['_fresh'] = True
+    return cliente
+
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    posicao = max(int(round(p / 100 * len(ordenados) + 0.5)) - 1, 0)
+    return ordenados[min(posicao, len(ordenados) - 1)]
+
+
+def resumir(tempos, duracao_total=None, erros=0):
+    ordenados = sorted(tempos)
+    resumo = {
+        'repeticoes': len(ordenados),
+        'erros': erros,
+        'p50_ms': round(percentil(ordenados, 50), 2),
+        'p95_ms': round(percentil(ordenados, 95), 2),
+        'p99_ms': round(percentil(ordenados, 99), 2),
+        'max_ms': round(ordenados[-1], 2) if ordenados else 0.0,
+        'media_ms': round(statistics.mean(ordenados), 2) if ordenados else 0.0,
+    }
+    if duracao_total:
+        resumo['por_segundo'] = round(len(ordenados) / duracao_total, 1)
+    return resumo
+
+
+def medir(funcao, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return resumir(tempos)
+
+
+def ranking_por_usuario():
+    """Implementação antiga (uma consulta por usuário), usada como referência."""
+    dados = []
+    for usuario in User.query.all():
+        melhor = Desempenho.query.filter_by(user_id=usuario.id)\
+                   .order_by(Desempenho.wpm.desc())\
+                   .first()
+        if melhor:
+            dados.append((usuario.username, melhor.wpm))
+    dados.sort(key=lambda x: x[1], reverse=True)
+    return dados
+
+
+def cenario_ranking(args):
+    popular_banco(args.usuarios, args.desempenhos)
+    cliente = cliente_autenticado(1)
+
+    def pagina(url):
+        def requisicao():
+            resposta = cliente.get(url)
+            assert resposta.status_code == 200, resposta.status_code
+        return requisicao
+
+    resultados = {
+        'usuarios': args.usuarios,
+        'desempenhos': args.desempenhos,
+        '/ranking': medir(pagina('/ranking'), args.repeticoes),
+        '/ranking?dificuldade=3': medir(pagina('/ranking?dificuldade=3'), args.repeticoes),
+        '/api/ranking?pagina=20': medir(pagina('/api/ranking?pagina=20'), args.repeticoes),
+    }
+    if args.comparar:
+        with app.app_context():
+            resultados['consulta_por_usuario'] = medir(ranking_por_usuario, 1)
+    return resultados
+
+
+class Medicoes:
+    """Latências por operação, coletadas por várias threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tempos = {}
+        self.erros = {}
+
+    def registrar(self, operacao, inicio, ok=True):
+        duracao = (time.perf_counter() - inicio) * 1000
+        with self._lock:
+            self.tempos.setdefault(operacao, []).append(duracao)
+            if not ok:
+                self.erros[operacao] = self.erros.get(operacao, 0) + 1
+
+
+def simular_aluno(numero, args, medicoes, barreira):
+    """Percorre o fluxo real de um aluno: login, jogo via Socket.IO, ranking e perfil."""
+    cliente = app.test_client()
+    barreira.wait()
+
+    inicio = time.perf_counter()
+    resposta = cliente.post('/login', data={'username': f'aluno{numero}', 'password': SENHA})
+    medicoes.registrar('POST /login', inicio, resposta.status_code == 302)
+
+    for _ in range(args.partidas):
+        inicio = time.perf_counter()
+        resposta = cliente.get('/jogo')
+        medicoes.registrar('GET /jogo', inicio, resposta.status_code == 200)
+
+        socket = socketio.test_client(app, flask_test_client=cliente)
+        socket.emit('start_game', {'difficulty': 1})
+        for nivel in range(1, args.frases_por_partida + 1):
+            inicio = time.perf_counter()
+            socket.emit('get_phrase', {'difficulty': (numero % 4) + 1, 'level': nivel})
+            recebido = socket.get_received()
+            medicoes.registrar('socket get_phrase', inicio,
+                               any(m['name'] == 'new_phrase' for m in recebido))
+
+        inicio = time.perf_counter()
+        socket.emit('save_game_results', {
+            'difficulty': (numero % 4) + 1,
+            'level': args.frases_por_partida,
+            'wpm': random.uniform(10, 90),
+            'accuracy': random.uniform(60, 100),
+            'errors': random.randint(0, 10),
+            'score': random.randint(0, 2000),
+            'time_played': 60
+        })
+        recebido = socket.get_received()
+        medicoes.registrar('socket save_game_results', inicio,
+                           any(m['name'] == 'results_saved' and m['args'][0].get('success')
+                               for m in recebido) or app.config['GRAVACAO_ADIADA'])
+        socket.disconnect()
+
+        for url in ('/ranking', '/perfil'):
+            inicio = time.perf_counter()
+            resposta = cliente.get(url)
+            medicoes.registrar(f'GET {url}', inicio, resposta.status_code == 200)
+
+
+def commit_atual():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def cenario_turma(args):
+    # Os alunos simulados jogam bem mais rápido que um aluno de verdade: sem o limite de eventos
+    app.config['LIMITE_EVENTOS'] = {}
+    popular_banco(args.usuarios, args.desempenhos, frases=args.frases, equipes=args.equipes,
+                  trabalhos=args.trabalhos, entregas=args.entregas)
+
+    medicoes = Medicoes()
+    barreira = threading.Barrier(args.alunos)
+    threads = [threading.Thread(target=simular_aluno, args=(numero, args, medicoes, barreira))
+               for numero in range(1, args.alunos + 1)]
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+
+    return {
+        'commit': commit_atual(),
+        'parametros': {chave: valor for chave, valor in vars(args).items()
+                       if chave not in ('cenario', 'saida', 'comparar_com')},
+        'duracao_s': round(duracao, 2),
+        'operacoes': {operacao: resumir(tempos, duracao, medicoes.erros.get(operacao, 0))
+                      for operacao, tempos in sorted(medicoes.tempos.items())},
+    }
+
+
+def cenario_download(args):
+    """Tempo do worker por download: envio direto, 304, Range e descarga para o proxy."""
+    popular_banco(1, 0)
+    armazenamento.pasta = os.path.join(_DIRETORIO, 'uploads')  # caminho absoluto: fora do projeto
+    gerador = random.Random(42)
+    conteudo = bytes(gerador.getrandbits(8) for _ in range(1024 * 1024)) * args.tamanho_mb
+    with app.app_context():
+        chave, tamanho = armazenamento.salvar(io.BytesIO(conteudo))
+        arquivo = Arquivo(filename='apostila.pdf', path=armazenamento.chave_relativa(chave),
+                          user_id=1, content_hash=chave, size=tamanho)
+        db.session.add(arquivo)
+        db.session.commit()
+        url = f'/download/{arquivo.id}'
+    cliente = cliente_autenticado(1)
+    etag = cliente.get(url).headers['ETag']
+
+    casos = {
+        'completo': (None, 200, {}),
+        'If-None-Match (304)': (None, 304, {'If-None-Match': etag}),
+        'Range 1 MB (206)': (None, 206, {'Range': 'bytes=0-1048575'}),
+        'x-sendfile': ('x-sendfile', 200, {}),
+        'x-accel': ('x-accel', 200, {}),
+    }
+    resultados = {'tamanho_bytes': len(conteudo), 'casos': {}}
+    try:
+        for nome, (modo, status, cabecalhos) in casos.items():
+            app.config['DOWNLOAD_DESCARGA'] = modo
+
+            def requisicao():
+                # buffered=True consome o corpo inteiro, como faria o servidor WSGI
+                resposta = cliente.get(url, headers=cabecalhos, buffered=True)
+                assert resposta.status_code == status, resposta.status_code
+                return len(resposta.get_data())
+
+            enviados = requisicao()
+            cpu = time.thread_time()
+            resumo = medir(requisicao, args.repeticoes)
+            resumo['cpu_ms_por_download'] = round((time.thread_time() - cpu) * 1000 / args.repeticoes, 2)
+            resumo['bytes_pela_aplicacao'] = enviados
+            resultados['casos'][nome] = resumo
+    finally:
+        app.config['DOWNLOAD_DESCARGA'] = None
+    return resultados
+
+
+def cenario_similaridade(args):
+    """Assinaturas MinHash de muitas entregas e busca de pares parecidos via LSH."""
+    popular_banco(args.equipes, 0, equipes=args.equipes, trabalhos=args.trabalhos, entregas=args.documentos)
+    gerador = random.Random(7)
+    vocabulario = [f'palavra{i}' for i in range(args.vocabulario)]
+    permutacoes = app.config['SIMILARIDADE_PERMUTACOES']
+    tamanho_shingle = app.config['SIMILARIDADE_SHINGLE']
+
+    # Uma fração dos textos é cópia de um anterior com algumas palavras trocadas
+    textos, copias = [], {}
+    for entrega_id in range(1, args.documentos + 1):
+        if textos and gerador.random() < args.copias:
+            original = gerador.randrange(len(textos))
+            palavras = textos[original].split()
+            for _ in range(int(len(palavras) * args.alteracao)):
+                palavras[gerador.randrange(len(palavras))] = gerador.choice(vocabulario)
+            copias[entrega_id] = original + 1
+        else:
+            palavras = gerador.choices(vocabulario, k=args.palavras)
+        textos.append(' '.join(palavras))
+
+    inicio = time.perf_counter()
+    assinaturas = [assinatura_minhash(texto, permutacoes, tamanho_shingle) for texto in textos]
+    duracao_assinaturas = time.perf_counter() - inicio
+
+    conexao = sqlite3.connect(_BANCO)
+    conexao.executemany(
+        'INSERT INTO texto_entrega (entrega_id, dados, caracteres, assinatura) VALUES (?, ?, ?, ?)',
+        ((i, zlib.compress(texto.encode()), len(texto), assinatura)
+         for i, (texto, assinatura) in enumerate(zip(textos, assinaturas), start=1))
+    )
+    conexao.executemany(
+        'INSERT INTO banda_similaridade (entrega_id, banda, valor) VALUES (?, ?, ?)',
+        ((i, banda, valor) for i, assinatura in enumerate(assinaturas, start=1)
+         for banda, valor in bandas_lsh(assinatura, app.config['SIMILARIDADE_BANDAS']))
+    )
+    conexao.commit()
+    equipes = dict(conexao.execute('SELECT id, equipe_id FROM entrega'))
+    conexao.close()
+
+    with app.app_context():
+        inicio = time.perf_counter()
+        todos = pares_similares()
+        duracao_global = time.perf_counter() - inicio
+        por_trabalho = medir(lambda: pares_similares(1), args.repeticoes)
+
+    encontrados = {tuple(sorted((par['entrega'].id, par['outra'].id))) for par in todos}
+    esperados = {tuple(sorted(par)) for par in copias.items() if equipes[par[0]] != equipes[par[1]]}
+    return {
+        'documentos': args.documentos,
+        'palavras_por_documento': args.palavras,
+        'assinatura_ms_por_documento': round(duracao_assinaturas * 1000 / args.documentos, 3),
+        'pares_possiveis': args.documentos * (args.documentos - 1) // 2,
+        'todos_os_pares_s': round(duracao_global, 3),
+        'pares_encontrados': len(todos),
+        'copias_plantadas': len(esperados),
+        'copias_encontradas': len(esperados & encontrados),
+        'pares_de_um_trabalho': por_trabalho,
+    }
+
+
+def cenario_busca(args):
+    """Latência da busca FTS5 com ~100 mil documentos: frases, trabalhos e entregas."""
+    popular_banco(args.equipes * 4, 0, equipes=args.equipes)
+    gerador = random.Random(11)
+    # Vocabulário com frequências desiguais (Zipf): há termos em quase todo
+    # documento e termos que aparecem em poucos
+    vocabulario = PALAVRAS + [f'termo{i}' for i in range(args.vocabulario)]
+    pesos = [1 / posicao for posicao in range(1, len(vocabulario) + 1)]
+
+    def texto(minimo, maximo):
+        return ' '.join(gerador.choices(vocabulario, pesos, k=gerador.randint(minimo, maximo)))
+
+    frases = args.documentos // 2
+    trabalhos = max(args.documentos // 20, 1)
+    entregas = args.documentos - frases - trabalhos
+    agora = datetime(2024, 1, 1).isoformat(' ')
+    professor_id = args.equipes * 4 + 1
+
+    inicio = time.perf_counter()
+    conexao = sqlite3.connect(_BANCO)
+    conexao.execute('INSERT INTO user (id, username, password, role) VALUES (?, ?, ?, ?)',
+                    (professor_id, 'professor', 'x', 'professor'))
+    conexao.executemany(
+        'INSERT INTO "frase_digitação" (texto, nivel_dificuldade, data_criacao) VALUES (?, ?, ?)',
+        ((texto(3, 16), gerador.randint(1, 4), agora) for _ in range(frases))
+    )
+    conexao.executemany(
+        'INSERT INTO trabalho (id, titulo, descricao, data_criacao) VALUES (?, ?, ?, ?)',
+        ((i, texto(2, 6), texto(20, 60), agora) for i in range(1, trabalhos + 1))
+    )
+    conexao.executemany(
+        'INSERT INTO equipe_trabalho (equipe_id, trabalho_id, data_atribuicao) VALUES (?, ?, ?)',
+        ((gerador.randint(1, args.equipes), t, agora) for t in range(1, trabalhos + 1))
+    )
+    conexao.executemany(
+        'INSERT INTO entrega (trabalho_id, equipe_id, data_entrega, comentarios, feedback) VALUES (?, ?, ?, ?, ?)',
+        ((gerador.randint(1, trabalhos), gerador.randint(1, args.equipes), agora, texto(5, 30), texto(0, 20))
+         for _ in range(entregas))
+    )
+    conexao.execute("INSERT INTO busca (busca) VALUES ('optimize')")
+    conexao.commit()
+    documentos = conexao.execute('SELECT count(*) FROM busca').fetchone()[0]
+    conexao.close()
+    duracao_indexacao = time.perf_counter() - inicio
+
+    # Termos sorteados pela mesma distribuição dos textos, mais os extremos
+    comuns = PALAVRAS[:5]
+    raros = vocabulario[-200:]
+    consultas = {
+        'termo_comum': lambda: gerador.choice(comuns),
+        'termo_raro': lambda: gerador.choice(raros),
+        'termo_sorteado': lambda: gerador.choices(vocabulario, pesos)[0],
+        'prefixo': lambda: gerador.choices(vocabulario, pesos)[0][:3],
+        'duas_palavras': lambda: ' '.join(gerador.choices(vocabulario, pesos, k=2)),
+    }
+
+    resultados = {'documentos': documentos, 'indexacao_s': round(duracao_indexacao, 2)}
+    with app.test_request_context():
+        professor = db.session.get(User, professor_id)
+        aluno = db.session.get(User, 1)
+        for nome, termo in consultas.items():
+            resultados[f'professor {nome}'] = medir(lambda: buscar(termo(), professor), args.repeticoes)
+        for nome in ('termo_comum', 'termo_sorteado'):
+            termo = consultas[nome]
+            resultados[f'aluno {nome}'] = medir(lambda: buscar(termo(), aluno), args.repeticoes)
+        db.session.remove()
+
+    cliente = cliente_autenticado(professor_id)
+
+    def api():
+        resposta = cliente.get('/api/buscar', query_string={'q': consultas['termo_sorteado']()})
+        assert resposta.status_code == 200, resposta.status_code
+    resultados['GET /api/buscar'] = medir(api, args.repeticoes)
+    return resultados
+
+
+def cenario_cadastro(args):
+    """Contas por minuto: importação em lote por CSV contra o formulário de cadastro."""
+    popular_banco(0, 0)
+    with app.app_context():
+        db.session.add(User(username='professor', password=generate_password_hash(SENHA), role='professor'))
+        db.session.commit()
+        professor_id = User.query.filter_by(username='professor').first().id
+    cliente = cliente_autenticado(professor_id)
+
+    inicio = time.perf_counter()
+    for i in range(args.formulario):
+        resposta = cliente.post('/cadastro', data={'username': f'form{i}', 'password': SENHA, 'role': 'aluno'})
+        assert resposta.status_code == 200, resposta.status_code
+    duracao_formulario = time.perf_counter() - inicio
+
+    linhas = ['username,password,role'] + [f'lote{i},{SENHA}{i},aluno' for i in range(args.usuarios)]
+    inicio = time.perf_counter()
+    with app.app_context():
+        resultado = list(importar_usuarios(io.StringIO('\n'.join(linhas)), processos=args.processos))
+    duracao_lote = time.perf_counter() - inicio
+    erros = sum(1 for _, _, erro in resultado if erro)
+
+    return {
+        'processos': args.processos or app.config['IMPORTACAO_PROCESSOS'],
+        'formulario': {'contas': args.formulario, 'duracao_s': round(duracao_formulario, 2),
+                       'contas_por_minuto': round(args.formulario / duracao_formulario * 60)},
+        'importacao_csv': {'contas': args.usuarios - erros, 'erros': erros, 'duracao_s': round(duracao_lote, 2),
+                           'contas_por_minuto': round((args.usuarios - erros) / duracao_lote * 60)},
+    }
+
+
+# Servidor real do cenário 'servidor', num processo separado para que o modo
+# assíncrono (monkey patch) valha desde o primeiro import
+SERVIDOR = """
+import sys
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import MODO_ASSINCRONO, app, socketio
+
+if MODO_ASSINCRONO == 'eventlet':
+    import eventlet.patcher
+    dormir = eventlet.patcher.original('time').sleep
+elif MODO_ASSINCRONO == 'gevent':
+    from gevent import monkey
+    dormir = monkey.get_original('time', 'sleep')
+else:
+    import time
+    dormir = time.sleep
+atraso = float(sys.argv[2]) / 1000
+
+@event.listens_for(Engine, 'commit')
+def commit_lento(conexao):
+    # Disco lento: o commit bloqueia a thread sem devolver o controle ao loop de eventos
+    dormir(atraso)
+
+socketio.run(app, host='127.0.0.1', port=int(sys.argv[1]), log_output=False)
+"""
+
+
+def porta_livre():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def iniciar_servidor(modo, atraso_commit_ms, **variaveis):
+    """Sobe o servidor; ``modo`` é 'threading', 'eventlet' ou 'gevent', com ':N' opcional para BANCO_THREADS."""
+    porta = porta_livre()
+    diretorio = os.path.dirname(os.path.abspath(__file__))
+    modo, _, threads = modo.partition(':')
+    # Os clientes simulados jogam bem mais rápido que um aluno: sem o limite de eventos
+    ambiente = dict(os.environ, SOCKETIO_ASYNC_MODE=modo, PYTHONPATH=diretorio, LIMITE_EVENTOS='0',
+                    **variaveis)
+    if threads:
+        ambiente['BANCO_THREADS'] = threads
+    processo = subprocess.Popen([sys.executable, '-c', SERVIDOR, str(porta), str(atraso_commit_ms)],
+                                cwd=diretorio, env=ambiente,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    prazo = time.monotonic() + 30
+    while time.monotonic() < prazo:
+        if processo.poll() is not None:
+            raise RuntimeError(f'o servidor no modo {modo} terminou ao iniciar (código {processo.returncode})')
+        try:
+            socket.create_connection(('127.0.0.1', porta), timeout=1).close()
+            return processo, f'http://127.0.0.1:{porta}'
+        except OSError:
+            time.sleep(0.2)
+    processo.kill()
+    raise RuntimeError(f'o servidor no modo {modo} não respondeu')
+
+
+def simular_digitador(numero, url, args, medicoes, barreira):
+    """Um aluno conectado ao servidor real: pede frases e grava a partida, com pausas entre eventos."""
+    from socketio import Client
+
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'_user_id': str(numero), '_fresh': True})
+    cliente = Client(reconnection=False)
+    respostas = {nome: threading.Event() for nome in ('new_phrase', 'results_saved')}
+    for nome, evento in respostas.items():
+        cliente.on(nome, lambda *_, evento=evento: evento.set())
+
+    inicio = time.perf_counter()
+    try:
+        cliente.connect(url, headers={'Cookie': f"{app.config['SESSION_COOKIE_NAME']}={cookie}"}, wait_timeout=args.timeout)
+        medicoes.registrar('connect', inicio)
+    except Exception:
+        medicoes.registrar('connect', inicio, ok=False)
+        barreira.abort()
+        return
+
+    def evento(nome, dados, resposta):
+        respostas[resposta].clear()
+        inicio = time.perf_counter()
+        cliente.emit(nome, dados)
+        medicoes.registrar(f'socket {nome}', inicio, respostas[resposta].wait(args.timeout))
+
+    try:
+        barreira.wait()
+        prazo = time.monotonic() + args.duracao
+        cliente.emit('start_game', {'difficulty': 1})
+        while time.monotonic() < prazo:
+            for nivel in range(1, args.frases_por_partida + 1):
+                evento('get_phrase', {'difficulty': (numero % 4) + 1, 'level': nivel}, 'new_phrase')
+                time.sleep(args.pausa_ms / 1000)
+            evento('save_game_results', {
+                'difficulty': (numero % 4) + 1, 'level': args.frases_por_partida,
+                'wpm': random.uniform(10, 90), 'accuracy': random.uniform(60, 100),
+                'errors': random.randint(0, 10), 'score': random.randint(0, 2000), 'time_played': 60
+            }, 'results_saved')
+    except threading.BrokenBarrierError:
+        pass
+    finally:
+        cliente.disconnect()
+
+
+def cenario_servidor(args):
+    """Conexões simultâneas e latência dos eventos num servidor real, por modo assíncrono.
+
+    Cada modo sobe o app num processo próprio (threading, eventlet ou gevent) e
+    recebe ``--clientes`` alunos jogando ao mesmo tempo; ``--atraso-commit-ms``
+    simula um disco lento travando a thread a cada commit. 'eventlet:0' roda
+    sem o pool de threads do banco, para comparar com o acesso bloqueante.
+    """
+    popular_banco(args.clientes, 0, frases=args.frases)
+    resultados = {'clientes': args.clientes, 'atraso_commit_ms': args.atraso_commit_ms, 'modos': {}}
+    for modo in args.modos.split(','):
+        try:
+            processo, url = iniciar_servidor(modo, args.atraso_commit_ms)
+        except RuntimeError as e:
+            resultados['modos'][modo] = {'erro': str(e)}
+            continue
+
+        medicoes = Medicoes()
+        barreira = threading.Barrier(args.clientes + 1)
+        threads = [threading.Thread(target=simular_digitador, args=(numero, url, args, medicoes, barreira),
+                                    daemon=True)
+                   for numero in range(1, args.clientes + 1)]
+        try:
+            for thread in threads:
+                thread.start()
+            try:
+                barreira.wait(timeout=args.timeout * 3)
+            except threading.BrokenBarrierError:
+                pass
+            inicio = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            duracao = time.perf_counter() - inicio
+        finally:
+            processo.terminate()
+            processo.wait()
+
+        conexoes = medicoes.tempos.get('connect', [])
+        resultados['modos'][modo] = {
+            'conectados': len(conexoes) - medicoes.erros.get('connect', 0),
+            'duracao_s': round(duracao, 2),
+            'operacoes': {operacao: resumir(tempos, duracao, medicoes.erros.get(operacao, 0))
+                          for operacao, tempos in sorted(medicoes.tempos.items())},
+        }
+    return resultados
+
+
+def verificar_cliente(numero, url, args, medicoes, sids, conectados, avisados):
+    """Cliente preso a um worker: confere as respostas do jogo e os avisos vindos pela fila."""
+    from socketio import Client
+
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'_user_id': str(numero), '_fresh': True})
+    cliente = Client(reconnection=False)
+    respostas = {nome: threading.Event() for nome in ('new_phrase', 'results_saved', 'aviso', 'aviso_geral')}
+    for nome in ('new_phrase', 'results_saved', 'aviso_geral'):
+        cliente.on(nome, lambda *_, evento=respostas[nome]: evento.set())
+    # O aviso individual precisa chegar ao cliente certo
+    cliente.on('aviso', lambda dados: dados.get('numero') == numero and respostas['aviso'].set())
+
+    inicio = time.perf_counter()
+    try:
+        cliente.connect(url, headers={'Cookie': f"{app.config['SESSION_COOKIE_NAME']}={cookie}"},
+                        wait_timeout=args.timeout)
+        medicoes.registrar('connect', inicio)
+        sids[numero] = cliente.get_sid()
+    except Exception:
+        medicoes.registrar('connect', inicio, ok=False)
+    try:
+        conectados.wait()
+        for _ in range(args.rodadas if numero in sids else 0):
+            for nome, dados, resposta in (
+                    ('get_phrase', {'difficulty': (numero % 4) + 1, 'level': 1}, 'new_phrase'),
+                    ('save_game_results', {'difficulty': (numero % 4) + 1, 'level': 1, 'wpm': 40,
+                                           'accuracy': 90, 'errors': 1, 'score': 100, 'time_played': 30},
+                     'results_saved')):
+                respostas[resposta].clear()
+                inicio = time.perf_counter()
+                cliente.emit(nome, dados)
+                medicoes.registrar(f'socket {nome}', inicio, respostas[resposta].wait(args.timeout))
+    except Exception:
+        medicoes.registrar('jogo', time.perf_counter(), ok=False)
+    try:
+        # Todos (mesmo quem falhou) passam por aqui, senão o emissor ficaria esperando
+        avisados.wait()
+        inicio = time.perf_counter()
+        for nome in ('aviso', 'aviso_geral'):
+            if numero in sids:
+                medicoes.registrar(nome, inicio, respostas[nome].wait(args.timeout))
+    except threading.BrokenBarrierError:
+        pass
+    finally:
+        cliente.disconnect()
+
+
+def cenario_workers(args):
+    """Vários workers ligados pela fila de mensagens: todo cliente recebe as suas respostas?
+
+    Sobe o broker embutido (ou usa ``--fila``, por exemplo redis://) e
+    ``--workers`` processos. Os clientes são distribuídos entre eles e ficam
+    presos ao seu worker, como faria o balanceador com sessões fixas. Com a
+    fila, até a resposta ao próprio cliente passa pelo broker. Depois do jogo,
+    um processo de fora manda um aviso ao sid de cada cliente e outro a todos.
+    """
+    popular_banco(args.clientes, 0, frases=args.frases)
+    corretor = None
+    url_fila = args.fila
+    if not url_fila:
+        corretor = CorretorMensagens('127.0.0.1', 0)
+        host, porta = corretor.escutar()
+        threading.Thread(target=corretor.executar, daemon=True).start()
+        url_fila = f'local://{host}:{porta}'
+    if url_fila.startswith('local://'):
+        emissor = FilaMensagensLocal(url_fila, write_only=True)
+    else:
+        from flask_socketio import SocketIO
+        emissor = SocketIO(message_queue=url_fila)
+
+    processos, urls = [], []
+    medicoes = Medicoes()
+    sids = {}
+    try:
+        for _ in range(args.workers):
+            processo, url = iniciar_servidor(args.modo, 0, SOCKETIO_MESSAGE_QUEUE=url_fila,
+                                             WORKERS=str(args.workers))
+            processos.append(processo)
+            urls.append(url)
+
+        conectados = threading.Barrier(args.clientes + 1)
+        avisados = threading.Barrier(args.clientes + 1)
+        threads = [threading.Thread(target=verificar_cliente, daemon=True,
+                                    args=(numero, urls[numero % len(urls)], args, medicoes, sids,
+                                          conectados, avisados))
+                   for numero in range(1, args.clientes + 1)]
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        conectados.wait(timeout=args.timeout * 3)
+        avisados.wait()  # todos terminaram as rodadas
+        for numero, sid in sids.items():
+            emissor.emit('aviso', {'numero': numero}, room=sid)
+        emissor.emit('aviso_geral', {'texto': 'Fim da aula'})
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+    finally:
+        for processo in processos:
+            processo.terminate()
+            processo.wait()
+        if corretor is not None:
+            corretor.encerrar()
+
+    operacoes = {operacao: resumir(tempos, duracao, medicoes.erros.get(operacao, 0))
+                 for operacao, tempos in sorted(medicoes.tempos.items())}
+    return {
+        'workers': args.workers,
+        'fila': url_fila,
+        'clientes': args.clientes,
+        'conectados': len(sids),
+        'operacoes': operacoes,
+        'todos_receberam': len(sids) == args.clientes and not any(medicoes.erros.values()),
+    }
+
+
+def correr_sala(numero_sala, args, medicoes, contagem, barreira):
+    """Uma sala: o primeiro jogador cria, os outros entram, e todos digitam até o fim."""
+    primeiro = numero_sala * args.jogadores + 1
+    sockets = [socketio.test_client(app, flask_test_client=cliente_autenticado(user_id))
+               for user_id in range(primeiro, primeiro + args.jogadores)]
+    sockets[0].emit('race_create', {'difficulty': 1})
+    recebido = sockets[0].get_received()
+    entrada = next(m['args'][0] for m in recebido if m['name'] == 'race_joined')
+    for socket in sockets[1:]:
+        socket.emit('race_join', {'sala': entrada['sala']})
+    barreira.wait()
+
+    sockets[0].emit('race_start', {'sala': entrada['sala']})
+    frases = next(m['args'][0]['frases'] for m in sockets[0].get_received() if m['name'] == 'race_started')
+    gerador = random.Random(numero_sala)
+    # Cada jogador envia o progresso a cada `--caracteres-por-envio` caracteres,
+    # em rodadas de `--intervalo-ms`, até concluir todas as frases.
+    posicoes = [[0, 0] for _ in sockets]  # [frase, digitados]
+    enviados = 0
+    while any(frase < len(frases) for frase, _ in posicoes):
+        inicio_rodada = time.perf_counter()
+        for socket, posicao in zip(sockets, posicoes):
+            frase, digitados = posicao
+            if frase >= len(frases):
+                continue
+            digitados = min(digitados + gerador.randint(1, args.caracteres_por_envio), len(frases[frase]))
+            dados = {'frase': frase, 'digitados': digitados, 'erros': 0}
+            if digitados == len(frases[frase]):
+                dados['texto'] = frases[frase]
+                posicao[:] = [frase + 1, 0]
+            else:
+                posicao[1] = digitados
+            inicio = time.perf_counter()
+            socket.emit('race_progress', dados)
+            medicoes.registrar('socket race_progress', inicio)
+            enviados += 1
+        time.sleep(max(args.intervalo_ms / 1000 - (time.perf_counter() - inicio_rodada), 0))
+
+    prazo = time.monotonic() + args.timeout
+    finais = {}
+    snapshots = 0
+    while len(finais) < len(sockets) and time.monotonic() < prazo:
+        for indice, socket in enumerate(sockets):
+            for mensagem in socket.get_received():
+                if mensagem['name'] == 'race_snapshot':
+                    snapshots += 1
+                elif mensagem['name'] == 'race_finished':
+                    finais[indice] = mensagem['args'][0]['classificacao']
+        time.sleep(0.05)
+    for socket in sockets:
+        socket.disconnect()
+    contagem.append({'sala': entrada['sala'], 'enviados': enviados, 'snapshots': snapshots,
+                     'terminaram': len(finais), 'classificados': len(next(iter(finais.values()), []))})
+
+
+def cenario_corrida(args):
+    """Salas de corrida cheias: custo do tick e mensagens poupadas pelos snapshots.
+
+    Compara as mensagens de fato entregues (um snapshot por sala e por tick,
+    para cada jogador) com o que custaria repassar cada evento de progresso a
+    todos os colegas da sala, e confere que a classificação foi gravada.
+    """
+    # Os alunos simulados jogam bem mais rápido que um aluno de verdade: sem o limite de eventos
+    app.config['LIMITE_EVENTOS'] = {}
+    popular_banco(args.salas * args.jogadores, 0, frases=args.frases)
+    app.config['CORRIDA_CONTAGEM'] = 0
+    corridas.tick = args.tick
+    corridas.max_jogadores = max(corridas.max_jogadores, args.jogadores)
+
+    medicoes = Medicoes()
+    contagem = []
+    barreira = threading.Barrier(args.salas)
+    threads = [threading.Thread(target=correr_sala, args=(numero, args, medicoes, contagem, barreira))
+               for numero in range(args.salas)]
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+
+    # A gravação da classificação roda em segundo plano depois do race_finished
+    prazo = time.monotonic() + args.timeout
+    with app.app_context():
+        gravados = 0
+        while time.monotonic() < prazo:
+            gravados = GameResult.query.filter(GameResult.posicao.isnot(None)).count()
+            if gravados >= args.salas * args.jogadores:
+                break
+            db.session.remove()
+            time.sleep(0.2)
+
+    serie = metricas.agregado().get(('digitacao_race_tick_duration_seconds', ()), [])
+    ticks = sum(serie[:-1]) if serie else 0
+    acumulado, p95 = 0, None
+    for limite, quantidade in zip(MetricasFragmentadas.LIMITES + (float('inf'),), serie[:-1]):
+        acumulado += quantidade
+        if p95 is None and acumulado >= 0.95 * ticks:
+            p95 = limite
+    enviados = sum(sala['enviados'] for sala in contagem)
+    snapshots = sum(sala['snapshots'] for sala in contagem)
+    return {
+        'salas': args.salas,
+        'jogadores_por_sala': args.jogadores,
+        'duracao_s': round(duracao, 2),
+        'race_progress': resumir(medicoes.tempos.get('socket race_progress', []), duracao),
+        'tick': {
+            'intervalo_ms': args.tick * 1000,
+            'ticks': ticks,
+            'media_ms': round(serie[-1] / ticks * 1000, 3) if ticks else 0.0,
+            'p95_ate_ms': p95 * 1000 if p95 not in (None, float('inf')) else p95,
+        },
+        'mensagens': {
+            'progresso_recebido': enviados,
+            'snapshots_entregues': snapshots,
+            'repasse_por_evento': enviados * args.jogadores,
+        },
+        'terminaram': sum(sala['terminaram'] for sala in contagem),
+        'resultados_gravados': gravados,
+        'todos_gravados': gravados == args.salas * args.jogadores,
+    }
+
+
+def cenario_monitor(args):
+    """Alunos mandando telemetria e professores no monitor: eventos recebidos contra quadros enviados."""
+    # Os alunos simulados jogam bem mais rápido que um aluno de verdade: sem o limite de eventos
+    app.config['LIMITE_EVENTOS'] = {}
+    popular_banco(args.alunos + args.professores, 0)
+    with app.app_context():
+        User.query.filter(User.id > args.alunos).update({'role': 'professor'})
+        db.session.commit()
+    monitor_turma.intervalo = args.intervalo
+
+    professores = [socketio.test_client(app, flask_test_client=cliente_autenticado(args.alunos + numero))
+                   for numero in range(1, args.professores + 1)]
+    for professor in professores:
+        professor.emit('monitor_subscribe')
+        professor.get_received()
+    alunos = [socketio.test_client(app, flask_test_client=cliente_autenticado(user_id))
+              for user_id in range(1, args.alunos + 1)]
+    for aluno in alunos:
+        aluno.emit('start_game', {'difficulty': 2})
+
+    medicoes = Medicoes()
+    gerador = random.Random(42)
+    eventos = 0
+    inicio = time.perf_counter()
+    while time.perf_counter() - inicio < args.duracao:
+        inicio_rodada = time.perf_counter()
+        for aluno in alunos:
+            if gerador.random() < 0.5:  # metade dos alunos digitou algo nesta rodada
+                continue
+            momento = time.perf_counter()
+            aluno.emit('game_progress', {'level': gerador.randint(1, 20), 'wpm': gerador.uniform(10, 90),
+                                         'accuracy': gerador.uniform(60, 100), 'errors': gerador.randint(0, 9),
+                                         'score': gerador.randint(0, 5000)})
+            medicoes.registrar('socket game_progress', momento)
+            eventos += 1
+        time.sleep(max(args.intervalo_ms / 1000 - (time.perf_counter() - inicio_rodada), 0))
+    for aluno in alunos[:args.alunos // 2]:
+        aluno.disconnect()
+    time.sleep(args.intervalo * 2)
+    duracao = time.perf_counter() - inicio
+
+    quadros, linhas, tamanho, visiveis = 0, 0, 0, {}
+    for mensagem in professores[0].get_received():
+        if mensagem['name'] != 'monitor_delta':
+            continue
+        quadro = mensagem['args'][0]
+        quadros += 1
+        linhas += len(quadro['alunos'])
+        tamanho += len(json.dumps(quadro, separators=(',', ':')))
+        for linha in quadro['alunos']:
+            visiveis[linha[0]] = linha
+        for user_id in quadro['removidos']:
+            visiveis.pop(user_id, None)
+    for socket in alunos[args.alunos // 2:] + professores:
+        socket.disconnect()
+    return {
+        'alunos': args.alunos,
+        'professores': args.professores,
+        'duracao_s': round(duracao, 2),
+        'game_progress': resumir(medicoes.tempos.get('socket game_progress', []), duracao),
+        'quadros_por_professor': quadros,
+        'linhas_enviadas': linhas,
+        'bytes_por_professor': tamanho,
+        'repasse_por_evento': eventos,
+        'alunos_no_monitor': len(visiveis),
+        'desconectados_removidos': len(visiveis) == args.alunos - args.alunos // 2,
+    }
+
+
+def comparar(atual, anterior):
+    """Diferença percentual de p95 por operação entre duas execuções do cenário turma."""
+    linhas = []
+    for operacao, dados in atual.get('operacoes', {}).items():
+        antes = anterior.get('operacoes', {}).get(operacao)
+        if not antes or not antes['p95_ms']:
+            continue
+        variacao = (dados['p95_ms'] - antes['p95_ms']) / antes['p95_ms'] * 100
+        linhas.append(f'{operacao:32} p95 {antes["p95_ms"]:9.2f} -> {dados["p95_ms"]:9.2f} ms ({variacao:+.1f}%)')
+    return '\n'.join(linhas)
+
+
+CENARIOS = {
+    'ranking': cenario_ranking,
+    'turma': cenario_turma,
+    'download': cenario_download,
+    'similaridade': cenario_similaridade,
+    'busca': cenario_busca,
+    'cadastro': cenario_cadastro,
+    'servidor': cenario_servidor,
+    'workers': cenario_workers,
+    'corrida': cenario_corrida,
+    'monitor': cenario_monitor,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='cenario', required=True)
+
+    ranking = subparsers.add_parser('ranking', help='latência do ranking com muitos desempenhos')
+    ranking.add_argument('--usuarios', type=int, default=10000)
+    ranking.add_argument('--desempenhos', type=int, default=1000000)
+    ranking.add_argument('--repeticoes', type=int, default=5)
+    ranking.add_argument('--comparar', action='store_true',
+                         help='também mede a implementação antiga, quando existir')
+
+    turma = subparsers.add_parser('turma', help='alunos simultâneos percorrendo o fluxo completo')
+    turma.add_argument('--alunos', type=int, default=40, help='alunos simulados em paralelo')
+    turma.add_argument('--partidas', type=int, default=2, help='partidas por aluno')
+    turma.add_argument('--frases-por-partida', type=int, default=15)
+    turma.add_argument('--usuarios', type=int, default=600)
+    turma.add_argument('--desempenhos', type=int, default=50000)
+    turma.add_argument('--frases', type=int, default=2000)
+    turma.add_argument('--equipes', type=int, default=150)
+    turma.add_argument('--trabalhos', type=int, default=5)
+    turma.add_argument('--entregas', type=int, default=1500)
+    turma.add_argument('--comparar-com', help='JSON de uma execução anterior para comparar o p95')
+
+    download = subparsers.add_parser('download', help='tempo do worker por download de arquivo grande')
+    download.add_argument('--tamanho-mb', type=int, default=20)
+    download.add_argument('--repeticoes', type=int, default=20)
+
+    similaridade = subparsers.add_parser('similaridade', help='MinHash/LSH para encontrar entregas parecidas')
+    similaridade.add_argument('--documentos', type=int, default=10000)
+    similaridade.add_argument('--palavras', type=int, default=300, help='palavras por texto')
+    similaridade.add_argument('--vocabulario', type=int, default=5000)
+    similaridade.add_argument('--copias', type=float, default=0.02, help='fração de textos copiados de outro')
+    similaridade.add_argument('--alteracao', type=float, default=0.05, help='fração de palavras trocadas na cópia')
+    similaridade.add_argument('--equipes', type=int, default=500)
+    similaridade.add_argument('--trabalhos', type=int, default=50)
+    similaridade.add_argument('--repeticoes', type=int, default=20)
+
+    busca = subparsers.add_parser('busca', help='latência da busca FTS5 com muitos documentos')
+    busca.add_argument('--documentos', type=int, default=100000, help='frases, trabalhos e entregas indexados')
+    busca.add_argument('--vocabulario', type=int, default=20000)
+    busca.add_argument('--equipes', type=int, default=200)
+    busca.add_argument('--repeticoes', type=int, default=200)
+
+    cadastro = subparsers.add_parser('cadastro', help='importação de usuários por CSV com hash em paralelo')
+    cadastro.add_argument('--usuarios', type=int, default=600)
+    cadastro.add_argument('--formulario', type=int, default=50, help='contas criadas pelo formulário, para comparar')
+    cadastro.add_argument('--processos', type=int, help='processos para o hash (padrão: IMPORTACAO_PROCESSOS)')
+
+    servidor = subparsers.add_parser('servidor', help='conexões simultâneas e latência por modo assíncrono '
+                                                      '(requer python-socketio[client])')
+    servidor.add_argument('--clientes', type=int, default=100, help='alunos conectados ao mesmo tempo')
+    servidor.add_argument('--modos', default='threading,eventlet:0,eventlet',
+                          help="modos do servidor, separados por vírgula ('eventlet:0' = sem pool de threads)")
+    servidor.add_argument('--duracao', type=float, default=20, help='segundos de jogo por modo')
+    servidor.add_argument('--frases-por-partida', type=int, default=10)
+    servidor.add_argument('--pausa-ms', type=float, default=500, help='tempo digitando entre uma frase e outra')
+    servidor.add_argument('--atraso-commit-ms', type=float, default=20)
+    servidor.add_argument('--frases', type=int, default=2000)
+    servidor.add_argument('--timeout', type=float, default=10, help='segundos esperando cada resposta')
+
+    workers = subparsers.add_parser('workers', help='vários workers ligados pela fila de mensagens '
+                                                    '(requer python-socketio[client])')
+    workers.add_argument('--workers', type=int, default=4)
+    workers.add_argument('--clientes', type=int, default=40)
+    workers.add_argument('--rodadas', type=int, default=5, help='get_phrase + save_game_results por cliente')
+    workers.add_argument('--fila', help='URL da fila (redis://...); padrão: broker embutido')
+    workers.add_argument('--modo', default='threading', help='modo assíncrono dos workers')
+    workers.add_argument('--frases', type=int, default=2000)
+    workers.add_argument('--timeout', type=float, default=10, help='segundos esperando cada resposta')
+
+    corrida = subparsers.add_parser('corrida', help='salas de corrida cheias: tick e snapshots de progresso')
+    corrida.add_argument('--salas', type=int, default=10)
+    corrida.add_argument('--jogadores', type=int, default=50, help='jogadores por sala')
+    corrida.add_argument('--intervalo-ms', type=float, default=100, help='intervalo entre envios de cada jogador')
+    corrida.add_argument('--caracteres-por-envio', type=int, default=3, help='máximo de caracteres por envio')
+    corrida.add_argument('--tick', type=float, default=0.2, help='segundos entre snapshots')
+    corrida.add_argument('--frases', type=int, default=2000)
+    corrida.add_argument('--timeout', type=float, default=30, help='segundos esperando o fim e a gravação')
+
+    monitor = subparsers.add_parser('monitor', help='telemetria dos alunos agregada para o monitor dos professores')
+    monitor.add_argument('--alunos', type=int, default=200)
+    monitor.add_argument('--professores', type=int, default=3)
+    monitor.add_argument('--duracao', type=float, default=10, help='segundos de jogo')
+    monitor.add_argument('--intervalo-ms', type=float, default=200, help='intervalo entre rodadas de envio')
+    monitor.add_argument('--intervalo', type=float, default=1.0, help='segundos entre quadros do monitor')
+
+    for subparser in (ranking, turma, download, similaridade, busca, cadastro, servidor, workers, corrida, monitor):
+        subparser.add_argument('--saida', help='grava o resultado em JSON neste arquivo')
+    args = parser.parse_args(argv)
+
+    try:
+        resultados = CENARIOS[args.cenario](args)
+    finally:
+        shutil.rmtree(_DIRETORIO, ignore_errors=True)
+    texto = json.dumps(resultados, indent=2, ensure_ascii=False)
+    print(texto)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(texto)
+    if getattr(args, 'comparar_com', None):
+        with open(args.comparar_com, encoding='utf-8') as arquivo:
+            print(comparar(resultados, json.load(arquivo)))
+    return 1 if False in (resultados.get('todos_receberam'), resultados.get('todos_gravados')) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
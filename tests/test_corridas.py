@@ -0,0 +1,57 @@
+"""Corridas com vários workers: as salas vivem na memória de um só, então os eventos são recusados.
+
+Com SOCKETIO_MESSAGE_QUEUE definida e WORKERS maior que 1, todo evento race_*
+recebe race_error e nenhuma sala é criada; com um worker só, a corrida funciona.
+"""
+import os
+import tempfile
+
+import pytest
+
+# O banco precisa ser definido antes de importar a aplicação
+_DIRETORIO = tempfile.mkdtemp(prefix='teste_digitacao_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_DIRETORIO, 'teste.sqlite')
+
+from app import app, db, aplicar_migracoes, corridas, socketio, User  # noqa: E402
+
+JOGADOR = 201
+
+
+@pytest.fixture
+def cliente_socket():
+    anterior = {chave: app.config[chave] for chave in ('LIMITE_EVENTOS', 'SOCKETIO_MESSAGE_QUEUE', 'WORKERS')}
+    app.config.update(TESTING=True, LIMITE_EVENTOS={})
+    with app.app_context():
+        db.create_all()
+        aplicar_migracoes()
+        if db.session.get(User, JOGADOR) is None:
+            db.session.add(User(id=JOGADOR, username=f'corredor{JOGADOR}', password='x', role='aluno'))
+            db.session.commit()
+
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['_user_id'] = str(JOGADOR)
+        sessao['_fresh'] = True
+    socket = socketio.test_client(app, flask_test_client=cliente)
+    yield socket
+    socket.disconnect()
+    app.config.update(TESTING=False, **anterior)
+
+
+def eventos(socket, nome):
+    return [mensagem['args'][0] for mensagem in socket.get_received() if mensagem['name'] == nome]
+
+
+def test_varios_workers_recusam_corridas(cliente_socket):
+    app.config.update(SOCKETIO_MESSAGE_QUEUE='local://127.0.0.1:5600', WORKERS=4)
+    abertas = len(corridas.abertas())
+    cliente_socket.emit('race_create', {'difficulty': 1})
+    assert eventos(cliente_socket, 'race_error')
+    assert len(corridas.abertas()) == abertas
+
+
+def test_um_worker_cria_a_sala(cliente_socket):
+    app.config.update(SOCKETIO_MESSAGE_QUEUE='local://127.0.0.1:5600', WORKERS=1)
+    cliente_socket.emit('race_create', {'difficulty': 1})
+    assert eventos(cliente_socket, 'race_joined')
+    cliente_socket.emit('race_leave')
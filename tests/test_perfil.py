@@ -0,0 +1,80 @@
+"""Regressão de N+1: o /perfil e o /api/perfil precisam caber no orçamento de SQL.
+
+Liga o monitor de SQL com falha ao estourar o orçamento (SQL_ORCAMENTOS) e
+confere o cabeçalho X-SQL-Consultas com poucas e com muitas equipes,
+trabalhos e entregas: o número de comandos não pode crescer com os dados.
+"""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+# O banco precisa ser definido antes de importar a aplicação
+_DIRETORIO = tempfile.mkdtemp(prefix='teste_digitacao_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_DIRETORIO, 'teste.sqlite')
+
+from app import (app, db, aplicar_migracoes, invalidar_painel, Entrega, Equipe,  # noqa: E402
+                 Trabalho, User)
+
+ALUNO = 1
+
+
+@pytest.fixture(scope='module')
+def cliente():
+    app.config.update(TESTING=True, SQL_MONITOR=True, SQL_FALHAR_ACIMA_DO_ORCAMENTO=True)
+    if not os.path.isdir(os.path.join(app.root_path, app.template_folder)):
+        app.template_folder = '.'  # checkout com os templates na raiz
+    with app.app_context():
+        db.create_all()
+        aplicar_migracoes()
+        db.session.add(User(id=ALUNO, username='aluno1', password='x', role='aluno'))
+        db.session.commit()
+
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['_user_id'] = str(ALUNO)
+        sessao['_fresh'] = True
+    cliente.get('/api/perfil')  # o user_loader guarda o usuário; as medições ficam comparáveis
+    yield cliente
+    app.config.update(TESTING=False, SQL_MONITOR=False, SQL_FALHAR_ACIMA_DO_ORCAMENTO=False)
+
+
+def adicionar_equipes(quantidade, trabalhos_por_equipe):
+    """Equipes do aluno com colegas, trabalhos atribuídos e uma entrega por trabalho."""
+    with app.app_context():
+        aluno = db.session.get(User, ALUNO)
+        inicio = datetime(2024, 1, 1)
+        for _ in range(quantidade):
+            colegas = [User(username=f'colega{User.query.count() + i}', password='x', role='aluno')
+                       for i in range(3)]
+            equipe = Equipe(nome='Equipe')
+            equipe.equipe_membros.extend([aluno] + colegas)
+            for numero in range(trabalhos_por_equipe):
+                trabalho = Trabalho(titulo=f'Trabalho {numero}', descricao='Descrição',
+                                    data_entrega=inicio + timedelta(days=30))
+                equipe.trabalhos.append(trabalho)
+                db.session.add(Entrega(trabalho=trabalho, equipe=equipe, data_entrega=inicio, nota=8.0))
+            db.session.add(equipe)
+        db.session.commit()
+    invalidar_painel()
+
+
+def consultas(cliente, url):
+    resposta = cliente.get(url)
+    assert resposta.status_code == 200, resposta.status_code
+    return int(resposta.headers['X-SQL-Consultas'])
+
+
+@pytest.mark.parametrize('url, endpoint', [('/perfil', 'perfil'), ('/api/perfil', 'api_perfil')])
+def test_perfil_dentro_do_orcamento(cliente, url, endpoint):
+    orcamento = app.config['SQL_ORCAMENTOS'][endpoint]
+
+    adicionar_equipes(1, 1)
+    poucos = consultas(cliente, url)
+    assert poucos <= orcamento
+
+    adicionar_equipes(5, 4)
+    muitos = consultas(cliente, url)
+    assert muitos <= orcamento
+    assert muitos == poucos
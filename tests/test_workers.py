@@ -0,0 +1,142 @@
+"""Vários workers ligados pelo broker embutido: as respostas chegam ao cliente certo?
+
+Sobe o broker (CorretorMensagens) e WORKERS processos com
+SOCKETIO_MESSAGE_QUEUE=local://..., conecta um jogador em cada worker e confere
+que ``new_phrase`` e ``results_saved`` chegam a todos. Com a fila, até a
+resposta ao próprio cliente passa pelo broker, então um worker que não a
+entrega (ou que a entrega no cliente de outro worker) faz o teste falhar.
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+# O cliente do Socket.IO faz o long-polling com o requests
+pytest.importorskip('requests')
+
+# O banco precisa ser definido antes de importar a aplicação
+_DIRETORIO = tempfile.mkdtemp(prefix='teste_digitacao_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_DIRETORIO, 'teste.sqlite')
+
+from socketio import Client  # noqa: E402
+
+from app import (app, db, aplicar_migracoes, CorretorMensagens, FraseDigitação,  # noqa: E402
+                 User)
+
+WORKERS = 4
+PRIMEIRO_JOGADOR = 101
+ESPERA = 15  # segundos por resposta
+
+SERVIDOR = """
+import sys
+from app import app, socketio
+
+socketio.run(app, host='127.0.0.1', port=int(sys.argv[1]), log_output=False)
+"""
+
+
+def porta_livre():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def iniciar_worker(url_fila):
+    porta = porta_livre()
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # O banco é o que a aplicação deste processo já abriu (outro módulo de teste pode tê-lo definido)
+    ambiente = dict(os.environ, SOCKETIO_ASYNC_MODE='threading', PYTHONPATH=raiz, LIMITE_EVENTOS='0',
+                    DATABASE_URL=app.config['SQLALCHEMY_DATABASE_URI'], SOCKETIO_MESSAGE_QUEUE=url_fila,
+                    WORKERS=str(WORKERS))
+    processo = subprocess.Popen([sys.executable, '-c', SERVIDOR, str(porta)], cwd=raiz, env=ambiente,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    prazo = time.monotonic() + 30
+    while time.monotonic() < prazo:
+        if processo.poll() is not None:
+            raise RuntimeError(f'o worker terminou ao iniciar (código {processo.returncode})')
+        try:
+            socket.create_connection(('127.0.0.1', porta), timeout=1).close()
+            return processo, f'http://127.0.0.1:{porta}'
+        except OSError:
+            time.sleep(0.2)
+    processo.kill()
+    raise RuntimeError('o worker não respondeu')
+
+
+@pytest.fixture(scope='module')
+def workers():
+    with app.app_context():
+        db.create_all()
+        aplicar_migracoes()
+        for numero in range(PRIMEIRO_JOGADOR, PRIMEIRO_JOGADOR + WORKERS):
+            db.session.add(User(id=numero, username=f'jogador{numero}', password='x', role='aluno'))
+        for dificuldade in range(1, 5):
+            db.session.add(FraseDigitação(texto=f'frase de teste do nível {dificuldade}',
+                                           nivel_dificuldade=dificuldade))
+        db.session.commit()
+
+    corretor = CorretorMensagens('127.0.0.1', 0)
+    host, porta = corretor.escutar()
+    threading.Thread(target=corretor.executar, daemon=True).start()
+    processos, urls = [], []
+    try:
+        for _ in range(WORKERS):
+            processo, url = iniciar_worker(f'local://{host}:{porta}')
+            processos.append(processo)
+            urls.append(url)
+        yield urls
+    finally:
+        for processo in processos:
+            processo.terminate()
+            processo.wait()
+        corretor.encerrar()
+
+
+def conectar(numero, url, respostas):
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'_user_id': str(numero), '_fresh': True})
+    cliente = Client(reconnection=False)
+    for nome in ('new_phrase', 'results_saved'):
+        cliente.on(nome, lambda dados, nome=nome: respostas.setdefault(nome, []).append(dados))
+    cliente.connect(url, headers={'Cookie': f"{app.config['SESSION_COOKIE_NAME']}={cookie}"},
+                    wait_timeout=ESPERA)
+    return cliente
+
+
+def esperar(respostas, nome):
+    prazo = time.monotonic() + ESPERA
+    while nome not in respostas and time.monotonic() < prazo:
+        time.sleep(0.05)
+    return respostas[nome][0] if nome in respostas else None
+
+
+def test_respostas_chegam_aos_clientes_de_cada_worker(workers):
+    # Um jogador em cada worker, todos conectados antes de o primeiro jogar
+    respostas = {numero: {} for numero in range(PRIMEIRO_JOGADOR, PRIMEIRO_JOGADOR + WORKERS)}
+    clientes = {numero: conectar(numero, url, respostas[numero])
+                for numero, url in zip(respostas, workers)}
+    try:
+        for numero, cliente in clientes.items():
+            dificuldade = numero % 4 + 1
+            cliente.emit('get_phrase', {'difficulty': dificuldade, 'level': 1})
+            frase = esperar(respostas[numero], 'new_phrase')
+            assert frase is not None, f'new_phrase não chegou ao jogador {numero}'
+            assert frase['phrase'] == f'frase de teste do nível {dificuldade}'
+
+            cliente.emit('save_game_results', {'difficulty': dificuldade, 'level': 1, 'wpm': 40,
+                                               'accuracy': 90, 'errors': 1, 'score': 100,
+                                               'time_played': 30})
+            salvo = esperar(respostas[numero], 'results_saved')
+            assert salvo is not None, f'results_saved não chegou ao jogador {numero}'
+            assert salvo['success']
+
+        # Cada resposta chegou uma vez, só ao jogador que a pediu
+        time.sleep(0.5)
+        assert all(len(recebidas) == 1 for jogador in respostas.values() for recebidas in jogador.values())
+    finally:
+        for cliente in clientes.values():
+            cliente.disconnect()